@@ -0,0 +1,135 @@
+# chatbot/answer_cache.py
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+
+class _Partition:
+    """Cached answers of one (model, language) pair with their inner-product index."""
+
+    def __init__(self, dim: int):
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self.entries = OrderedDict()  # id -> entry dict; order is least -> most recently used
+
+    def remove(self, entry_id: int):
+        self.entries.pop(entry_id, None)
+        self.index.remove_ids(np.array([entry_id], dtype="int64"))
+
+
+class SemanticAnswerCache:
+    """
+    Reuse answers of near-duplicate first questions.
+    Questions are compared by cosine similarity of their embeddings; a match above
+    `threshold` returns the stored answer instead of running the model.
+    Entries expire after `ttl` seconds and each partition keeps at most `max_entries`.
+    """
+
+    def __init__(self, threshold: float = 0.92, max_entries: int = 1024, ttl: float = 7 * 24 * 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._partitions = {}  # (model, language) -> _Partition
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(emb) -> np.ndarray:
+        """L2-normalized float32 row vector, so inner product equals cosine similarity."""
+        vec = np.array(emb, dtype="float32").reshape(1, -1)
+        faiss.normalize_L2(vec)
+        return vec
+
+    def lookup(self, emb, model: str, language: str):
+        """Return the cached answer for a similar question, or None."""
+        vec = self._unit(emb)
+        with self._lock:
+            part = self._partitions.get((model, language))
+            if part is None or not part.entries:
+                self.misses += 1
+                return None
+
+            D, I = part.index.search(vec, 1)
+            entry_id, score = int(I[0][0]), float(D[0][0])
+            entry = part.entries.get(entry_id)
+            if entry is None or score < self.threshold:
+                self.misses += 1
+                return None
+
+            # Expired entries are dropped on access
+            if self.ttl and time.time() - entry["created"] > self.ttl:
+                part.remove(entry_id)
+                self.misses += 1
+                return None
+
+            part.entries.move_to_end(entry_id)
+            self.hits += 1
+            return entry["answer"]
+
+    def store(self, emb, question: str, answer: str, model: str, language: str, created: float = None):
+        """Add a (question, answer) pair to the cache."""
+        if not answer:
+            return
+        vec = self._unit(emb)
+        with self._lock:
+            part = self._partitions.get((model, language))
+            if part is None:
+                part = self._partitions[(model, language)] = _Partition(vec.shape[1])
+
+            entry_id = self._next_id
+            self._next_id += 1
+            part.index.add_with_ids(vec, np.array([entry_id], dtype="int64"))
+            part.entries[entry_id] = {
+                "question": question,
+                "answer": answer,
+                "model": model,
+                "language": language,
+                "created": time.time() if created is None else created,
+                "vector": vec[0],
+            }
+
+            # Drop least recently used entries beyond the partition limit
+            while len(part.entries) > self.max_entries:
+                part.remove(next(iter(part.entries)))
+
+    def export(self, path: str):
+        """Write all live entries to a JSON file for a warm start elsewhere."""
+        with self._lock:
+            entries = [
+                dict(entry, vector=entry["vector"].tolist())
+                for part in self._partitions.values()
+                for entry in part.entries.values()
+            ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "entries": entries}, f, ensure_ascii=False)
+
+    def load(self, path: str) -> int:
+        """Import entries written by export(); expired ones are skipped. Returns the count loaded."""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        now = time.time()
+        loaded = 0
+        for entry in data.get("entries", []):
+            if self.ttl and now - entry["created"] > self.ttl:
+                continue
+            self.store(entry["vector"], entry["question"], entry["answer"],
+                       entry["model"], entry["language"], created=entry["created"])
+            loaded += 1
+        return loaded
+
+    def stats(self) -> dict:
+        """Hit/miss counters and entries per (model, language) partition."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": {f"{m}/{l}": len(p.entries) for (m, l), p in self._partitions.items()},
+        }
@@ -0,0 +1,183 @@
+# chatbot/autotune.py
+
+import json
+import os
+import platform
+import socket
+import time
+
+import llama_cpp
+import xxhash
+from llama_cpp import Llama
+
+from chatbot.model_info import inspect_model
+
+# Tuned profiles live outside the repo: they describe this machine, not the project
+PROFILE_DIR = os.environ.get(
+    "CHATBOT_PROFILE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "therapy-chatbot", "profiles"))
+
+# Request shape the profile is optimized for (RAG prompt + a typical answer)
+TYPICAL_PROMPT_TOKENS = 1024
+TYPICAL_ANSWER_TOKENS = 150
+
+# Bytes hashed from each end of the model file
+_HASH_SPAN = 8 * 1024 * 1024
+
+
+def host_id() -> str:
+    """Hostname plus CPU description, so a profile is not reused on different hardware."""
+    cpu = platform.processor() or platform.machine()
+    return f"{socket.gethostname()}|{cpu}|{os.cpu_count()}"
+
+
+def model_hash(model_path: str) -> str:
+    """
+    xxhash of the file size and its first and last 8 MB. GGUF headers and
+    quantized tensors differ between files well within that span, and it avoids
+    reading several GB on every start.
+    """
+    size = os.path.getsize(model_path)
+    h = xxhash.xxh3_64()
+    h.update(str(size).encode())
+    with open(model_path, "rb") as f:
+        h.update(f.read(_HASH_SPAN))
+        if size > 2 * _HASH_SPAN:
+            f.seek(size - _HASH_SPAN)
+            h.update(f.read(_HASH_SPAN))
+    return h.hexdigest()
+
+
+def profile_path(model_path: str) -> str:
+    host = xxhash.xxh3_64_hexdigest(host_id().encode("utf-8"))
+    return os.path.join(PROFILE_DIR, f"{host}-{model_hash(model_path)}.json")
+
+
+def load_profile(model_path: str):
+    """Tuned runtime settings of this model on this host, or None."""
+    try:
+        path = profile_path(model_path)
+    except OSError:
+        return None
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_profile(model_path: str, profile: dict) -> str:
+    path = profile_path(model_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    return path
+
+
+def default_thread_grid() -> list:
+    """1, 2, 4, ... up to the core count, plus the physical-core guess (half of logical)."""
+    cores = os.cpu_count() or 1
+    grid = {cores, max(1, cores // 2)}
+    n = 1
+    while n < cores:
+        grid.add(n)
+        n *= 2
+    return sorted(grid)
+
+
+def default_gpu_layer_grid(model_path: str) -> list:
+    """No offload to full offload in quarters; [0] when llama.cpp was built without GPU support."""
+    if not llama_cpp.llama_supports_gpu_offload():
+        return [0]
+    # The layer count is in the GGUF header; no need to load the weights for it
+    n_layers = inspect_model(model_path).n_layer
+    return sorted({0, n_layers // 4, n_layers // 2, 3 * n_layers // 4, n_layers})
+
+
+def _bench_tokens(llm, n: int) -> list:
+    """A prompt of n real tokens, built by repeating a short sentence."""
+    base = llm.tokenize("The patient described feeling anxious and tired during the week. ".encode(),
+                        add_bos=False)
+    return (base * (n // len(base) + 1))[:n]
+
+
+def measure(llm, n_threads: int, prompt_tokens: int, decode_tokens: int) -> dict:
+    """Prefill and decode speed (tokens/s) of a loaded model with the given thread count."""
+    llama_cpp.llama_set_n_threads(llm.ctx, n_threads, n_threads)
+    tokens = _bench_tokens(llm, prompt_tokens + decode_tokens)
+
+    llm.reset()
+    start = time.perf_counter()
+    llm.eval(tokens[:prompt_tokens])
+    prefill = time.perf_counter() - start
+
+    # Decode one token at a time, as generation does
+    start = time.perf_counter()
+    for token in tokens[prompt_tokens:]:
+        llm.eval([token])
+    decode = time.perf_counter() - start
+    llm.reset()
+    return {"prefill_tok_s": prompt_tokens / prefill, "decode_tok_s": decode_tokens / decode}
+
+
+def request_seconds(prefill_tok_s: float, decode_tok_s: float) -> float:
+    """Estimated latency of a typical request; the value the tuner minimizes."""
+    return TYPICAL_PROMPT_TOKENS / prefill_tok_s + TYPICAL_ANSWER_TOKENS / decode_tok_s
+
+
+def autotune(model_path: str, n_ctx: int = 2048, threads=None, batches=None, gpu_layers=None,
+             prompt_tokens: int = 512, decode_tokens: int = 32, log=print) -> dict:
+    """
+    Benchmark a model over a grid of thread counts, batch sizes and GPU offload values.
+
+    Thread counts are switched on a loaded context; prefill (n_threads_batch) and
+    decode (n_threads) keep their own best value. Batch size and offload need a new
+    context/model and are the outer loops; offload values that fail to load are skipped.
+    Returns the best profile (lowest estimated latency of a typical request).
+    """
+    threads = threads or default_thread_grid()
+    batches = batches or [128, 256, 512]
+    gpu_layers = gpu_layers or default_gpu_layer_grid(model_path)
+
+    results = []
+    for n_gpu_layers in gpu_layers:
+        for n_batch in batches:
+            try:
+                llm = Llama(model_path=model_path, n_ctx=max(n_ctx, prompt_tokens + decode_tokens),
+                            n_batch=n_batch, n_ubatch=n_batch, n_gpu_layers=n_gpu_layers,
+                            verbose=False)
+            except (ValueError, RuntimeError) as e:
+                log(f"  n_gpu_layers={n_gpu_layers} n_batch={n_batch}: load failed ({e})")
+                continue
+            for n_threads in threads:
+                speed = measure(llm, n_threads, prompt_tokens, decode_tokens)
+                row = {"n_gpu_layers": n_gpu_layers, "n_batch": n_batch, "n_threads": n_threads, **speed}
+                results.append(row)
+                log(f"  gpu={n_gpu_layers:<3} batch={n_batch:<4} threads={n_threads:<3} "
+                    f"prefill {speed['prefill_tok_s']:8.1f} tok/s  decode {speed['decode_tok_s']:6.1f} tok/s")
+            del llm
+
+    if not results:
+        raise RuntimeError(f"Autotune could not load {model_path} with any setting")
+
+    # Best offload/batch pair, then the best decode and prefill thread counts within it
+    def pair_seconds(pair):
+        rows = [r for r in results if (r["n_gpu_layers"], r["n_batch"]) == pair]
+        return request_seconds(max(r["prefill_tok_s"] for r in rows), max(r["decode_tok_s"] for r in rows))
+
+    best_gpu, best_batch = min({(r["n_gpu_layers"], r["n_batch"]) for r in results}, key=pair_seconds)
+    rows = [r for r in results if (r["n_gpu_layers"], r["n_batch"]) == (best_gpu, best_batch)]
+    best_decode = max(rows, key=lambda r: r["decode_tok_s"])
+    best_prefill = max(rows, key=lambda r: r["prefill_tok_s"])
+
+    return {
+        "host": host_id(),
+        "model": os.path.basename(model_path),
+        "model_hash": model_hash(model_path),
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "n_gpu_layers": best_gpu,
+        "n_batch": best_batch,
+        "n_threads": best_decode["n_threads"],
+        "n_threads_batch": best_prefill["n_threads"],
+        "prefill_tok_s": best_prefill["prefill_tok_s"],
+        "decode_tok_s": best_decode["decode_tok_s"],
+        "results": results,
+    }
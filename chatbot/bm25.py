@@ -0,0 +1,240 @@
+# chatbot/bm25.py
+
+import heapq
+import itertools
+import json
+import math
+import os
+import re
+from array import array
+
+import numpy as np
+
+from chatbot.retrieval_cache import normalize_query
+
+BM25_VERSION = 1
+
+# Very frequent words that carry no retrieval signal
+STOPWORDS = {
+    # Persian
+    "و", "در", "به", "از", "که", "این", "را", "با", "است", "برای", "آن", "یک", "خود", "تا",
+    "بر", "هم", "نیز", "ها", "های", "می", "شود", "شده", "بود", "کرد", "کند", "باید", "یا",
+    "اما", "اگر", "هر", "چه", "ما", "من", "تو", "او", "شما", "آنها", "هست", "نه", "دارد",
+    # English
+    "the", "a", "an", "and", "or", "of", "to", "in", "on", "for", "is", "are", "was", "be",
+    "it", "that", "this", "with", "as", "at", "by", "i", "you", "my", "me", "do", "have",
+}
+
+_WORDS = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list:
+    """Persian-aware word tokens: normalized letters, no ZWNJ splits, no stopwords."""
+    return [t for t in _WORDS.findall(normalize_query(text)) if len(t) > 1 and t not in STOPWORDS]
+
+
+class BM25Builder:
+    """
+    Build an inverted index one document at a time; document ids follow the FAISS ids.
+
+    Postings are held in memory up to `max_postings`, then written out as a sorted
+    run next to the index (<prefix>.run<N>.*.tmp). save() merges the runs term by
+    term into the final files, so memory stays bounded by one run whatever the
+    corpus size.
+    """
+
+    def __init__(self, prefix: str, max_postings: int = 4_000_000):
+        """
+        Parameters:
+            prefix (str): Path prefix of the index files
+            max_postings (int): Postings kept in memory before they are spilled to a run
+        """
+        self.prefix = prefix
+        self.max_postings = max_postings
+        self._postings = {}  # term -> (array of doc ids, array of term frequencies)
+        self._n_postings = 0
+        self._doc_len = array("I")  # Lengths of the documents since the last spill
+        self._n_docs = 0
+        self._skipped = 0
+        self._runs = 0
+        os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+        # Document lengths of spilled runs, in doc id order
+        self._doc_len_file = open(prefix + ".doclen.tmp", "wb")
+
+    def add(self, text: str):
+        doc_id = self._n_docs
+        tokens = tokenize(text)
+        self._doc_len.append(len(tokens))
+        self._n_docs += 1
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for term, tf in counts.items():
+            docs, tfs = self._postings.setdefault(term, (array("I"), array("H")))
+            docs.append(doc_id)
+            tfs.append(min(tf, 65535))
+        self._n_postings += len(counts)
+        if self._n_postings >= self.max_postings:
+            self._spill()
+
+    def skip(self):
+        """Reserve a document id without a document (e.g. a chunk removed from the corpus)."""
+        self._doc_len.append(0)
+        self._n_docs += 1
+        self._skipped += 1
+
+    def _run_path(self, run: int, part: str) -> str:
+        return f"{self.prefix}.run{run}.{part}.tmp"
+
+    def _spill(self):
+        """Write the postings in memory as the next sorted run and start a new one."""
+        self._doc_len.tofile(self._doc_len_file)
+        self._doc_len = array("I")
+        if not self._postings:
+            return
+        terms = sorted(self._postings)
+        counts = array("I", (len(self._postings[term][0]) for term in terms))
+        with open(self._run_path(self._runs, "docs"), "wb") as docs, \
+                open(self._run_path(self._runs, "tfs"), "wb") as tfs:
+            for term in terms:
+                d, t = self._postings[term]
+                d.tofile(docs)
+                t.tofile(tfs)
+        with open(self._run_path(self._runs, "counts"), "wb") as f:
+            counts.tofile(f)
+        with open(self._run_path(self._runs, "vocab"), "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        self._runs += 1
+        self._postings = {}
+        self._n_postings = 0
+
+    def _open_runs(self) -> list:
+        """(terms, offsets, doc ids, term frequencies) of every run, the arrays memory-mapped."""
+        runs = []
+        for run in range(self._runs):
+            with open(self._run_path(run, "vocab"), encoding="utf-8") as f:
+                terms = json.load(f)
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            np.cumsum(np.fromfile(self._run_path(run, "counts"), dtype=np.uint32), out=offsets[1:])
+            docs = np.memmap(self._run_path(run, "docs"), dtype=np.uint32, mode="r")
+            tfs = np.memmap(self._run_path(run, "tfs"), dtype=np.uint16, mode="r")
+            runs.append((terms, offsets, docs, tfs))
+        return runs
+
+    def _merge(self) -> tuple:
+        """Write the postings of all runs, term by term, as .docs.npy / .tfs.npy; returns (terms, offsets)."""
+        runs = self._open_runs()
+        total = sum(int(offsets[-1]) for _, offsets, _, _ in runs)
+        terms = []
+        offsets = array("q")  # Start of each term's postings, then the end of the last
+        position = 0
+        if not total:
+            np.save(self.prefix + ".docs.npy", np.zeros(0, dtype=np.uint32))
+            np.save(self.prefix + ".tfs.npy", np.zeros(0, dtype=np.uint16))
+            offsets.append(0)
+            return terms, offsets
+
+        docs = np.lib.format.open_memmap(self.prefix + ".docs.npy", mode="w+", dtype=np.uint32, shape=(total,))
+        tfs = np.lib.format.open_memmap(self.prefix + ".tfs.npy", mode="w+", dtype=np.uint16, shape=(total,))
+        # Runs hold increasing doc ids, so a term's postings stay sorted when its
+        # pieces are copied in run order (heapq.merge breaks ties by run index)
+        merged = heapq.merge(*(zip(run_terms, itertools.repeat(run), itertools.count())
+                               for run, (run_terms, _, _, _) in enumerate(runs)))
+        for term, run, i in merged:
+            if not terms or terms[-1] != term:
+                terms.append(term)
+                offsets.append(position)
+            _, run_offsets, run_docs, run_tfs = runs[run]
+            start, end = run_offsets[i], run_offsets[i + 1]
+            docs[position:position + end - start] = run_docs[start:end]
+            tfs[position:position + end - start] = run_tfs[start:end]
+            position += end - start
+        offsets.append(position)
+        docs.flush()
+        tfs.flush()
+        return terms, offsets
+
+    def save(self, k1: float = 1.5, b: float = 0.75):
+        """Merge the runs into vocabulary, postings and document lengths as memory-mappable files."""
+        self._spill()
+        self._doc_len_file.close()
+        terms, offsets = self._merge()
+
+        doc_len = np.fromfile(self.prefix + ".doclen.tmp", dtype=np.uint32)
+        n_docs = len(doc_len) - self._skipped
+        np.save(self.prefix + ".offsets.npy", np.frombuffer(offsets, dtype=np.int64))
+        np.save(self.prefix + ".doclen.npy", doc_len)
+        with open(self.prefix + ".vocab.json", "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        with open(self.prefix + ".json", "w", encoding="utf-8") as f:
+            json.dump({
+                "version": BM25_VERSION,
+                "n_docs": n_docs,
+                "avgdl": float(doc_len.sum()) / n_docs if n_docs else 0.0,
+                "k1": k1,
+                "b": b,
+            }, f)
+        self._remove_runs()
+
+    def _remove_runs(self):
+        for run in range(self._runs):
+            for part in ("vocab", "counts", "docs", "tfs"):
+                os.remove(self._run_path(run, part))
+        os.remove(self.prefix + ".doclen.tmp")
+        self._runs = 0
+
+
+class BM25Index:
+    """Read-only BM25 index written by BM25Builder."""
+
+    def __init__(self, prefix: str):
+        with open(prefix + ".json", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != BM25_VERSION:
+            raise ValueError(f"Unsupported BM25 index version: {manifest.get('version')}")
+        self.n_docs = manifest["n_docs"]
+        self.avgdl = manifest["avgdl"] or 1.0
+        self.k1 = manifest["k1"]
+        self.b = manifest["b"]
+
+        with open(prefix + ".vocab.json", encoding="utf-8") as f:
+            self.vocab = {term: i for i, term in enumerate(json.load(f))}
+        self.docs = np.load(prefix + ".docs.npy", mmap_mode="r")
+        self.tfs = np.load(prefix + ".tfs.npy", mmap_mode="r")
+        self.offsets = np.load(prefix + ".offsets.npy", mmap_mode="r")
+        self.doc_len = np.load(prefix + ".doclen.npy", mmap_mode="r")
+
+    @staticmethod
+    def exists(prefix: str) -> bool:
+        return os.path.exists(prefix + ".json")
+
+    def search(self, query: str, top_k: int) -> list:
+        """Return up to top_k (doc id, score) pairs, best first."""
+        scores = {}
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            docs = self.docs[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[docs] / self.avgdl)
+            term_scores = idf * tf * (self.k1 + 1) / (tf + norm)
+            for doc, score in zip(docs.tolist(), term_scores.tolist()):
+                scores[doc] = scores.get(doc, 0.0) + score
+
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(rankings, top_k: int, k: int = 60) -> list:
+    """
+    Merge several ranked id lists: score(id) = sum over lists of 1 / (k + rank).
+    Returns the top_k ids, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return [doc_id for doc_id, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]]
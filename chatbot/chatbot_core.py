@@ -4,12 +4,32 @@
 import json
 import faiss
 import numpy as np
+import llama_cpp
 from llama_cpp import Llama
 from sentence_transformers import SentenceTransformer
 import sys
 import os
+import threading
+import time
 from langdetect import detect
 from utils.printer import print_success, print_system
+from chatbot.model_pool import ModelPool
+from chatbot.prefix_cache import PrefixStateCache
+from chatbot.sessions import SessionStore
+from chatbot.conversation_store import ConversationStore
+from chatbot.history_summary import HistorySummarizer
+from chatbot.prompt_packer import PromptPacker, TokenCounter
+from chatbot.retrieval_cache import RetrievalCache
+from chatbot.answer_cache import SemanticAnswerCache
+from chatbot.startup import StartupLoader
+from chatbot.chunk_store import ChunkStore, read_faiss_index
+from chatbot.bm25 import BM25Index, reciprocal_rank_fusion
+from chatbot.autotune import load_profile
+from chatbot.metrics import Metrics
+from chatbot.llama_server import LlamaServerModel
+from chatbot.model_info import available_memory, ggml_type, inspect_model, kv_cache_options
+from chatbot.speculative import PromptLookupDraft, speculative_options
+from chatbot.vector_store import VectorStore, is_exact_index, vector_store_path
 
 # --- Add current directory to Python path ---
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -17,38 +37,42 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 # --- RTL (right-to-left) Persian text reshaping ---
 import arabic_reshaper
 from bidi.algorithm import get_display
-import torch.cuda as cuda
 
-def estimate_max_gpu_layers(model_size: str, vram_gb: float) -> int:
+def estimate_max_gpu_layers(model_path: str, vram_gb: float, n_ctx: int = 4096) -> int:
     """
-    Estimate the maximum number of GPU layers based on model size and available VRAM.
-    
+    Estimate the maximum number of GPU layers from the model's GGUF header and available VRAM.
+
     Parameters:
-        model_size (str): Model size (e.g., "7B", "8B")
+        model_path (str): Path to the GGUF model file
         vram_gb (float): Available VRAM in GB
+        n_ctx (int): Context length whose KV cache must fit next to the weights
 
     Returns:
-        int: Recommended n_gpu_layers value
+        int: Recommended n_gpu_layers value (block count + 1 offloads the output layer too)
     """
-    # Estimated memory consumption per layer in GB (Q4_K_M quantization)
-    MEMORY_PER_LAYER_GB = {
-        "7B": 0.16,   # ~160MB per layer for 7B models
-        "8B": 0.18,   # ~180MB per layer for 8B models
-    }
-
-    if model_size not in MEMORY_PER_LAYER_GB:
-        raise ValueError(f"Unsupported model size: {model_size}. Use '7B' or '8B'.")
+    info = inspect_model(model_path)
+    return info.fit(n_ctx, info.n_layer + 1, int(vram_gb * 2**30), float("inf"))[1]
 
-    layer_memory = MEMORY_PER_LAYER_GB[model_size]
-    max_layers = int(vram_gb * 1024 / (layer_memory * 1024))  # convert GB to MB
+class TherapyChatbot:
+    # Model used for each question language when per-request routing is on
+    LANGUAGE_ROUTES = {"fa": "dorna", "en": "zephyr"}
 
-    # Limit to a reasonable range
-    return min(max(max_layers, 0), 32)
+    # Session used when callers (e.g. the terminal REPL) do not pass one
+    DEFAULT_SESSION = "default"
 
-class TherapyChatbot:
     def __init__(self, model_paths: dict, faiss_index_path_fa: str, faiss_meta_path_fa: str,
                 embed_model: str = "all-MiniLM-L6-v2", n_ctx: int = 4096,
-                n_gpu_layers: int = 28, n_threads: int = 6):
+                n_gpu_layers: int = 28, n_threads: int = 6,
+                model_ram_budget_gb: float = None, route_by_language: bool = False,
+                prefix_cache_mb: int = 1024, max_sessions: int = 256,
+                session_idle_ttl: float = 1800, query_cache_dir: str = None,
+                answer_cache: bool = False, answer_cache_threshold: float = 0.92,
+                faiss_search_params: str = None, rescore_factor: int = 4,
+                speculative: dict = None, use_tuned_profiles: bool = True,
+                kv_cache: dict = None, llm_class=None, metrics: bool = False,
+                trace_path: str = None, backend: str = "llama_cpp", server_slots: int = 4,
+                conversation_db: str = None, history_summary_tokens: int = 768,
+                summary_max_tokens: int = 160):
         """Initialize the Therapist Chatbot with multiple LLaMA models and retriever."""
         self.model_paths = model_paths
         self.active_model = list(model_paths.keys())[0]
@@ -56,69 +80,350 @@ class TherapyChatbot:
         self.n_ctx = n_ctx
         self.n_gpu_layers = n_gpu_layers
         self.n_threads = n_threads
-        self.model = self.load_model(self.model_paths[self.active_model])
-        self.embedder = SentenceTransformer(embed_model)
-
-            # Load FAISS index and metadata for Persian
-        self.index_fa = faiss.read_index(faiss_index_path_fa)
-        with open(faiss_meta_path_fa, encoding="utf-8") as f:
-            self.meta_fa = json.load(f)
-
-        # --- Attempt to load the English version of FAISS index and metadata, if available ---
+        # Llama-compatible class the models are loaded with (benchmarks pass a fake one)
+        self.llm_class = llm_class or Llama
+        # "llama_cpp" runs the models in this process, one generation per model at a time;
+        # "llama_server" spawns a llama-server per model that decodes server_slots
+        # requests together (continuous batching)
+        if backend not in ("llama_cpp", "llama_server"):
+            raise ValueError(f"Unknown inference backend: {backend}")
+        self.backend = backend
+        self.slots_per_model = server_slots if backend == "llama_server" else 1
+        self.route_by_language = route_by_language
+        # Settings measured by scripts/autotune.py for this host replace the values above
+        self.use_tuned_profiles = use_tuned_profiles
+        self.runtime_profiles = {}  # model path -> runtime settings the model was loaded with
+        # e.g. "nprobe=32" or "efSearch=128"; None keeps the values saved by build_faiss.py
+        self.faiss_search_params = faiss_search_params
+        # Candidates per result re-scored exactly when the index stores compressed vectors
+        self.rescore_factor = rescore_factor
+
+        # Per-model caches of saved KV states for shared prompt prefixes (0 disables)
+        self.prefix_cache_bytes = prefix_cache_mb * 1024 * 1024
+        self.prefix_caches = {}  # model path -> PrefixStateCache
+
+        # Prompt-lookup speculative decoding per model name: True, or a dict of
+        # PromptLookupDraft options (num_pred_tokens, max_ngram_size)
+        self.speculative = speculative or {}
+        self.draft_models = {}  # model path -> PromptLookupDraft
+        self.server_models = {}  # model path -> LlamaServerModel (llama_server backend)
+
+        # KV cache per model name: {"type_k": "q8_0", "type_v": "q8_0", "flash_attn": True};
+        # q8_0 halves and q4_0 quarters the f16 cache. Validated here, not at load time
+        self.kv_cache = {name: kv_cache_options((kv_cache or {}).get(name)) for name in model_paths}
+
+        # Stage histograms and token/retrieval counters per request (off by default);
+        # trace_path appends every request as a JSON line
+        self.metrics = Metrics(enabled=metrics, trace_path=trace_path)
+        self.metrics.add_collector(self._cache_metrics)
+
+        # Loaded models stay resident up to the RAM budget (LRU eviction)
+        self.pool = ModelPool(model_paths, self.load_model, ram_budget_gb=model_ram_budget_gb,
+                              size_estimator=self.model_memory_bytes, on_evict=self._drop_prefix_cache)
+
+        # A loaded llama.cpp context is not thread-safe: one generation per model at a time.
+        # A llama-server takes one request per slot; more would only queue inside it
+        self._model_locks = {name: threading.BoundedSemaphore(self.slots_per_model) for name in model_paths}
+
+        # Per-session history, language and retrieved context, shared model
+        # conversation_db logs every message to SQLite and resumes sessions from it
+        self.conversations = ConversationStore(conversation_db) if conversation_db else None
+        self.sessions = SessionStore(max_sessions=max_sessions, idle_ttl=session_idle_ttl,
+                                     store=self.conversations)
+
+        # Fits system prompt, history, retrieved context and generation into n_ctx
+        self.token_counter = TokenCounter()
+        self.packer = PromptPacker(self.token_counter, n_ctx)
+
+        # Once a session's history passes history_summary_tokens, its older turns are
+        # folded into a running summary in the background (0 disables)
+        self.summarizer = HistorySummarizer(
+            self.token_counter, self._generate_summary, threshold_tokens=history_summary_tokens,
+            max_tokens=summary_max_tokens) if history_summary_tokens else None
+        self.last_prompt_usage = {}  # Tokens per prompt section of the last request (only "prompt" on the Zephyr path)
+        self.last_generation_stats = {}  # Tokens, speed and draft acceptance of the last request
+        self.last_stage_times = {}  # Seconds per stage (language, retrieval, prompt, prefill, ...) of the last request
+
+        # --- English FAISS index and metadata are optional ---
         # Replace "_fa." in file names with "_en." to get the expected English paths
         faiss_index_path_en = faiss_index_path_fa.replace("_fa.", "_en.")
         faiss_meta_path_en = faiss_meta_path_fa.replace("_fa.", "_en.")
+        has_en = os.path.exists(faiss_index_path_en) and (
+            os.path.exists(faiss_meta_path_en) or ChunkStore.exists(os.path.splitext(faiss_meta_path_en)[0]))
+
+        # --- Load LLM, embedder and indexes in parallel background threads ---
+        # Accessors (self.embedder, self.index_fa, ...) wait only for their own component
+        self.startup = StartupLoader(on_complete=self._report_startup)
+        self.startup.submit("model:" + self.active_model, self.pool.get, self.active_model)
+        self.startup.submit("embedder", self._load_embedder, embed_model)
+        self.startup.submit("index_fa", self._load_index, faiss_index_path_fa, faiss_meta_path_fa)
+        if has_en:
+            self.startup.submit("index_en", self._load_index, faiss_index_path_en, faiss_meta_path_en)
+        self.startup.close()
+
+        # Index files identify their contents, so cached results survive restarts
+        # but are never served for a rebuilt index
+        self.index_generation = self._index_generation(
+            faiss_index_path_fa, faiss_index_path_en if has_en else None)
+
+        # Query text -> embedding and (embedding, lang, top_k) -> chunks caches
+        self.retrieval_cache = RetrievalCache(
+            persist_dir=query_cache_dir,
+            namespace=embed_model if isinstance(embed_model, str) else type(embed_model).__name__)
+
+        # Running latency of each retrieval path: name -> [total ms, count]
+        self.retrieval_latency = {"dense": [0.0, 0], "sparse": [0.0, 0]}
+
+        # Opt-in reuse of answers to near-duplicate first questions
+        self.answer_cache = SemanticAnswerCache(threshold=answer_cache_threshold) if answer_cache else None
+
+    def _load_embedder(self, embed_model):
+        """Load the sentence embedding model used for retrieval (or use a given encoder object)."""
+        if not isinstance(embed_model, str):
+            return embed_model
+        return SentenceTransformer(embed_model)
+
+    def _load_index(self, index_path: str, meta_path: str):
+        """
+        Load a FAISS index (memory-mapped), its metadata, the optional BM25 index and,
+        for compressed indexes, the float vectors used for re-scoring.
+        The chunk store written by build_faiss.py is preferred: it is memory-mapped
+        and resolves ids in O(1). The JSON list of chunks is the fallback.
+        """
+        # Any index type written by build_faiss.py (Flat, IVF, PQ, HNSW, SQ) loads the same way
+        index = read_faiss_index(index_path)
+        if self.faiss_search_params:
+            faiss.ParameterSpace().set_index_parameters(index, self.faiss_search_params)
+        # build_faiss.py keeps the float vectors of every index; only compressed ones need them here
+        vectors = None
+        if VectorStore.exists(index_path) and not is_exact_index(index):
+            vectors = VectorStore(vector_store_path(index_path))
+        store_prefix = os.path.splitext(meta_path)[0]
+        bm25 = BM25Index(store_prefix + ".bm25") if BM25Index.exists(store_prefix + ".bm25") else None
+        if ChunkStore.exists(store_prefix):
+            return index, ChunkStore(store_prefix), bm25, vectors
+        with open(meta_path, encoding="utf-8") as f:
+            metadata = json.load(f)
+        return index, metadata, bm25, vectors
+
+    def _report_startup(self, startup: StartupLoader):
+        """Show how long each component took once startup has finished."""
+        if os.environ.get("TERM_UI", "1") == "1":
+            print_system(startup.format_timeline())
 
-        # Check if both English index and metadata files exist
-        if os.path.exists(faiss_index_path_en) and os.path.exists(faiss_meta_path_en):
-                # Load the English FAISS index
-            self.index_en = faiss.read_index(faiss_index_path_en)
-                # Load the associated metadata (list of chunks)
-            with open(faiss_meta_path_en, encoding="utf-8") as f:
-                self.meta_en = json.load(f)
-        else:
-                # If files are not found, fall back to empty values
-            self.index_en = None
-            self.meta_en = []
-        self.history = []
-
-    def load_model(self, model_path: str):
-        """Load a LLaMA model from disk with specified runtime configuration."""
-        return Llama(
+    @property
+    def embedder(self):
+        return self.startup.get("embedder")
+
+    @property
+    def index_fa(self):
+        return self.startup.get("index_fa")[0]
+
+    @property
+    def meta_fa(self):
+        return self.startup.get("index_fa")[1]
+
+    @property
+    def index_en(self):
+        # The English index is optional; without it English retrieval returns nothing
+        return self.startup.get("index_en")[0] if "index_en" in self.startup else None
+
+    @property
+    def meta_en(self):
+        return self.startup.get("index_en")[1] if "index_en" in self.startup else []
+
+    def _bm25(self, lang: str):
+        """BM25 index for a language, or None when it was not built."""
+        component = "index_fa" if lang == "fa" else "index_en"
+        return self.startup.get(component)[2] if component in self.startup else None
+
+    def _vectors(self, lang: str):
+        """Float vector store of a compressed index, or None."""
+        component = "index_fa" if lang == "fa" else "index_en"
+        return self.startup.get(component)[3] if component in self.startup else None
+
+    def load_model(self, model_path: str, speculative=None):
+        """
+        Load a LLaMA model from disk with specified runtime configuration.
+        speculative enables prompt-lookup speculative decoding (True or a dict of
+        PromptLookupDraft options); by default the setting for this model name in
+        self.speculative is used. Drafting needs logits for every position, which
+        llama_cpp then keeps for the whole context.
+        """
+        names = {path: name for name, path in self.model_paths.items()}
+        if speculative is None:
+            speculative = self.speculative.get(names.get(model_path))
+        options = speculative_options(speculative)
+        # Prompt-lookup drafting hooks into the in-process sampler; llama-server has none
+        draft_model = PromptLookupDraft(**options) if options and self.backend == "llama_cpp" else None
+
+        settings = self.runtime_settings(model_path)
+        settings.update(self.kv_cache.get(names.get(model_path)) or kv_cache_options(None))
+        settings.update(self.plan_model_memory(model_path, settings, logits_all=draft_model is not None))
+        with self.metrics.span("model_load_seconds", model=names.get(model_path, model_path)):
+            llm = self._create_llm(model_path, settings, draft_model)
+        self.runtime_profiles[model_path] = settings
+        if draft_model is not None:
+            self.draft_models[model_path] = draft_model
+        if isinstance(llm, LlamaServerModel):
+            self.server_models[model_path] = llm
+
+        # Requests sharing a token prefix (system instructions, earlier turns)
+        # restore its saved state and only prefill the new suffix.
+        # llama-server does the same per slot (cache_prompt)
+        if self.prefix_cache_bytes > 0 and self.backend == "llama_cpp":
+            self.prefix_caches[model_path] = PrefixStateCache(self.prefix_cache_bytes).bind(llm)
+        return llm
+
+    def _create_llm(self, model_path: str, settings: dict, draft_model):
+        if self.backend == "llama_server":
+            return LlamaServerModel(
+                model_path,
+                n_ctx=settings["n_ctx"],                      # Context of each slot
+                n_slots=self.slots_per_model,                 # Requests decoded together
+                n_gpu_layers=settings["n_gpu_layers"],
+                n_threads=settings["n_threads"],
+                n_threads_batch=settings["n_threads_batch"],
+                n_batch=settings["n_batch"],
+                type_k=settings["type_k"],
+                type_v=settings["type_v"],
+                flash_attn=settings["flash_attn"],
+            )
+        return self.llm_class(
             model_path=model_path,
-            n_ctx=self.n_ctx,                  # Number of context tokens
-            n_gpu_layers=self.n_gpu_layers,    # Number of layers offloaded to GPU
-            n_threads=self.n_threads,          # Number of CPU threads to use
-            use_mlock=True,                    # Prevent the model from being swapped out of RAM
-            verbose=False                      # Suppress detailed logs
+            n_ctx=settings["n_ctx"],                          # Number of context tokens
+            n_gpu_layers=settings["n_gpu_layers"],            # Number of layers offloaded to GPU
+            n_threads=settings["n_threads"],                  # CPU threads for generation
+            n_threads_batch=settings["n_threads_batch"],      # CPU threads for prompt processing
+            n_batch=settings["n_batch"],                      # Prompt tokens evaluated per batch
+            type_k=ggml_type(settings["type_k"]),             # KV cache element types (f16, q8_0, q4_0)
+            type_v=ggml_type(settings["type_v"]),
+            flash_attn=settings["flash_attn"],                # Fused attention; required for a quantized V cache
+            use_mlock=True,                                   # Prevent the model from being swapped out of RAM
+            draft_model=draft_model,                          # Draft tokens copied from the prompt (None = off)
+            verbose=False                                     # Suppress detailed logs
         )
 
-    def detect_model_size(model_path: str) -> str:
+    def runtime_settings(self, model_path: str) -> dict:
         """
-        Detect model size from its filename.
+        Threads, batch size and offload for a model: the tuned profile of this host
+        if scripts/autotune.py has saved one, else the constructor arguments.
+        """
+        settings = {
+            "n_gpu_layers": self.n_gpu_layers,
+            "n_threads": self.n_threads,
+            "n_threads_batch": self.n_threads,
+            "n_batch": 512,
+            "source": "defaults",
+        }
+        profile = load_profile(model_path) if self.use_tuned_profiles else None
+        if profile:
+            settings.update({key: profile[key] for key in settings if key in profile})
+            settings["source"] = "autotune " + profile.get("tuned_at", "")
+        return settings
+
+    def plan_model_memory(self, model_path: str, settings: dict, logits_all: bool = False) -> dict:
+        """
+        Context size and offload that fit the free VRAM and RAM, from the GGUF header.
+        Offload is reduced before the context; self.n_ctx is an upper bound and so
+        are the model's trained context and the requested n_gpu_layers.
+        Returns n_ctx, n_gpu_layers and the planned bytes (see ModelInfo.plan).
+        """
+        info = inspect_model(model_path)
+        requested = settings["n_gpu_layers"]
+        if requested < 0 or requested > info.n_layer:
+            requested = info.n_layer + 1  # All layers plus the output projection
+        if not llama_cpp.llama_supports_gpu_offload():
+            requested = 0  # CPU-only build: every layer stays in RAM
+
+        kv = {key: settings[key] for key in ("type_k", "type_v", "flash_attn")}
+        gpu_budget, ram_budget = available_memory()
+        n_ctx, n_gpu_layers = info.fit(self.n_ctx, requested, gpu_budget, ram_budget,
+                                       n_batch=settings["n_batch"], logits_all=logits_all, **kv)
+        plan = info.plan(n_ctx, n_gpu_layers, n_batch=settings["n_batch"], logits_all=logits_all, **kv)
+        return {
+            "n_ctx": n_ctx,
+            "n_gpu_layers": n_gpu_layers,
+            "memory": {"gpu_bytes": plan["gpu"], "ram_bytes": plan["cpu"], "kv_bytes": plan["kv_gpu"] + plan["kv_cpu"]},
+        }
+
+    def model_memory_bytes(self, model_path: str) -> int:
+        """
+        Resident size of a model for the pool's RAM budget: weights, the KV cache of
+        its configured type at n_ctx (once per llama-server slot) and the scratch
+        buffers, from the GGUF header.
+        """
+        names = {path: name for name, path in self.model_paths.items()}
+        kv = self.kv_cache.get(names.get(model_path)) or kv_cache_options(None)
+        info = inspect_model(model_path)
+        n_ctx = min(self.n_ctx, info.n_ctx_train)
+        return (info.weight_bytes + self.slots_per_model * info.kv_bytes(n_ctx, kv["type_k"], kv["type_v"])
+                + info.scratch_bytes(n_ctx, flash_attn=kv["flash_attn"]))
+
+    def kv_cache_report(self) -> dict:
+        """
+        KV cache type and size per model name. Loaded models report the context they
+        were loaded with; the others the size they would get at n_ctx.
+        """
+        report = {}
+        for name, path in self.model_paths.items():
+            kv = self.kv_cache[name]
+            settings = self.runtime_profiles.get(path) if self.pool.is_loaded(name) else None
+            n_ctx = settings["n_ctx"] if settings else min(self.n_ctx, inspect_model(path).n_ctx_train)
+            report[name] = dict(kv, n_ctx=n_ctx, loaded=settings is not None,
+                                kv_bytes=inspect_model(path).kv_bytes(n_ctx, kv["type_k"], kv["type_v"]))
+        return report
+
+    def _drop_prefix_cache(self, model_name: str, model_path: str):
+        """
+        Free the saved states and draft model of a model that left the pool, and stop
+        its llama-server once the requests running on it have finished.
+        """
+        self.draft_models.pop(model_path, None)
+        server = self.server_models.pop(model_path, None)
+        if server is not None:
+            lock = self._model_locks[model_name]
+            for _ in range(self.slots_per_model):
+                lock.acquire()
+            try:
+                server.close()
+            finally:
+                for _ in range(self.slots_per_model):
+                    lock.release()
+        cache = self.prefix_caches.pop(model_path, None)
+        if cache is not None:
+            cache.clear()
+
+    def prefix_cache_stats(self) -> dict:
+        """Hit/miss counters and prefill tokens saved, per model name."""
+        names = {path: name for name, path in self.model_paths.items()}
+        return {names.get(path, path): cache.stats() for path, cache in self.prefix_caches.items()}
+
+    @property
+    def model(self):
+        """The active model, loaded through the residency pool."""
+        return self.pool.get(self.active_model)
+
+    @property
+    def history(self) -> list:
+        """History of the default session."""
+        return self.sessions.get(self.DEFAULT_SESSION).history
+
+    def detect_model_size(self, model_path: str) -> str:
+        """
+        Detect model size from its GGUF metadata (general.size_label, or the parameter count).
         Example: dorna-llama3-8b-instruct.Q4_K_M.gguf → returns "8B"
         """
-        filename = os.path.basename(model_path).lower()
-        if "7b" in filename:
-            return "7B"
-        elif "8b" in filename:
-            return "8B"
-        else:
-            raise ValueError("Model size not found in filename (expected 7B or 8B)")
+        return inspect_model(model_path).size_label
         
     def switch_model(self, new_model_name: str):
         """Switch to a different model by name and reset conversation history."""
         
-        # Check if the requested model exists in the model paths
-        if new_model_name not in self.model_paths:
-            raise ValueError(f"Model '{new_model_name}' not found.")
-
-        # Remove the current model from memory
-        del self.model
-
-        # Load the new model
+        # Fetch the new model from the pool; warm models are returned without reloading
+        timing = {}
+        self.pool.get(new_model_name, timing)
         self.active_model = new_model_name
-        self.model = self.load_model(self.model_paths[self.active_model])
+        elapsed, loaded = timing["seconds"], timing["loaded"]
 
         # Set chatbot language based on model
         if new_model_name == "dorna":
@@ -132,110 +437,255 @@ class TherapyChatbot:
         # Display success messages in both Persian and English
         if os.environ.get("TERM_UI", "1") == "1":
             print_success(f"مدل با موفقیت تغییر کرد به {self.active_model}")
-            print_system(f"✨ Model {self.active_model} is ready.")
+            how = "loaded from disk" if loaded else "already resident"
+            print_system(f"✨ Model {self.active_model} is ready ({how} in {elapsed * 1000:.1f} ms).")
+            settings = self.runtime_profiles.get(self.model_paths[self.active_model])
+            if loaded and settings:
+                print_system(f"   threads {settings['n_threads']}/{settings['n_threads_batch']}, "
+                             f"batch {settings['n_batch']}, GPU layers {settings['n_gpu_layers']} "
+                             f"({settings['source']}), context {settings['n_ctx']} tokens, "
+                             f"KV {settings['type_k']}/{settings['type_v']} "
+                             f"{settings['memory']['kv_bytes'] / 2**20:.0f} MB"
+                             f"{' + flash attention' if settings['flash_attn'] else ''}, "
+                             f"{settings['memory']['ram_bytes'] / 2**30:.1f} GB RAM / "
+                             f"{settings['memory']['gpu_bytes'] / 2**30:.1f} GB VRAM")
+
+    def route_model(self, question_language: str, session=None, model: str = None):
+        """
+        Pick the model and prompt language for one request.
+        A given `model` is used as is (the API's "model" field). With routing on,
+        Persian questions go to dorna and English ones to zephyr without touching
+        the active model or the history.
+        """
+        if model is not None:
+            if question_language in self.LANGUAGE_ROUTES:
+                return model, question_language
+            return model, (session.language if session is not None else None) or self.language
+        if self.route_by_language:
+            routed = self.LANGUAGE_ROUTES.get(question_language)
+            if routed in self.model_paths:
+                return routed, question_language
+        if session is not None:
+            return session.model or self.active_model, session.language or self.language
+        return self.active_model, self.language
 
 
 
-    def retrieve_chunks(self, question: str, top_k: int = 5, lang: str = None):
-        """Retrieve top-k relevant text chunks from the FAISS index based on question embedding."""
+    def retrieve_chunks(self, question: str, top_k: int = 5, lang: str = None, stages: dict = None):
+        """
+        Retrieve top-k relevant text chunks for the question.
+        Dense FAISS results are fused with BM25 results (reciprocal-rank fusion)
+        when a BM25 index was built for the language.
+        When `stages` is given, the embedding and search seconds are stored in it.
+        """
+        stages = {} if stages is None else stages
         lang = self.language if lang is None else lang
+        # Choose the appropriate index and metadata based on language. These wait for
+        # the startup loader, so a failed load is raised here rather than read as "no sources".
+        index = self.index_fa if lang == "fa" else self.index_en
+        metadata = self.meta_fa if lang == "fa" else self.meta_en
+        bm25 = self._bm25(lang)
+        vectors = self._vectors(lang)
+        embedder = self.embedder
+
+        # If the index or metadata is missing, return empty list
+        if index is None or not metadata:
+            return []
+
         try:
-            # Generate sentence embedding for the question
-            q_emb = self.embedder.encode([question], convert_to_numpy=True).astype('float32')
-
-            # Choose the appropriate index and metadata based on language
-            index = self.index_fa if lang == "fa" else self.index_en
-            metadata = self.meta_fa if lang == "fa" else self.meta_en
-
-            # If the index or metadata is missing, return empty list
-            if index is None or not metadata:
-                return []
-
-            # Search the index for most relevant entries
-            D, I = index.search(np.array(q_emb), top_k)
-            chunks = []
-            for idx in I[0]:
-                if 0 <= idx < len(metadata):
+            # Sentence embedding for the question (cached by normalized text)
+            start = time.perf_counter()
+            q_emb = self.retrieval_cache.embedding(
+                question, lambda text: embedder.encode([text], convert_to_numpy=True))
+            start = self._stage(stages, "embedding", start)
+
+            def search(emb):
+                # Over-fetch candidates from each path when fusing
+                n_candidates = top_k * 3 if bm25 is not None else top_k
+
+                # Search the index for most relevant entries; a compressed index
+                # over-fetches and the candidates are re-scored with exact vectors
+                start = time.perf_counter()
+                if vectors is not None:
+                    D, I = index.search(emb, n_candidates * self.rescore_factor)
+                    ids = vectors.rescore(emb[0], [int(idx) for idx in I[0]], n_candidates)
+                else:
+                    D, I = index.search(emb, n_candidates)
+                    ids = [int(idx) for idx in I[0]]
+                self._record_latency("dense", start)
+                ids = [idx for idx in ids if 0 <= idx < len(metadata)]
+
+                if bm25 is not None:
+                    start = time.perf_counter()
+                    sparse_ids = [doc for doc, _ in bm25.search(question, n_candidates)]
+                    self._record_latency("sparse", start)
+                    ids = reciprocal_rank_fusion([ids, sparse_ids], top_k)
+
+                chunks = []
+                for idx in ids[:top_k]:
                     chunk = metadata[idx]
                     chunks.append({
                         "content": chunk.get("content", ""),
                         "chunk_id": chunk.get("chunk_id"),
                         "source": chunk.get("source", "")
                     })
+                return chunks
+
+            chunks = self.retrieval_cache.search(q_emb, lang, top_k, self.index_generation, search)
+            self._stage(stages, "search", start)
             return chunks
         except Exception as e:
             print(f"Error retrieving data from FAISS: {e}")
             return []
 
-    def detect_question_complexity(self, question: str) -> int:
-        """Determine number of chunks to retrieve based on question complexity."""
+    @staticmethod
+    def _stage(stages: dict, name: str, start: float) -> float:
+        """Store the seconds since `start` as a request stage; returns the current time."""
+        now = time.perf_counter()
+        stages[name] = now - start
+        return now
+
+    def _record_latency(self, path: str, start: float):
+        """Add the time since `start` to a retrieval path's running latency."""
+        total = self.retrieval_latency[path]
+        total[0] += (time.perf_counter() - start) * 1000
+        total[1] += 1
+
+    def retrieval_stats(self) -> dict:
+        """Average latency (ms) and call count of the dense and sparse retrieval paths."""
+        return {
+            path: {"avg_ms": total / count if count else 0.0, "calls": count}
+            for path, (total, count) in self.retrieval_latency.items()
+        }
+
+    @staticmethod
+    def _index_generation(*index_paths) -> str:
+        """Short tag derived from the size and mtime of the loaded index files."""
+        parts = []
+        for path in index_paths:
+            if path:
+                st = os.stat(path)
+                parts.append(f"{st.st_size}-{st.st_mtime_ns}")
+        return "/".join(parts)
+
+    def retrieval_cache_stats(self) -> dict:
+        """Hit rates and saved time of the query embedding and result caches."""
+        return self.retrieval_cache.stats()
+
+    def detect_question_complexity(self, question: str, hybrid: bool = False) -> int:
+        """
+        Determine number of chunks to retrieve based on question complexity.
+        Hybrid (dense + BM25) retrieval is more precise per chunk, so it sends fewer.
+        """
         length = len(question.split())
         if length < 8:
-            return 3
+            return 2 if hybrid else 3
         elif length < 20:
-            return 5
+            return 3 if hybrid else 5
         else:
-            return 7
+            return 5 if hybrid else 7
 
-    def build_system_prompt(self, retrieved_chunks):
-        """Construct the initial system prompt with context from retrieved chunks."""
-        
-        # Set the base instruction prompt depending on language
-        if self.language == "fa":
-            system_prompt = (
+    def system_instructions(self, language: str = None) -> str:
+        """Base therapist instructions for a language, without reference context."""
+        language = self.language if language is None else language
+        if language == "fa":
+            return (
                 "تو یک درمانگر حرفه‌ای شناختی-رفتاری فارسی زبان هستی. "
                 "باید با زبان کاملا فارسی، ساده و علمی پاسخ بدهی. "
                 "پاسخ‌ها باید کوتاه، خاص و کاربردی باشند."
             )
-        else:
-            system_prompt = (
-                "You are a professional Cognitive-Behavioral Therapist. "
-                "Respond in clear, simple, and scientific English. "
-                "Provide brief and focused answers."
-            )
+        return (
+            "You are a professional Cognitive-Behavioral Therapist. "
+            "Respond in clear, simple, and scientific English. "
+            "Provide brief and focused answers."
+        )
+
+    @staticmethod
+    def format_context_line(chunk) -> str:
+        """Text a retrieved chunk takes in the last user message."""
+        return f"- {chunk['content'].strip()}\n" if chunk["content"] else ""
+
+    @staticmethod
+    def format_summary(summary: str, language: str = None) -> str:
+        """Text the running summary of earlier turns takes in the system prompt."""
+        if not summary:
+            return ""
+        label = "خلاصه‌ی گفتگوی قبلی" if language == "fa" else "Summary of the earlier conversation"
+        return f"\n{label}:\n{summary}\n"
 
-        # Add reference context from the retrieved documents
+    def build_system_prompt(self, language: str = None, summary: str = None):
+        """
+        System prompt: the instructions and the summary of earlier turns. It stays the
+        same from turn to turn, so with the history after it it forms a prefix whose
+        KV state the prefix cache can reuse.
+        """
+        return self.system_instructions(language) + self.format_summary(summary, language)
+
+    def build_user_message(self, question: str, retrieved_chunks) -> str:
+        """Last user message: the reference context retrieved for this turn, then the question."""
         if retrieved_chunks:
-            context_text = "\nReference information:\n"
+            context_text = "Reference information:\n"
             for chunk in retrieved_chunks:
-                if chunk["content"]:
-                    context_text += f"- {chunk['content'].strip()}\n"
+                context_text += self.format_context_line(chunk)
         else:
-            context_text = "\n(No sources found; please answer based on general knowledge.)"
+            context_text = "(No sources found; please answer based on general knowledge.)\n"
+        return context_text + "\n" + question
 
-        return system_prompt + context_text
 
-
-    def sanitize_question(self, question: str) -> str:
+    def sanitize_question(self, question: str, language: str = None) -> str:
         """Ensure the question is in the correct language."""
-        if self.language == "fa" and not any('\u0600' <= c <= '\u06FF' for c in question):
+        language = self.language if language is None else language
+        if language == "fa" and not any('\u0600' <= c <= '\u06FF' for c in question):
             return "لطفا سوال خود را به زبان فارسی بنویسید."
-        elif self.language == "en" and any('\u0600' <= c <= '\u06FF' for c in question):
+        elif language == "en" and any('\u0600' <= c <= '\u06FF' for c in question):
             return "Please write your question in English."
         return question
 
-    def ask(self, question: str, max_tokens: int = 512, temperature: float = 0.3) -> str:
+    def _prepare_generation(self, question: str, max_tokens: int, temperature: float, session_id: str,
+                            model: str = None, session=None):
         """
-        Generate a response to the user's question using the active model.
-        Supports both Zephyr (English) and Dorna (Persian) models with optional RAG.
+        Build the llama_cpp call for a question without running it.
+        Returns a dict with the model ("llm", "model_name"), the call "mode"
+        ("completion" for the prompt-style Zephyr path, "chat" for
+        create_chat_completion, "cached" when the answer cache already has
+        the "answer"), its "params" and the "session" to record into
+        (None when the path keeps no history). A given `session` (SessionState)
+        is used as is instead of being looked up by session_id.
         """
-        llm = self.model
+        stages = {}
+        start = time.perf_counter()
+        if session is None:
+            session = self.sessions.get(session_id)
 
-        # Automatically detect question's language
+        # Automatically detect question's language and pick the model for it
         question_language = self.detect_language(question)
-
-        # If the active model is Zephyr (English chat, prompt-style input)
-        if self.active_model == "zephyr":
+        start = self._stage(stages, "language", start)
+        model_name, language = self.route_model(question_language, session, model)
+        llm = self.pool.get(model_name)
+        start = self._stage(stages, "model", start)
+        job = {"llm": llm, "model_name": model_name, "language": language, "session": None, "stages": stages,
+               "lang": question_language if question_language in ("fa", "en") else "other", "counters": {}}
+
+        # If the model is Zephyr (English chat, prompt-style input)
+        if model_name == "zephyr":
             system_prompt = (
                 "You are a professional cognitive-behavioral therapist. "
                 "Respond briefly and directly to the user's problems. "
                 "Avoid long stories or explanations. Focus on practical advice and support."
             )
+            # Zephyr keeps no history, so every question is a first question
+            if self._check_answer_cache(job, question.strip(), language):
+                return job
+
             # Build a single-prompt message
             prompt = system_prompt + "\nUser: " + question.strip() + "\nTherapist:"
+            job["counters"]["tokens_in"] = self.token_counter.count(llm, prompt)
+            self.last_prompt_usage = {"prompt": job["counters"]["tokens_in"]}
+            self._stage(stages, "prompt", start)
 
-            # Call the model (Zephyr works in prompt-style completion)
-            response = llm(
+            # Zephyr works in prompt-style completion and does not keep history
+            job["mode"] = "completion"
+            job["params"] = dict(
                 prompt=prompt,
                 max_tokens=150,
                 temperature=0.3,
@@ -243,73 +693,304 @@ class TherapyChatbot:
                 repeat_penalty=1.1,
                 stop=["User:", "Therapist:"]
             )
-
-            # Extract and clean the generated text
-            raw_text = response["choices"][0]["text"]
-            safe_text = raw_text.encode("utf-8", errors="replace").decode("utf-8").strip()
-            return safe_text
+            return job
 
         # For Dorna or other models supporting chat-style input
+        sanitized_question = self.sanitize_question(question, language)
+        previous_history = list(session.history)
+        summary = session.summary  # Stands in for the turns folded out of previous_history
+        # The question joins the history together with its answer (_finish_answer), so a
+        # stream abandoned half-way leaves no unanswered user turn behind
+        job["session"] = session
+        job["question"] = sanitized_question
+
+        # Only a conversation's first question can reuse a cached answer
+        if not previous_history and self._check_answer_cache(job, sanitized_question, language):
+            return job
+
+        # Retrieve relevant chunks based on question complexity (RAG)
+        top_k = self.detect_question_complexity(
+            sanitized_question, hybrid=self._bm25(question_language) is not None)
+        retrieved_chunks = self.retrieve_chunks(sanitized_question, top_k=top_k, lang=question_language,
+                                                stages=stages)
+        start = time.perf_counter()
+
+        # Keep the newest turns and best chunks that fit the token budget
+        packed = self.packer.pack(
+            llm,
+            instructions=self.build_system_prompt(language, summary),
+            question=sanitized_question,
+            history=previous_history,
+            chunks=retrieved_chunks,
+            max_tokens=150 if question_language == 'fa' else max_tokens,
+            format_chunk=self.format_context_line,
+            # Stable parts first (instructions, summary, earlier turns) and the per-turn
+            # retrieved context last, so consecutive turns share a prompt prefix
+            user_message=self.build_user_message
+        )
+        self.last_prompt_usage = packed["usage"]
+        job["counters"].update(tokens_in=packed["usage"]["prompt"], chunks_retrieved=len(retrieved_chunks),
+                               context_tokens=packed["usage"]["context"])
+        session.retrieved_chunks = [chunk["chunk_id"] for chunk in packed["chunks"]]
+        messages = packed["messages"]
+        self._stage(stages, "prompt", start)
+
+        job["mode"] = "chat"
         if question_language == 'fa':
             # Persian input
-            sanitized_question = self.sanitize_question(question)
-            self.history.append({"role": "user", "content": sanitized_question})
-
-            # Retrieve relevant chunks based on question complexity (RAG)
-            top_k = self.detect_question_complexity(sanitized_question)
-            retrieved_chunks = self.retrieve_chunks(sanitized_question, top_k=top_k, lang=question_language)
-            system_prompt = self.build_system_prompt(retrieved_chunks)
-
-            # Construct chat history with system prompt
-            messages = [{"role": "system", "content": system_prompt}]
-            messages += self.history[-6:]  # Limit to last 6 turns
-            messages.append({"role": "user", "content": sanitized_question})
-
-            # Generate chat completion
-            response = llm.create_chat_completion(
+            job["params"] = dict(
                 messages=messages,
-                max_tokens=150,
+                max_tokens=packed["max_tokens"],
                 temperature=0.25,
                 top_p=0.7,
                 repeat_penalty=1.1,
                 stop=["مراجع:", "درمانگر:"]
             )
-
-            raw = response["choices"][0]["message"]["content"]
-            answer = raw.encode("utf-8", errors="replace").decode("utf-8").strip()
-
         else:
             # English input (chat-style models like Dorna or fallback Zephyr)
-            sanitized_question = self.sanitize_question(question)
-            self.history.append({"role": "user", "content": sanitized_question})
-
-            # Retrieve English context if available
-            top_k = self.detect_question_complexity(sanitized_question)
-            retrieved_chunks = self.retrieve_chunks(sanitized_question, top_k=top_k, lang=question_language)
-            system_prompt = self.build_system_prompt(retrieved_chunks)
-
-            messages = [{"role": "system", "content": system_prompt}]
-            messages += self.history[-6:]
-            messages.append({"role": "user", "content": sanitized_question})
-
-            response = llm.create_chat_completion(
+            job["params"] = dict(
                 messages=messages,
-                max_tokens=max_tokens,
+                max_tokens=packed["max_tokens"],
                 temperature=temperature,
                 top_p=0.9,
                 repeat_penalty=1.1,
                 stop=["Client:", "Therapist:"]
             )
-
-            raw = response["choices"][0]["message"]["content"]
-            answer = raw.encode("utf-8", errors="replace").decode("utf-8").strip()
-
-        # Save model response to history
-        self.history.append({"role": "assistant", "content": answer})
-
-        # Return the final response
+        return job
+
+    def _check_answer_cache(self, job: dict, question: str, language: str) -> bool:
+        """Look the question up in the answer cache; on a hit the job becomes "cached"."""
+        if self.answer_cache is None:
+            return False
+        emb = self.retrieval_cache.embedding(
+            question, lambda text: self.embedder.encode([text], convert_to_numpy=True))
+        answer = self.answer_cache.lookup(emb, job["model_name"], language)
+        if answer is not None:
+            job["mode"] = "cached"
+            job["answer"] = answer
+            return True
+        # Remember what to store once the model has answered
+        job["cache_entry"] = (emb, question, language)
+        return False
+
+    def _finish_answer(self, raw: str, job: dict) -> str:
+        """Clean the generated text, save it to the session's history and the answer cache."""
+        answer = raw.encode("utf-8", errors="replace").decode("utf-8").strip()
+        if job["session"] is not None:
+            self.sessions.append(job["session"], "user", job["question"])
+            self.sessions.append(job["session"], "assistant", answer)
+            if self.summarizer is not None and job["session"].persistent:
+                # Runs once the answer is out; the next request sees the shorter history.
+                # Throwaway sessions (one API request) would never use the summary
+                self.summarizer.schedule(self.sessions, job["session"], job["llm"], job["model_name"],
+                                         job["language"])
+        if "cache_entry" in job:
+            emb, question, language = job["cache_entry"]
+            self.answer_cache.store(emb, question, answer, job["model_name"], language)
         return answer
 
+    def _generate_summary(self, model_name: str, messages: list, max_tokens: int, stop: list) -> str:
+        """Run a summarization request on a model, between the requests that use it."""
+        llm = self.pool.get(model_name)
+        with self._model_locks[model_name], self.metrics.span("summary_seconds", model=model_name):
+            response = llm.create_chat_completion(messages=messages, max_tokens=max_tokens, temperature=0.2,
+                                                  top_p=0.9, repeat_penalty=1.1, stop=stop)
+        return response["choices"][0]["message"]["content"] or ""
+
+    def _start_generation(self, job: dict) -> float:
+        """Reset the draft counters of the job's model; returns the start time."""
+        draft = self.draft_models.get(job["llm"].model_path)
+        if draft is not None:
+            draft.reset_counts()
+        return time.perf_counter()
+
+    def _record_generation(self, job: dict, text: str, start: float, first_token: float = None,
+                           finish_reason: str = None):
+        """
+        Store tokens/sec (and the draft acceptance rate) and the stage times of a finished generation.
+        finish_reason is llama_cpp's: "stop" (end of turn or a stop string) or "length" (max_tokens).
+        """
+        llm = job["llm"]
+        elapsed = time.perf_counter() - start
+        stages = job["stages"]
+        tokens = self.token_counter.count(llm, text) if text else 0
+        stats = {
+            "model": job["model_name"],
+            "tokens": tokens,
+            "seconds": elapsed,
+            "tokens_per_s": tokens / elapsed if elapsed > 0 else 0.0,
+            "finish_reason": finish_reason or "stop",
+        }
+        if first_token is not None:
+            # Streaming separates prefill (time to first token) from decoding
+            decode = time.perf_counter() - first_token
+            stats["ttft_s"] = first_token - start
+            stats["decode_tokens_per_s"] = (tokens - 1) / decode if tokens > 1 and decode > 0 else 0.0
+            stages["prefill"] = stats["ttft_s"]
+            stages["decode"] = decode
+        else:
+            stages["generation"] = elapsed
+        draft = self.draft_models.get(llm.model_path)
+        if draft is not None:
+            stats.update(draft.stats())
+        self.last_generation_stats = stats
+        self.last_stage_times = stages
+        self.metrics.record_request(stages, dict(job["counters"], tokens_out=tokens),
+                                    model=job["model_name"], lang=job["lang"])
+        return stats
+
+    def _cache_metrics(self) -> list:
+        """Hit/miss counters the caches keep themselves, for the Prometheus export."""
+        rows = []
+        retrieval = self.retrieval_cache.stats()
+        for level in ("embeddings", "results"):
+            for outcome in ("hits", "misses"):
+                rows.append((f"retrieval_cache_{outcome}_total", "counter", {"level": level},
+                             retrieval[level][outcome]))
+        names = {path: name for name, path in self.model_paths.items()}
+        for path, cache in list(self.prefix_caches.items()):
+            stats = cache.stats()
+            model = {"model": names.get(path, path)}
+            rows.append(("prefix_cache_hits_total", "counter", model, stats["hits"]))
+            rows.append(("prefix_cache_misses_total", "counter", model, stats["misses"]))
+            rows.append(("prefix_cache_prefill_tokens_saved_total", "counter", model, stats["prefill_tokens_saved"]))
+        if self.answer_cache is not None:
+            stats = self.answer_cache.stats()
+            rows.append(("answer_cache_hits_total", "counter", {}, stats["hits"]))
+            rows.append(("answer_cache_misses_total", "counter", {}, stats["misses"]))
+        if self.summarizer is not None:
+            summaries = self.summarizer.stats()
+            rows.append(("history_summaries_total", "counter", {}, summaries["summaries"]))
+            rows.append(("history_folded_messages_total", "counter", {}, summaries["folded_messages"]))
+            rows.append(("history_summary_failures_total", "counter", {}, summaries["failures"]))
+        rows.append(("resident_models", "gauge", {}, len(self.pool.resident())))
+        return rows
+
+    def format_stats(self) -> str:
+        """Live p50/p95/p99 per stage and the request counters, for the /stats command."""
+        if not self.metrics.enabled:
+            return "Metrics are disabled (TherapyChatbot(metrics=True))."
+        lines = [f"{'stage':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'count':>8}"]
+        order = ["language", "model", "embedding", "search", "prompt", "prefill", "decode", "generation"]
+        rows = [(dict(labels), values) for labels, values in self.metrics.percentiles().items()]
+        rows.sort(key=lambda row: (row[0].get("model"), row[0].get("lang"),
+                                   order.index(row[0]["stage"]) if row[0]["stage"] in order else len(order)))
+        for label, values in rows:
+            name = f"{label.get('model')}/{label.get('lang')} {label.get('stage')}"
+            lines.append(f"{name:<22}{values['p50'] * 1000:10.1f}{values['p95'] * 1000:10.1f}"
+                         f"{values['p99'] * 1000:10.1f}{values['count']:8d}")
+        totals = {}
+        for (name, _), value in self.metrics.counter_values().items():
+            totals[name] = totals.get(name, 0) + value
+        lines.append("  ".join(f"{name} {value:g}" for name, value in sorted(totals.items())))
+        retrieval = self.retrieval_cache.stats()
+        lines.append(f"retrieval cache hit rate: embeddings {retrieval['embeddings']['hit_rate']:.0%}, "
+                     f"results {retrieval['results']['hit_rate']:.0%}")
+        return "\n".join(lines)
+
+    def format_generation_stats(self) -> str:
+        """One-line summary of the last request's speed and draft acceptance."""
+        stats = self.last_generation_stats
+        if not stats:
+            return ""
+        line = f"⚡ {stats['tokens']} tokens, {stats['tokens_per_s']:.1f} tok/s"
+        if "decode_tokens_per_s" in stats:
+            line += f" (decode {stats['decode_tokens_per_s']:.1f} tok/s, first token {stats['ttft_s']:.2f}s)"
+        if "acceptance_rate" in stats:
+            line += f", draft acceptance {stats['acceptance_rate']:.0%} ({stats['accepted']}/{stats['drafted']})"
+        return line
+
+    def export_answer_cache(self, path: str):
+        """Save the answer cache to a JSON file."""
+        if self.answer_cache is not None:
+            self.answer_cache.export(path)
+
+    def import_answer_cache(self, path: str) -> int:
+        """Warm the answer cache from a file written by export_answer_cache()."""
+        if self.answer_cache is None or not os.path.exists(path):
+            return 0
+        return self.answer_cache.load(path)
+
+    def ask(self, question: str, max_tokens: int = 512, temperature: float = 0.3,
+            session_id: str = DEFAULT_SESSION, model: str = None, session=None) -> str:
+        """
+        Generate a response to the user's question using the active model
+        (or `model`, when given, instead of the routed one).
+        Supports both Zephyr (English) and Dorna (Persian) models with optional RAG.
+        Each session_id keeps its own history on the shared models; a `session`
+        object (e.g. a throwaway one outside the session store) replaces the lookup.
+        """
+        job = self._prepare_generation(question, max_tokens, temperature, session_id, model, session)
+        llm = job["llm"]
+
+        # Near-duplicate first question: answer from the cache without the model
+        if job["mode"] == "cached":
+            self.last_stage_times = job["stages"]
+            self.metrics.record_request(job["stages"], job["counters"], model=job["model_name"], lang=job["lang"])
+            return self._finish_answer(job["answer"], job)
+
+        with self._model_locks[job["model_name"]]:
+            start = self._start_generation(job)
+            if job["mode"] == "completion":
+                response = llm(**job["params"])
+                raw = response["choices"][0]["text"]
+            else:
+                response = llm.create_chat_completion(**job["params"])
+                raw = response["choices"][0]["message"]["content"]
+            self._record_generation(job, raw, start, finish_reason=response["choices"][0].get("finish_reason"))
+
+        # Save model response to history and return the final response
+        return self._finish_answer(raw, job)
+
+    def ask_stream(self, question: str, max_tokens: int = 512, temperature: float = 0.3,
+                   session_id: str = DEFAULT_SESSION, stats: dict = None, model: str = None, session=None):
+        """
+        Same as ask(), but yields text pieces as llama_cpp produces them.
+        History is updated once the stream has been fully consumed; a stream closed
+        early (client gone, rerun, Ctrl-C) records neither the question nor the answer.
+        A given `stats` dict receives this request's generation stats; unlike
+        last_generation_stats it is not shared with concurrent requests.
+        """
+        job = self._prepare_generation(question, max_tokens, temperature, session_id, model, session)
+        llm = job["llm"]
+
+        if job["mode"] == "cached":
+            self.last_stage_times = job["stages"]
+            self.metrics.record_request(job["stages"], job["counters"], model=job["model_name"], lang=job["lang"])
+            if stats is not None:
+                stats.update(model=job["model_name"], cached=True, finish_reason="stop")
+            yield job["answer"]
+            self._finish_answer(job["answer"], job)
+            return
+
+        pieces = []
+        first_token = None
+        finish_reason = None  # Carried by the last chunk
+        with self._model_locks[job["model_name"]]:
+            start = self._start_generation(job)
+            if job["mode"] == "completion":
+                for part in llm(stream=True, **job["params"]):
+                    finish_reason = part["choices"][0].get("finish_reason") or finish_reason
+                    text = part["choices"][0]["text"]
+                    if text:
+                        first_token = first_token or time.perf_counter()
+                        pieces.append(text)
+                        yield text
+            else:
+                for part in llm.create_chat_completion(stream=True, **job["params"]):
+                    # The first chunk only carries the role, the rest carry content
+                    finish_reason = part["choices"][0].get("finish_reason") or finish_reason
+                    text = part["choices"][0]["delta"].get("content")
+                    if text:
+                        first_token = first_token or time.perf_counter()
+                        pieces.append(text)
+                        yield text
+            generation = self._record_generation(job, "".join(pieces), start, first_token, finish_reason)
+            if stats is not None:
+                stats.update(generation, prompt_tokens=job["counters"].get("tokens_in"))
+
+        self._finish_answer("".join(pieces), job)
+
     def detect_language(self, question: str) -> str:
         """Detect the language of the question."""
         try:
@@ -328,9 +1009,9 @@ class TherapyChatbot:
             print(f"{marker} {model}")
         print("\nTo change the model, please enter the new model's number or name.")
 
-    def reset_history(self):
-        """Clear the conversation history."""
-        self.history = []
+    def reset_history(self, session_id: str = DEFAULT_SESSION):
+        """Clear the conversation history of a session."""
+        self.sessions.reset(session_id)
         print("🧹 Chat history has been cleared!")
 
 
@@ -0,0 +1,172 @@
+# chatbot/chunk_store.py
+
+import json
+import mmap
+import os
+from array import array
+
+import faiss
+import numpy as np
+
+STORE_VERSION = 1
+
+
+def read_faiss_index(index_path: str):
+    """
+    Load a FAISS index memory-mapped and read-only where the index type allows it,
+    so startup does not copy the vectors and several processes share the same pages.
+    """
+    flags = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+    try:
+        return faiss.read_index(index_path, flags)
+    except RuntimeError:
+        # Older FAISS builds cannot map every index type; fall back to a normal read
+        return faiss.read_index(index_path)
+
+
+class _StringColumn:
+    """
+    Memory-mapped UTF-8 strings: an offsets array plus one contiguous blob.
+    A nullable column also has a .null.npy mask; rows set in it read as None.
+    """
+
+    def __init__(self, prefix: str):
+        self.offsets = np.load(prefix + ".idx.npy", mmap_mode="r")
+        # Stores written before the mask existed have no nulls to report
+        self.nulls = np.load(prefix + ".null.npy", mmap_mode="r") if os.path.exists(prefix + ".null.npy") else None
+        self._file = open(prefix + ".bin", "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # mmap cannot map an empty file
+        self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._view = memoryview(self._blob)
+
+    def __getitem__(self, i: int):
+        if self.nulls is not None and self.nulls[i]:
+            return None
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        # Slicing the memoryview does not copy; only the decoded str is allocated
+        return str(self._view[start:end], "utf-8")
+
+
+class _StringColumnWriter:
+    """
+    Streams strings into a blob file and their end offsets into a temporary file.
+    A nullable column also streams one null flag per row, so None is kept apart from "".
+    """
+
+    def __init__(self, prefix: str, nullable: bool = False):
+        self.prefix = prefix
+        self._blob = open(prefix + ".bin", "wb")
+        self._offsets = open(prefix + ".idx.tmp", "wb")
+        self._nulls = open(prefix + ".null.tmp", "wb") if nullable else None
+        self._pos = 0
+        array("Q", [0]).tofile(self._offsets)
+
+    def append(self, text: str):
+        data = (text or "").encode("utf-8")
+        self._blob.write(data)
+        self._pos += len(data)
+        array("Q", [self._pos]).tofile(self._offsets)
+        if self._nulls is not None:
+            self._nulls.write(b"\x01" if text is None else b"\x00")
+
+    def close(self, count: int):
+        self._blob.close()
+        self._offsets.close()
+        tmp = self.prefix + ".idx.tmp"
+        # Copy the raw offsets into a .npy that can be memory-mapped with np.load
+        raw = np.memmap(tmp, dtype=np.uint64, mode="r", shape=(count + 1,))
+        out = np.lib.format.open_memmap(self.prefix + ".idx.npy", mode="w+", dtype=np.uint64, shape=(count + 1,))
+        out[:] = raw
+        out.flush()
+        del raw, out
+        os.remove(tmp)
+
+        if self._nulls is not None:
+            self._nulls.close()
+            tmp = self.prefix + ".null.tmp"
+            nulls = np.fromfile(tmp, dtype=np.bool_) if count else np.zeros(0, dtype=np.bool_)
+            np.save(self.prefix + ".null.npy", nulls)
+            os.remove(tmp)
+
+
+class ChunkStore:
+    """
+    Read-only, memory-mapped chunk metadata for a FAISS index.
+
+    Files written next to `prefix`:
+        .store.json                      manifest (version, count)
+        .content.bin / .content.idx.npy  chunk texts and their offsets
+        .chunk_id.bin / .chunk_id.idx.npy  chunk ids and their offsets
+        .chunk_id.null.npy                 chunks whose id is None
+        .source.codes.npy / .source.json   per-chunk source code and the distinct sources
+
+    store[i] resolves FAISS id i in O(1) and behaves like the old metadata dicts.
+    """
+
+    def __init__(self, prefix: str):
+        with open(prefix + ".store.json", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported chunk store version: {manifest.get('version')}")
+        self.count = manifest["count"]
+        self.content = _StringColumn(prefix + ".content")
+        self.chunk_ids = _StringColumn(prefix + ".chunk_id")
+        self.source_codes = np.load(prefix + ".source.codes.npy", mmap_mode="r")
+        with open(prefix + ".source.json", encoding="utf-8") as f:
+            self.sources = json.load(f)
+
+    @staticmethod
+    def exists(prefix: str) -> bool:
+        return os.path.exists(prefix + ".store.json")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> dict:
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return {
+            "content": self.content[i],
+            "chunk_id": self.chunk_ids[i],
+            "source": self.sources[int(self.source_codes[i])],
+        }
+
+
+class ChunkStoreWriter:
+    """Write a ChunkStore incrementally, one chunk at a time, in FAISS id order."""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+        # Hide any previous store until this one is complete
+        if os.path.exists(prefix + ".store.json"):
+            os.remove(prefix + ".store.json")
+        self._content = _StringColumnWriter(prefix + ".content")
+        self._chunk_ids = _StringColumnWriter(prefix + ".chunk_id", nullable=True)
+        self._codes = open(prefix + ".source.codes.tmp", "wb")
+        self._sources = {}  # source -> code
+        self.count = 0
+
+    def append(self, content: str, chunk_id, source: str = ""):
+        self._content.append(content)
+        self._chunk_ids.append(None if chunk_id is None else str(chunk_id))
+        code = self._sources.setdefault(source or "", len(self._sources))
+        array("I", [code]).tofile(self._codes)
+        self.count += 1
+
+    def close(self):
+        self._content.close(self.count)
+        self._chunk_ids.close(self.count)
+
+        self._codes.close()
+        tmp = self.prefix + ".source.codes.tmp"
+        codes = np.fromfile(tmp, dtype=np.uint32) if self.count else np.zeros(0, dtype=np.uint32)
+        np.save(self.prefix + ".source.codes.npy", codes)
+        os.remove(tmp)
+        with open(self.prefix + ".source.json", "w", encoding="utf-8") as f:
+            json.dump(list(self._sources), f, ensure_ascii=False)
+
+        # The manifest is written last, so a half-written store is never picked up
+        with open(self.prefix + ".store.json", "w", encoding="utf-8") as f:
+            json.dump({"version": STORE_VERSION, "count": self.count}, f)
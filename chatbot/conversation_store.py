@@ -0,0 +1,297 @@
+# chatbot/conversation_store.py
+
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    session_id TEXT PRIMARY KEY,
+    name       TEXT,
+    created    REAL NOT NULL,
+    updated    REAL NOT NULL,
+    n_turns    INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS turns (
+    session_id TEXT NOT NULL,
+    seq        INTEGER NOT NULL,
+    role       TEXT NOT NULL,
+    content    TEXT NOT NULL,
+    ts         REAL NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated);
+"""
+
+_STOP = object()
+
+
+class ConversationStore:
+    """
+    Conversation turns in SQLite (WAL mode), appended one row per message.
+
+    append() only queues the turn; a writer thread commits the queue in batches,
+    so a request never waits on the disk and an update costs one row instead of
+    rewriting every conversation. Turns are clustered by (session_id, seq), so
+    the last N turns of a session are an index range read.
+
+    A turn's seq is assigned by the writer inside its (IMMEDIATE) transaction,
+    so several processes may share the database without overwriting each
+    other's turns.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.5, batch_size: int = 256):
+        """
+        Parameters:
+            path (str): SQLite database file (created if missing)
+            flush_interval (float): Seconds the writer waits to gather more turns into a batch
+            batch_size (int): Most turns committed in one transaction
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        conn.close()
+
+        self._queue = queue.Queue()
+        self._pending = {}   # session_id -> turns queued but not yet committed
+        self._lock = threading.Lock()
+        self._local = threading.local()  # One read connection per thread
+        self.written = 0
+        self.batches = 0
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        # IMMEDIATE: a write transaction takes the write lock before its first read,
+        # so MAX(seq) cannot go stale under another process's writer
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level="IMMEDIATE")
+        conn.execute("PRAGMA journal_mode=WAL")     # Readers never block the writer
+        conn.execute("PRAGMA synchronous=NORMAL")   # fsync at checkpoints only; safe with WAL
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    # --- Writes (queued) ---
+
+    def append(self, session_id: str, role: str, content: str):
+        """Queue a message of a session; it is committed within flush_interval."""
+        with self._lock:
+            self._pending[session_id] = self._pending.get(session_id, 0) + 1
+        self._queue.put(("turn", session_id, role, content, time.time()))
+
+    def clear(self, session_id: str):
+        """Queue the removal of a session's turns (the conversation entry stays)."""
+        self._queue.put(("clear", session_id))
+
+    def delete(self, session_id: str):
+        """Queue the removal of a session and all its turns."""
+        self._queue.put(("delete", session_id))
+
+    def rename(self, session_id: str, name: str):
+        self._queue.put(("rename", session_id, name))
+
+    def flush(self):
+        """Wait until every queued write is committed."""
+        self._queue.join()
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not _STOP and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._commit(conn, [op for op in batch if op is not _STOP])
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if batch[-1] is _STOP:
+                conn.close()
+                return
+
+    def _commit(self, conn: sqlite3.Connection, ops: list):
+        """Apply a batch in one transaction, in queue order."""
+        if not ops:
+            return
+        turns = 0
+        with conn:
+            for op in ops:
+                kind, session_id = op[0], op[1]
+                if kind == "turn":
+                    _, _, role, content, ts = op
+                    conn.execute("INSERT INTO turns SELECT ?, COALESCE(MAX(seq), -1) + 1, ?, ?, ? "
+                                 "FROM turns WHERE session_id = ?", (session_id, role, content, ts, session_id))
+                    conn.execute("INSERT INTO conversations (session_id, created, updated, n_turns) "
+                                 "VALUES (?, ?, ?, 1) ON CONFLICT (session_id) "
+                                 "DO UPDATE SET updated = excluded.updated, n_turns = n_turns + 1",
+                                 (session_id, ts, ts))
+                    turns += 1
+                elif kind == "clear":
+                    conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+                    conn.execute("UPDATE conversations SET n_turns = 0 WHERE session_id = ?", (session_id,))
+                elif kind == "delete":
+                    conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+                    conn.execute("DELETE FROM conversations WHERE session_id = ?", (session_id,))
+                elif kind == "rename":
+                    now = time.time()
+                    conn.execute("INSERT INTO conversations (session_id, name, created, updated) "
+                                 "VALUES (?, ?, ?, ?) ON CONFLICT (session_id) DO UPDATE SET name = excluded.name",
+                                 (session_id, op[2], now, now))
+        with self._lock:
+            for op in ops:
+                if op[0] == "turn":
+                    left = self._pending[op[1]] - 1
+                    if left:
+                        self._pending[op[1]] = left
+                    else:
+                        del self._pending[op[1]]
+        self.written += turns
+        self.batches += 1
+
+    # --- Reads ---
+
+    def last_turns(self, session_id: str, n: int) -> list:
+        """The newest `n` messages of a session, oldest first, as {"role", "content"} dicts."""
+        if session_id in self._pending:
+            self.flush()  # Resuming right after writing: read our own writes
+        rows = self._reader().execute(
+            "SELECT role, content FROM turns WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+            (session_id, n)).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def conversations(self, limit: int = 50) -> list:
+        """Most recently updated conversations: session_id, name, created, updated, n_turns."""
+        rows = self._reader().execute(
+            "SELECT session_id, name, created, updated, n_turns FROM conversations "
+            "ORDER BY updated DESC LIMIT ?", (limit,)).fetchall()
+        keys = ("session_id", "name", "created", "updated", "n_turns")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def __contains__(self, session_id: str) -> bool:
+        return self._reader().execute("SELECT 1 FROM conversations WHERE session_id = ?",
+                                      (session_id,)).fetchone() is not None
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "written": self.written, "batches": self.batches}
+
+    # --- Maintenance ---
+
+    def compact(self, keep_last: int = None, max_age_days: float = None) -> dict:
+        """
+        Drop turns beyond the newest `keep_last` of each session and sessions not
+        updated for `max_age_days`, then checkpoint the WAL and VACUUM the file.
+        """
+        self.flush()
+        size_before = self._file_bytes()
+        conn = self._connect()
+        try:
+            with conn:
+                turns_before = conn.execute("SELECT COUNT(*) FROM turns").fetchone()[0]
+                sessions = 0
+                if max_age_days is not None:
+                    cutoff = time.time() - max_age_days * 86400
+                    conn.execute("DELETE FROM turns WHERE session_id IN "
+                                 "(SELECT session_id FROM conversations WHERE updated < ?)", (cutoff,))
+                    sessions = conn.execute("DELETE FROM conversations WHERE updated < ?", (cutoff,)).rowcount
+                if keep_last is not None:
+                    conn.execute(
+                        "DELETE FROM turns WHERE seq <= (SELECT t.seq FROM turns t WHERE t.session_id = turns.session_id "
+                        "ORDER BY t.seq DESC LIMIT 1 OFFSET ?)", (keep_last,))
+                conn.execute("UPDATE conversations SET n_turns = "
+                             "(SELECT COUNT(*) FROM turns WHERE turns.session_id = conversations.session_id)")
+                turns_after = conn.execute("SELECT COUNT(*) FROM turns").fetchone()[0]
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        return {"turns_removed": turns_before - turns_after, "sessions_removed": sessions,
+                "bytes_before": size_before, "bytes_after": self._file_bytes()}
+
+    def _file_bytes(self) -> int:
+        return sum(os.path.getsize(self.path + suffix) for suffix in ("", "-wal")
+                   if os.path.exists(self.path + suffix))
+
+    def import_chat_history(self, path: str, overwrite: bool = False) -> int:
+        """
+        One-shot import of the old chat_history.json layout
+        ({"chats": {id: {"name", "messages": [{"role", "content"}]}}}).
+        Chats already in the store are skipped unless `overwrite`. Returns the chats imported.
+        """
+        with open(path, encoding="utf-8") as f:
+            chats = json.load(f).get("chats", {})
+        self.flush()
+        now = time.time()
+        imported = 0
+        conn = self._connect()
+        try:
+            with conn:
+                for session_id, chat in chats.items():
+                    exists = conn.execute("SELECT 1 FROM conversations WHERE session_id = ?",
+                                          (session_id,)).fetchone()
+                    if exists and not overwrite:
+                        continue
+                    messages = [m for m in chat.get("messages", []) if m.get("content")]
+                    conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+                    conn.executemany("INSERT INTO turns VALUES (?, ?, ?, ?, ?)",
+                                     [(session_id, seq, m["role"], m["content"], now)
+                                      for seq, m in enumerate(messages)])
+                    conn.execute("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?, ?)",
+                                 (session_id, chat.get("name"), now, now, len(messages)))
+                    imported += 1
+        finally:
+            conn.close()
+        return imported
+
+    def close(self):
+        """Commit what is queued and stop the writer."""
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import, compact or list the conversation store.")
+    parser.add_argument("--db", default="data/conversations.db")
+    commands = parser.add_subparsers(dest="command", required=True)
+    imp = commands.add_parser("import", help="Import an old chat_history.json")
+    imp.add_argument("path", nargs="?", default="chat_history.json")
+    imp.add_argument("--overwrite", action="store_true")
+    compact = commands.add_parser("compact", help="Trim old turns and sessions, then VACUUM")
+    compact.add_argument("--keep-last", type=int, default=None, help="Messages kept per session")
+    compact.add_argument("--max-age-days", type=float, default=None)
+    commands.add_parser("list", help="Most recently updated conversations")
+    args = parser.parse_args()
+
+    store = ConversationStore(args.db)
+    try:
+        if args.command == "import":
+            print(f"Imported {store.import_chat_history(args.path, overwrite=args.overwrite)} chats into {args.db}")
+        elif args.command == "compact":
+            result = store.compact(keep_last=args.keep_last, max_age_days=args.max_age_days)
+            print(f"Removed {result['turns_removed']} turns and {result['sessions_removed']} sessions; "
+                  f"{result['bytes_before'] / 2**20:.1f} MB -> {result['bytes_after'] / 2**20:.1f} MB")
+        else:
+            for chat in store.conversations():
+                updated = time.strftime("%Y-%m-%d %H:%M", time.localtime(chat["updated"]))
+                print(f"{chat['session_id']:<36} {updated}  {chat['n_turns']:>5} msgs  {chat['name'] or ''}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
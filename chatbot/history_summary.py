@@ -0,0 +1,121 @@
+# chatbot/history_summary.py
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Instructions of the summarization request, per language
+SUMMARY_INSTRUCTIONS = {
+    "fa": ("خلاصه‌ای کوتاه از گفتگوی درمانی زیر بنویس: نگرانی‌ها و احساسات مراجع، "
+           "اطلاعات مهمی که گفته و توصیه‌هایی که درمانگر داده است. فقط خلاصه را بنویس."),
+    "en": ("Summarize the therapy conversation below in a few sentences: the client's concerns "
+           "and feelings, important facts they shared, and the advice the therapist already gave. "
+           "Write only the summary."),
+}
+ROLE_LABELS = {
+    "fa": {"user": "مراجع", "assistant": "درمانگر"},
+    "en": {"user": "Client", "assistant": "Therapist"},
+}
+PREVIOUS_LABEL = {"fa": "خلاصه‌ی قبلی", "en": "Earlier summary"}
+
+
+class HistorySummarizer:
+    """
+    Fold the older turns of a long conversation into a running summary.
+
+    After a reply has been delivered, a session whose history is over
+    `threshold_tokens` gets a background job that summarizes everything but the
+    newest `keep_recent` messages (together with the previous summary) in at
+    most `max_tokens` tokens. The summary then stands in for those turns, so
+    the prompt stops growing with the conversation.
+    """
+
+    def __init__(self, counter, generate, threshold_tokens: int = 768, keep_recent: int = 4,
+                 max_tokens: int = 160):
+        """
+        Parameters:
+            counter (TokenCounter): Memoized token counter
+            generate (callable): (model_name, messages, max_tokens, stop) -> text; runs the model
+            threshold_tokens (int): History size that triggers a fold
+            keep_recent (int): Newest messages that always stay verbatim
+            max_tokens (int): Generation budget of a summary
+        """
+        self.counter = counter
+        self.generate = generate
+        self.threshold_tokens = threshold_tokens
+        self.keep_recent = keep_recent
+        self.max_tokens = max_tokens
+        # One summary at a time: they share the models with live requests
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarize")
+        self._running = set()  # session ids with a queued or running fold
+        self._futures = set()
+        self._lock = threading.Lock()
+        self.summaries = 0
+        self.folded_messages = 0
+        self.failures = 0
+        self.seconds = 0.0
+
+    def history_tokens(self, llm, history: list) -> int:
+        return sum(self.counter.count(llm, message["content"]) for message in history)
+
+    def schedule(self, sessions, session, llm, model_name: str, language: str):
+        """Queue a fold of the session's older turns if its history is over the threshold."""
+        history = list(session.history)
+        if len(history) <= self.keep_recent or self.history_tokens(llm, history) <= self.threshold_tokens:
+            return None
+        # Keep the verbatim part starting with a question
+        cut = len(history) - self.keep_recent
+        while cut < len(history) and history[cut]["role"] == "assistant":
+            cut += 1
+        with self._lock:
+            if session.session_id in self._running:
+                return None
+            self._running.add(session.session_id)
+            future = self._executor.submit(self._fold, sessions, session, history[:cut], model_name,
+                                           "fa" if language == "fa" else "en")
+            self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        return future
+
+    def _fold(self, sessions, session, messages: list, model_name: str, language: str):
+        start = time.perf_counter()
+        try:
+            summary = self.generate(model_name, self.build_messages(session.summary, messages, language),
+                                    self.max_tokens, [f"{label}:" for label in ROLE_LABELS[language].values()])
+            summary = summary.strip()
+            if summary and sessions.fold(session, messages, summary):
+                self.summaries += 1
+                self.folded_messages += len(messages)
+        except Exception:
+            self.failures += 1  # The turns stay verbatim; the next reply retries
+        finally:
+            self.seconds += time.perf_counter() - start
+            with self._lock:
+                self._running.discard(session.session_id)
+
+    @staticmethod
+    def build_messages(previous: str, messages: list, language: str) -> list:
+        """Chat messages of a summarization request."""
+        labels = ROLE_LABELS[language]
+        transcript = "\n".join(f"{labels.get(m['role'], m['role'])}: {m['content'].strip()}" for m in messages)
+        if previous:
+            transcript = f"{PREVIOUS_LABEL[language]}:\n{previous}\n\n{transcript}"
+        return [
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS[language]},
+            {"role": "user", "content": transcript},
+        ]
+
+    def wait(self):
+        """Block until the queued folds have finished (benchmarks and shutdown)."""
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.exception()
+
+    def stats(self) -> dict:
+        return {
+            "summaries": self.summaries,
+            "folded_messages": self.folded_messages,
+            "failures": self.failures,
+            "seconds": self.seconds,
+        }
@@ -0,0 +1,222 @@
+# chatbot/llama_server.py
+
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Where a CMake build of the vendored llama.cpp puts the server binary
+DEFAULT_SERVER_PATH = os.path.join(BASE_DIR, "llama.cpp", "build", "bin", "llama-server")
+
+HEALTH_TIMEOUT = 300  # Seconds a large model may take to load before the server answers /health
+
+
+def free_port(host: str = "127.0.0.1") -> int:
+    """A TCP port nobody listens on right now."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+class LlamaServerProcess:
+    """
+    A llama-server child process (same flags and health polling as
+    llama.cpp/examples/server/tests/utils.py ServerProcess).
+    """
+
+    def __init__(self, model_file: str, n_ctx: int, n_slots: int = 4, n_gpu_layers: int = 0,
+                 n_threads: int = None, n_threads_batch: int = None, n_batch: int = None,
+                 type_k: str = None, type_v: str = None, flash_attn: bool = False,
+                 host: str = "127.0.0.1", port: int = None, server_path: str = None, log_path: str = None):
+        """
+        Parameters:
+            model_file (str): GGUF model to serve
+            n_ctx (int): Context per slot; the server gets n_ctx * n_slots and splits it evenly
+            n_slots (int): Parallel sequences decoded together (continuous batching)
+            server_path (str): llama-server binary (default: $LLAMA_SERVER_BIN_PATH or the vendored build)
+            log_path (str): File for the server's output (default: discarded)
+        """
+        self.model_file = model_file
+        self.n_ctx = n_ctx
+        self.n_slots = n_slots
+        self.n_gpu_layers = n_gpu_layers
+        self.n_threads = n_threads
+        self.n_threads_batch = n_threads_batch
+        self.n_batch = n_batch
+        self.type_k = type_k
+        self.type_v = type_v
+        self.flash_attn = flash_attn
+        self.host = host
+        self.port = port
+        self.server_path = server_path or os.environ.get("LLAMA_SERVER_BIN_PATH", DEFAULT_SERVER_PATH)
+        self.log_path = log_path
+        self.process = None
+        self.restarts = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def args(self) -> list:
+        args = [
+            self.server_path,
+            "--host", self.host,
+            "--port", self.port,
+            "--model", self.model_file,
+            "--ctx-size", self.n_ctx * self.n_slots,
+            "--parallel", self.n_slots,
+            "--cont-batching",
+            "--n-gpu-layers", self.n_gpu_layers,
+            "--metrics",
+            "--no-webui",
+        ]
+        if self.n_threads:
+            args.extend(["--threads", self.n_threads])
+        if self.n_threads_batch:
+            args.extend(["--threads-batch", self.n_threads_batch])
+        if self.n_batch:
+            args.extend(["--batch-size", self.n_batch])
+        if self.type_k:
+            args.extend(["-ctk", self.type_k])
+        if self.type_v:
+            args.extend(["-ctv", self.type_v])
+        if self.flash_attn:
+            args.append("-fa")
+        return [str(arg) for arg in args]
+
+    def start(self, timeout: float = HEALTH_TIMEOUT):
+        """Spawn the server and wait until /health answers 200 (it answers 503 while loading)."""
+        if self.port is None:
+            self.port = free_port(self.host)
+        log = open(self.log_path, "ab") if self.log_path else subprocess.DEVNULL
+        self.process = subprocess.Popen(self.args(), stdout=log, stderr=subprocess.STDOUT)
+
+        start = time.time()
+        while time.time() - start < timeout:
+            try:
+                if requests.get(self.base_url + "/health", timeout=2).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            if self.process.poll() is not None:
+                raise RuntimeError(f"llama-server exited with code {self.process.returncode} "
+                                   f"while loading {os.path.basename(self.model_file)}")
+            time.sleep(0.5)
+        self.stop()
+        raise TimeoutError(f"llama-server did not become healthy within {timeout:.0f}s")
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self, grace: float = 5.0):
+        """Terminate the server, killing it if it does not exit within `grace` seconds."""
+        if self.process is None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(grace)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def restart(self):
+        self.stop()
+        self.restarts += 1
+        self.start()
+
+
+class LlamaServerModel:
+    """
+    Llama-compatible client of a llama-server process: the subset of llama_cpp.Llama
+    TherapyChatbot uses (__call__, create_chat_completion, tokenize, n_ctx), with the
+    same response dicts. Connections are pooled and kept alive, one per slot.
+
+    Unlike the in-process model, up to `n_slots` requests may run at once; the
+    server batches their decoding. Its own prompt cache replaces PrefixStateCache.
+    """
+
+    def __init__(self, model_path: str, n_ctx: int, n_slots: int = 4, request_timeout: float = 600.0,
+                 **server_options):
+        self.model_path = model_path
+        self.n_slots = n_slots
+        self._n_ctx = n_ctx
+        self.request_timeout = request_timeout
+        self.server = LlamaServerProcess(model_path, n_ctx, n_slots=n_slots, **server_options)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=n_slots + 2)  # Slots + tokenize calls
+        self.session.mount("http://", adapter)
+        self._restart_lock = threading.Lock()
+        self.server.start()
+
+    def n_ctx(self) -> int:
+        """Context of one slot."""
+        return self._n_ctx
+
+    def _post(self, path: str, body: dict, stream: bool = False):
+        """POST with one restart-and-retry when the server process has died."""
+        for attempt in (0, 1):
+            try:
+                response = self.session.post(self.server.base_url + path, json=body, stream=stream,
+                                             timeout=(5, self.request_timeout))
+                response.raise_for_status()
+                return response
+            except requests.ConnectionError:
+                if attempt or self.server.alive():
+                    raise
+                with self._restart_lock:
+                    if not self.server.alive():  # Another thread may have restarted it already
+                        self.server.restart()
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> list:
+        body = {"content": text.decode("utf-8", errors="ignore"), "add_special": add_bos}
+        return self._post("/tokenize", body).json()["tokens"]
+
+    def apply_chat_template(self, messages: list) -> str:
+        """The prompt text the server's chat template makes of `messages` (for exact token counts)."""
+        return self._post("/apply-template", {"messages": messages}).json()["prompt"]
+
+    @staticmethod
+    def _events(response):
+        """Parsed `data:` events of an SSE response, up to [DONE]."""
+        try:
+            for line in response.iter_lines():
+                if not line.startswith(b"data: "):
+                    continue
+                data = line[6:]
+                if data == b"[DONE]":
+                    break
+                yield json.loads(data)
+        finally:
+            response.close()  # Closing mid-stream makes the server stop the slot's generation
+
+    def _request(self, path: str, body: dict, stream: bool):
+        body = dict(body, stream=stream, cache_prompt=True)
+        response = self._post(path, body, stream=stream)
+        return self._events(response) if stream else response.json()
+
+    def __call__(self, prompt: str, max_tokens: int = 16, stream: bool = False, **params):
+        return self._request("/v1/completions", dict(params, prompt=prompt, max_tokens=max_tokens), stream)
+
+    def create_chat_completion(self, messages: list, max_tokens: int = None, stream: bool = False, **params):
+        body = dict(params, messages=messages)
+        if max_tokens is not None:
+            body["max_tokens"] = max_tokens
+        return self._request("/v1/chat/completions", body, stream)
+
+    def close(self):
+        self.session.close()
+        self.server.stop()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
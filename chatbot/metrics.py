@@ -0,0 +1,209 @@
+# chatbot/metrics.py
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Upper bounds (seconds) of the latency histogram buckets, from cache hits to long generations
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _NullSpan:
+    """Span of a disabled registry: entering and leaving does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, metrics, name: str, labels: dict):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Histogram:
+    """
+    Cumulative Prometheus buckets plus a window of the most recent samples,
+    from which live percentiles are computed.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window: int = 2048):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def percentiles(self, ps=(50, 95, 99)) -> dict:
+        if not self.recent:
+            return {f"p{p}": 0.0 for p in ps}
+        values = np.percentile(np.fromiter(self.recent, dtype=float), ps)
+        return {f"p{p}": float(v) for p, v in zip(ps, values)}
+
+
+def _label_text(labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{str(value)}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+class Metrics:
+    """
+    Timing histograms and counters keyed by (name, labels), exported in the
+    Prometheus text format, with an optional JSONL trace of every request.
+
+    A disabled registry returns before touching any state, so the calls left in
+    the request path cost a function call each.
+    """
+
+    def __init__(self, enabled: bool = False, trace_path: str = None, namespace: str = "chatbot"):
+        """
+        Parameters:
+            enabled (bool): Record anything at all
+            trace_path (str): JSONL file that gets one line per request (None disables)
+            namespace (str): Prefix of the exported metric names
+        """
+        self.enabled = enabled
+        self.namespace = namespace
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}    # (name, labels) -> float
+        self.collectors = []  # callables returning [(name, type, labels dict, value)] at export time
+        self._lock = threading.Lock()
+        self._trace = None
+        if enabled and trace_path:
+            os.makedirs(os.path.dirname(trace_path) or ".", exist_ok=True)
+            self._trace = open(trace_path, "a", encoding="utf-8")
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted(labels.items()))
+
+    def span(self, name: str, **labels):
+        """Context manager that observes its duration (seconds) in histogram `name`."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, labels)
+
+    def observe(self, name: str, seconds: float, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record_request(self, stages: dict, counters: dict, **labels):
+        """
+        Observe every stage of a finished request in the "stage_seconds" histogram,
+        add its counters, and append it to the trace.
+        """
+        if not self.enabled:
+            return
+        for stage, seconds in stages.items():
+            self.observe("stage_seconds", seconds, stage=stage, **labels)
+        self.inc("requests", **labels)
+        for name, value in counters.items():
+            self.inc(name, value, **labels)
+        if self._trace is not None:
+            line = json.dumps({"ts": time.time(), **labels, "stages": stages, "counters": counters},
+                              ensure_ascii=False)
+            with self._lock:
+                self._trace.write(line + "\n")
+                self._trace.flush()
+
+    def add_collector(self, collector):
+        """
+        Register a callable returning [(name, "counter" or "gauge", labels, value)],
+        exported as they are. Components that already count (caches) are read this way.
+        """
+        self.collectors.append(collector)
+
+    def percentiles(self, name: str = "stage_seconds") -> dict:
+        """{labels: {"p50", "p95", "p99", "count"}} of a histogram, for live display."""
+        with self._lock:
+            return {labels: dict(h.percentiles(), count=h.count)
+                    for (hist_name, labels), h in self.histograms.items() if hist_name == name}
+
+    def counter_values(self) -> dict:
+        with self._lock:
+            return dict(self.counters)
+
+    def prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        seen = set()
+        for (name, labels), h in histograms:
+            full = f"{self.namespace}_{name}"
+            if full not in seen:
+                lines.append(f"# TYPE {full} histogram")
+                seen.add(full)
+            cumulative = 0
+            for bound, count in zip(h.buckets, h.counts):
+                cumulative += count
+                lines.append(f"{full}_bucket{_label_text(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{full}_bucket{_label_text(labels + (('le', '+Inf'),))} {h.count}")
+            lines.append(f"{full}_sum{_label_text(labels)} {h.sum}")
+            lines.append(f"{full}_count{_label_text(labels)} {h.count}")
+
+        for (name, labels), value in counters:
+            full = f"{self.namespace}_{name}_total"
+            if full not in seen:
+                lines.append(f"# TYPE {full} counter")
+                seen.add(full)
+            lines.append(f"{full}{_label_text(labels)} {value}")
+
+        for collector in self.collectors:
+            for name, kind, labels, value in collector():
+                full = f"{self.namespace}_{name}"
+                if full not in seen:
+                    lines.append(f"# TYPE {full} {kind}")
+                    seen.add(full)
+                lines.append(f"{full}{_label_text(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
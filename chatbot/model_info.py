@@ -0,0 +1,219 @@
+# chatbot/model_info.py
+
+import os
+import re
+import sys
+from collections import Counter
+
+import psutil
+
+# The gguf-py package vendored with llama.cpp reads GGUF headers without loading weights
+_GGUF_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "llama.cpp", "gguf-py")
+if _GGUF_PY not in sys.path:
+    sys.path.append(_GGUF_PY)
+from gguf import GGML_QUANT_SIZES, GGMLQuantizationType, GGUFReader, LlamaFileType
+
+# KV cache element types accepted by llama.cpp (type_k / type_v)
+KV_TYPES = {
+    "f32": GGMLQuantizationType.F32,
+    "f16": GGMLQuantizationType.F16,
+    "q8_0": GGMLQuantizationType.Q8_0,
+    "q5_1": GGMLQuantizationType.Q5_1,
+    "q5_0": GGMLQuantizationType.Q5_0,
+    "q4_1": GGMLQuantizationType.Q4_1,
+    "q4_0": GGMLQuantizationType.Q4_0,
+}
+
+# KV cache of a model without explicit settings (llama.cpp defaults)
+DEFAULT_KV_CACHE = {"type_k": "f16", "type_v": "f16", "flash_attn": False}
+
+_LAYER = re.compile(r"^blk\.(\d+)\.")
+
+
+def bytes_per_element(type_name: str) -> float:
+    """Storage cost of one element of a GGML type (block bytes / block size)."""
+    block_size, type_size = GGML_QUANT_SIZES[KV_TYPES[type_name.lower()]]
+    return type_size / block_size
+
+
+def kv_cache_options(value) -> dict:
+    """
+    Normalize a per-model KV cache setting: None -> f16 K/V without flash attention,
+    dict -> defaults updated with the given keys (type_k, type_v, flash_attn).
+    Raises ValueError for unknown types and for a quantized V cache without flash
+    attention, which llama.cpp refuses to create.
+    """
+    options = dict(DEFAULT_KV_CACHE)
+    options.update(value or {})
+    for key in ("type_k", "type_v"):
+        options[key] = options[key].lower()
+        if options[key] not in KV_TYPES:
+            raise ValueError(f"Unsupported KV cache type {options[key]!r}; use one of {', '.join(KV_TYPES)}")
+    if options["type_v"] not in ("f16", "f32") and not options["flash_attn"]:
+        raise ValueError(f"A {options['type_v']} V cache needs flash_attn=True")
+    return options
+
+
+def ggml_type(type_name: str) -> int:
+    """GGML type id of a KV cache type, as Llama(type_k=..., type_v=...) expects."""
+    return int(KV_TYPES[type_name.lower()])
+
+
+class ModelInfo:
+    """Architecture and tensor sizes of a GGUF model, read from its header only."""
+
+    def __init__(self, model_path: str):
+        reader = GGUFReader(model_path)  # Memory-maps the file; tensor data is not read
+
+        def field(key, default=None):
+            f = reader.get_field(key)
+            return f.contents() if f is not None else default
+
+        self.path = model_path
+        self.architecture = field("general.architecture", "llama")
+        arch = self.architecture
+        self.name = field("general.name", os.path.basename(model_path))
+        self.size_label = field("general.size_label")
+        file_type = field("general.file_type")
+        self.file_type = LlamaFileType(file_type).name if file_type is not None else None
+
+        self.n_layer = int(field(f"{arch}.block_count"))
+        self.n_ctx_train = int(field(f"{arch}.context_length", 4096))
+        self.n_embd = int(field(f"{arch}.embedding_length"))
+        self.n_ff = int(field(f"{arch}.feed_forward_length", 4 * self.n_embd))
+        self.n_head = int(field(f"{arch}.attention.head_count"))
+        self.n_head_kv = int(field(f"{arch}.attention.head_count_kv", self.n_head))
+        self.head_dim_k = int(field(f"{arch}.attention.key_length", self.n_embd // self.n_head))
+        self.head_dim_v = int(field(f"{arch}.attention.value_length", self.n_embd // self.n_head))
+        tokens = reader.get_field("tokenizer.ggml.tokens")
+        self.n_vocab = len(tokens.data) if tokens is not None else int(field(f"{arch}.vocab_size", 32000))
+
+        # Weight bytes per repeating layer and outside the layers
+        self.layer_bytes = [0] * self.n_layer
+        self.other_bytes = 0       # token embeddings, output norm
+        self.output_bytes = 0      # output projection (offloaded last)
+        self.quant_types = Counter()
+        self.n_params = 0
+        for tensor in reader.tensors:
+            n_bytes = int(tensor.n_bytes)
+            self.quant_types[tensor.tensor_type.name] += n_bytes
+            self.n_params += int(tensor.n_elements)
+            match = _LAYER.match(tensor.name)
+            if match and int(match.group(1)) < self.n_layer:
+                self.layer_bytes[int(match.group(1))] += n_bytes
+            elif tensor.name.startswith("output."):
+                self.output_bytes += n_bytes
+            else:
+                self.other_bytes += n_bytes
+
+        if not self.size_label:
+            self.size_label = (f"{round(self.n_params / 1e9)}B" if self.n_params >= 1e9
+                               else f"{round(self.n_params / 1e6)}M")
+
+    @property
+    def weight_bytes(self) -> int:
+        return sum(self.layer_bytes) + self.other_bytes + self.output_bytes
+
+    def kv_bytes_per_layer(self, n_ctx: int, type_k: str = "f16", type_v: str = "f16") -> int:
+        """K and V cache of one layer for n_ctx positions."""
+        per_token = self.n_head_kv * (self.head_dim_k * bytes_per_element(type_k)
+                                      + self.head_dim_v * bytes_per_element(type_v))
+        return int(n_ctx * per_token)
+
+    def kv_bytes(self, n_ctx: int, type_k: str = "f16", type_v: str = "f16") -> int:
+        return self.n_layer * self.kv_bytes_per_layer(n_ctx, type_k, type_v)
+
+    def scratch_bytes(self, n_ctx: int, n_batch: int = 512, flash_attn: bool = False,
+                      logits_all: bool = False) -> int:
+        """
+        Working memory of one forward pass over n_batch tokens (float32 activations):
+        hidden states and feed-forward intermediates, the attention score matrix
+        (not materialized with flash attention) and the logits llama_cpp keeps.
+        """
+        activations = 4 * n_batch * (4 * self.n_embd + 2 * self.n_ff)
+        attention = 0 if flash_attn else 4 * n_batch * n_ctx * self.n_head
+        logits = 4 * self.n_vocab * (n_ctx if logits_all else n_batch)
+        return activations + attention + logits
+
+    def plan(self, n_ctx: int, n_gpu_layers: int, type_k: str = "f16", type_v: str = "f16",
+             n_batch: int = 512, flash_attn: bool = False, logits_all: bool = False) -> dict:
+        """
+        Bytes needed on the GPU and in host RAM for a configuration.
+        Offloaded layers keep their weights and KV cache on the GPU; the output
+        projection is offloaded once n_gpu_layers exceeds the block count.
+        """
+        n_gpu = max(0, min(n_gpu_layers, self.n_layer))
+        kv_layer = self.kv_bytes_per_layer(n_ctx, type_k, type_v)
+        gpu_weights = sum(self.layer_bytes[self.n_layer - n_gpu:]) if n_gpu else 0
+        if n_gpu_layers > self.n_layer:
+            gpu_weights += self.output_bytes
+        scratch = self.scratch_bytes(n_ctx, n_batch, flash_attn, logits_all)
+
+        plan = {
+            "weights_gpu": gpu_weights,
+            "weights_cpu": self.weight_bytes - gpu_weights,
+            "kv_gpu": n_gpu * kv_layer,
+            "kv_cpu": (self.n_layer - n_gpu) * kv_layer,
+            # The compute buffer lives on the GPU as soon as anything is offloaded
+            "scratch_gpu": scratch if n_gpu else 0,
+            "scratch_cpu": 0 if n_gpu else scratch,
+        }
+        plan["gpu"] = plan["weights_gpu"] + plan["kv_gpu"] + plan["scratch_gpu"]
+        plan["cpu"] = plan["weights_cpu"] + plan["kv_cpu"] + plan["scratch_cpu"]
+        return plan
+
+    def fit(self, n_ctx: int, n_gpu_layers: int, gpu_budget, ram_budget: int,
+            min_ctx: int = 512, **kwargs) -> tuple:
+        """
+        Largest (n_ctx, n_gpu_layers) not above the requested values that fits both budgets.
+        Offload is reduced first (the layers move to RAM); the context is halved only
+        when RAM cannot hold the model at the requested size. A gpu_budget of None
+        (free VRAM unknown) keeps the requested offload.
+        Raises MemoryError if even min_ctx on the CPU does not fit.
+        """
+        n_ctx = min(n_ctx, self.n_ctx_train)
+        while True:
+            n_gpu = min(n_gpu_layers, self.n_layer + 1)
+            while (gpu_budget is not None and n_gpu > 0
+                   and self.plan(n_ctx, n_gpu, **kwargs)["gpu"] > gpu_budget):
+                n_gpu -= 1
+            if self.plan(n_ctx, n_gpu, **kwargs)["cpu"] <= ram_budget:
+                return n_ctx, n_gpu
+            if n_ctx <= min_ctx:
+                raise MemoryError(
+                    f"{os.path.basename(self.path)} needs {self.plan(n_ctx, n_gpu, **kwargs)['cpu'] / 2**30:.1f} GB "
+                    f"of RAM at n_ctx={n_ctx}; only {ram_budget / 2**30:.1f} GB available")
+            n_ctx = max(min_ctx, n_ctx // 2)
+
+    def summary(self) -> str:
+        quant = ", ".join(f"{name} {n / 2**30:.2f} GB" for name, n in self.quant_types.most_common())
+        return (f"{self.name} ({self.architecture}, {self.size_label}, {self.file_type}): "
+                f"{self.n_layer} layers, n_embd {self.n_embd}, heads {self.n_head}/{self.n_head_kv}, "
+                f"vocab {self.n_vocab}, trained ctx {self.n_ctx_train}; weights {self.weight_bytes / 2**30:.2f} GB [{quant}]")
+
+
+_INFO_CACHE = {}
+
+
+def inspect_model(model_path: str) -> ModelInfo:
+    """ModelInfo of a file, cached by path, size and modification time."""
+    stat = os.stat(model_path)
+    key = (os.path.abspath(model_path), stat.st_size, stat.st_mtime)
+    if key not in _INFO_CACHE:
+        _INFO_CACHE[key] = ModelInfo(model_path)
+    return _INFO_CACHE[key]
+
+
+def available_memory(headroom: float = 0.9) -> tuple:
+    """
+    (free GPU bytes, available RAM bytes), each scaled by `headroom`.
+    Free VRAM is None when torch cannot query a CUDA device.
+    """
+    gpu = None
+    try:
+        import torch.cuda as cuda
+        if cuda.is_available():
+            gpu = int(cuda.mem_get_info()[0] * headroom)
+    except ImportError:
+        pass
+    return gpu, int(psutil.virtual_memory().available * headroom)
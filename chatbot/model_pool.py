@@ -0,0 +1,149 @@
+# chatbot/model_pool.py
+
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def estimate_model_bytes(model_path: str) -> int:
+    """
+    Rough resident size of a loaded GGUF model.
+    The weights are the file itself; ~10% is added for KV cache and scratch buffers.
+    """
+    return int(os.path.getsize(model_path) * 1.1)
+
+
+class _Loading:
+    """A load in progress that other requests for the same model wait on."""
+
+    __slots__ = ("done", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class ModelPool:
+    """
+    Keep several loaded models resident up to a RAM budget.
+    When a new model does not fit, the least recently used ones are evicted.
+    """
+
+    def __init__(self, model_paths: dict, loader, ram_budget_gb: float = None,
+                 size_estimator=estimate_model_bytes, on_evict=None):
+        """
+        Parameters:
+            model_paths (dict): Model name -> GGUF file path
+            loader (callable): Function that loads a model from a path
+            ram_budget_gb (float): Total RAM the resident models may use.
+                None keeps a single model resident (the old behaviour).
+            size_estimator (callable): Function that estimates a model's resident bytes
+            on_evict (callable): Called with (name, path) after a model leaves the pool
+        """
+        self.model_paths = model_paths
+        self.loader = loader
+        self.ram_budget_bytes = int(ram_budget_gb * 1024 ** 3) if ram_budget_gb else None
+        self.size_estimator = size_estimator
+        self.on_evict = on_evict
+
+        # name -> (model, estimated bytes); order is least -> most recently used
+        self._models = OrderedDict()
+        self._loading = {}  # name -> _Loading of a load in progress
+        self._lock = threading.Lock()
+
+        self.load_times = {}  # model name -> seconds of its last load from disk
+
+    def get(self, name: str, timing: dict = None):
+        """
+        Return the model with this name, loading it (and evicting others) if needed.
+        Loading and eviction run outside the pool lock, so requests for resident
+        models are not held up by another model's load; concurrent requests for
+        the model being loaded wait for that one load.
+        When `timing` is given, the seconds this call took and whether it loaded
+        the model from disk are stored in it ("seconds", "loaded").
+        """
+        timing = {} if timing is None else timing
+        if name not in self.model_paths:
+            raise ValueError(f"Model '{name}' not found.")
+
+        start = time.perf_counter()
+        while True:
+            with self._lock:
+                # Already warm: just mark as most recently used
+                if name in self._models:
+                    self._models.move_to_end(name)
+                    timing.update(seconds=time.perf_counter() - start, loaded=False)
+                    return self._models[name][0]
+                loading = self._loading.get(name)
+                if loading is None:
+                    loading = self._loading[name] = _Loading()
+                    break
+            # Another thread is loading it: wait, then look again
+            loading.done.wait()
+            if loading.error is not None:
+                raise loading.error
+
+        try:
+            path = self.model_paths[name]
+            needed = self.size_estimator(path)
+            self._evict_for(needed)
+
+            model = self.loader(path)
+            elapsed = time.perf_counter() - start
+            # Models loaded meanwhile by other threads may have used up the budget
+            self._evict_for(needed)
+            with self._lock:
+                self._models[name] = (model, needed)
+                self.load_times[name] = elapsed
+            timing.update(seconds=elapsed, loaded=True)
+            return model
+        except BaseException as e:
+            loading.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._loading[name]
+            loading.done.set()
+
+    def _evict_for(self, needed: int):
+        """Evict least recently used models until `needed` bytes fit in the budget."""
+        evicted = []
+        with self._lock:
+            while self._models:
+                if self.ram_budget_bytes is not None and self.resident_bytes() + needed <= self.ram_budget_bytes:
+                    break
+                # popitem(last=False) removes the least recently used entry
+                name, _ = self._models.popitem(last=False)
+                evicted.append(name)
+        # Owners may wait for requests still running on an evicted model: not under the lock
+        for name in evicted:
+            self._evicted(name)
+        if evicted:
+            gc.collect()  # Free the evicted model's memory before loading the next one
+
+    def evict(self, name: str):
+        """Drop a model from the pool if it is resident."""
+        with self._lock:
+            removed = self._models.pop(name, None) is not None
+        if removed:
+            self._evicted(name)
+            gc.collect()
+
+    def _evicted(self, name: str):
+        """Notify the owner so it can drop anything tied to the evicted model."""
+        if self.on_evict is not None:
+            self.on_evict(name, self.model_paths[name])
+
+    def is_loaded(self, name: str) -> bool:
+        """Check whether a model is currently resident."""
+        return name in self._models
+
+    def resident(self) -> list:
+        """Names of resident models, least recently used first."""
+        return list(self._models.keys())
+
+    def resident_bytes(self) -> int:
+        """Estimated bytes used by all resident models."""
+        return sum(size for _, size in self._models.values())
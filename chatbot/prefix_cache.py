@@ -0,0 +1,140 @@
+# chatbot/prefix_cache.py
+
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+from llama_cpp.llama_cache import BaseLlamaCache
+
+
+def hash_tokens(tokens) -> str:
+    """Stable hash of a token sequence, used as the cache key."""
+    data = np.asarray(tokens, dtype=np.intc).tobytes()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def common_prefix_length(a: np.ndarray, b: np.ndarray) -> int:
+    """Length of the common prefix of two token arrays (vectorized)."""
+    n = min(len(a), len(b))
+    if n == 0:
+        return 0
+    mismatch = np.flatnonzero(a[:n] != b[:n])
+    return int(mismatch[0]) if len(mismatch) else n
+
+
+class PrefixStateCache(BaseLlamaCache):
+    """
+    Byte-bounded LRU cache of llama.cpp states keyed by a hash of their token prefix.
+
+    llama_cpp looks the cache up before every completion. The entry sharing the
+    longest token prefix with the new prompt is restored, so only the remaining
+    suffix (e.g. a new question after the fixed system instructions) is prefilled.
+    """
+
+    def __init__(self, capacity_bytes: int = (2 << 30), min_prefix_tokens: int = 16):
+        super().__init__(capacity_bytes)
+        self.min_prefix_tokens = min_prefix_tokens  # Shorter matches are not worth a restore
+        self._llm = None  # Weak reference to the model this cache belongs to (set by bind)
+
+        # hash -> (tokens, state, bytes); order is least -> most recently used
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.prefill_tokens_saved = 0
+
+    def bind(self, llm):
+        """Attach the cache to a model so restores are only counted when they help."""
+        self._llm = weakref.ref(llm)
+        llm.set_cache(self)
+        return self
+
+    @property
+    def cache_size(self) -> int:
+        return self._size
+
+    def _find_longest_prefix_key(self, key):
+        """Return (hash, prefix length) of the entry sharing the longest prefix with key."""
+        tokens = np.asarray(key, dtype=np.intc)
+        best_key, best_len = None, 0
+        for entry_key, (entry_tokens, _, _) in self._entries.items():
+            length = common_prefix_length(entry_tokens, tokens)
+            if length > best_len:
+                best_key, best_len = entry_key, length
+        return best_key, best_len
+
+    def _current_prefix_length(self, tokens: np.ndarray) -> int:
+        """Prefix the model already holds in its context (llama_cpp reuses it anyway)."""
+        llm = self._llm() if self._llm is not None else None
+        if llm is None or llm.n_tokens == 0:
+            return 0
+        return common_prefix_length(np.asarray(llm._input_ids, dtype=np.intc), tokens)
+
+    def __getitem__(self, key):
+        tokens = np.asarray(key, dtype=np.intc)
+        with self._lock:
+            entry_key, length = self._find_longest_prefix_key(tokens)
+            current = self._current_prefix_length(tokens)
+
+            # Only a restore that beats the model's live context is a real hit
+            if entry_key is None or length < self.min_prefix_tokens or length <= current:
+                self.misses += 1
+                raise KeyError("No useful cached prefix")
+
+            self._entries.move_to_end(entry_key)
+            self.hits += 1
+            self.prefill_tokens_saved += length - current
+            return self._entries[entry_key][1]
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            _, length = self._find_longest_prefix_key(np.asarray(key, dtype=np.intc))
+        return length >= self.min_prefix_tokens
+
+    def __setitem__(self, key, value):
+        # The key is prompt + completion; the saved KV only covers the evaluated tokens
+        tokens = np.asarray(key, dtype=np.intc)[:value.n_tokens]
+
+        # The saved logits are never read back: llama_cpp always re-evaluates the last
+        # prompt token after a restore. Keep a zero-byte view of the right shape instead
+        # of a (n_batch x n_vocab) float copy, which would dwarf the KV state itself.
+        value.scores = np.broadcast_to(np.zeros(value.scores.shape[1:], dtype=value.scores.dtype),
+                                       value.scores.shape)
+        nbytes = int(value.llama_state_size) + value.input_ids.nbytes + tokens.nbytes
+
+        with self._lock:
+            entry_key = hash_tokens(tokens)
+            old = self._entries.pop(entry_key, None)
+            if old is not None:
+                self._size -= old[2]
+            self._entries[entry_key] = (tokens, value, nbytes)
+            self._size += nbytes
+
+            # Evict least recently used states until we are back under budget
+            while self._size > self.capacity_bytes and self._entries:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+
+    def clear(self):
+        """Drop all cached states."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        """Hit/miss counters and memory use."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "capacity_bytes": self.capacity_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "prefill_tokens_saved": self.prefill_tokens_saved,
+        }
@@ -0,0 +1,258 @@
+# chatbot/prompt_packer.py
+
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+
+
+class TokenCounter:
+    """
+    Count tokens with a model's own tokenizer.
+    Counts are memoized per (model, text), so history turns and retrieved chunks
+    that come back on later requests are only tokenized once.
+    """
+
+    def __init__(self, max_entries: int = 8192):
+        self.max_entries = max_entries
+        self._counts = OrderedDict()  # (model path, text digest) -> token count
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, llm, text: str) -> int:
+        """Number of tokens `text` takes in `llm`'s vocabulary."""
+        if not text:
+            return 0
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=12).digest()
+        key = (getattr(llm, "model_path", id(llm)), digest)
+
+        with self._lock:
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                self.hits += 1
+                return self._counts[key]
+
+        n = len(llm.tokenize(text.encode("utf-8"), add_bos=False, special=False))
+
+        with self._lock:
+            self.misses += 1
+            self._counts[key] = n
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return n
+
+
+class PromptTooLong(ValueError):
+    """The instructions and the question alone leave no room for an answer."""
+
+
+def chat_prompt_counter(llm):
+    """
+    Function returning the exact prompt tokens of a message list on `llm`: its chat
+    template rendered and tokenized the way create_chat_completion does it. Uses
+    llama-server's own template (apply_chat_template) or the GGUF's
+    tokenizer.chat_template; None when the model has neither.
+    """
+    render = getattr(llm, "apply_chat_template", None)
+    if render is not None:
+        return lambda messages: len(llm.tokenize(render(messages).encode("utf-8"), add_bos=True, special=True))
+
+    template = (getattr(llm, "metadata", None) or {}).get("tokenizer.chat_template")
+    if not template:
+        return None
+
+    def token_text(token: int) -> str:
+        return llm.detokenize([token], special=True).decode("utf-8", errors="ignore") if token != -1 else ""
+
+    formatter = Jinja2ChatFormatter(template=template, eos_token=token_text(llm.token_eos()),
+                                    bos_token=token_text(llm.token_bos()))
+
+    def count(messages: list) -> int:
+        result = formatter(messages=messages)
+        return len(llm.tokenize(result.prompt.encode("utf-8"), add_bos=not result.added_special, special=True))
+    return count
+
+
+class PromptPacker:
+    """
+    Fill a fixed context window by priority:
+    system instructions, the question and generation headroom first (always kept),
+    then the newest history turns up to the history budget, then retrieved chunks
+    in rank order up to the context budget.
+
+    The chat-template tokens are measured from the model's template, and the
+    packed prompt is rendered and counted before it is used, so the reported
+    usage is the prompt the model will see. Models without a template fall back
+    to an estimate of MESSAGE_OVERHEAD tokens per message.
+    """
+
+    # Estimated chat-template tokens around each message (role header + end-of-turn)
+    MESSAGE_OVERHEAD = 8
+
+    def __init__(self, counter: TokenCounter, n_ctx: int, history_share: float = 0.25,
+                 context_share: float = 0.40, safety_margin: int = 32, min_generation: int = 64):
+        """
+        Parameters:
+            counter (TokenCounter): Memoized token counter
+            n_ctx (int): Context window of the model
+            history_share (float): Fraction of n_ctx history may use
+            context_share (float): Fraction of n_ctx retrieved chunks may use
+            safety_margin (int): Tokens left free when the template can only be estimated
+            min_generation (int): Fewest tokens left for the answer (llama_cpp reads
+                max_tokens <= 0 as "until the context is full")
+        """
+        self.counter = counter
+        self.n_ctx = n_ctx
+        self.history_share = history_share
+        self.context_share = context_share
+        self.safety_margin = safety_margin
+        self.min_generation = min_generation
+        self._templates = weakref.WeakKeyDictionary()  # llm -> (exact counter, scaffold, per-message tokens)
+        self._templates_lock = threading.Lock()
+
+    def template_costs(self, llm):
+        """
+        (exact prompt counter or None, tokens of the system + user message scaffolding
+        including BOS and the generation prompt, tokens around each further message).
+        """
+        with self._templates_lock:
+            if llm in self._templates:
+                return self._templates[llm]
+        exact, scaffold, per_message = None, 2 * self.MESSAGE_OVERHEAD, self.MESSAGE_OVERHEAD
+        try:
+            counter = chat_prompt_counter(llm)
+            if counter is not None:
+                a = self.counter.count(llm, "a")
+                probe = [{"role": "system", "content": "a"}, {"role": "user", "content": "a"}]
+                two = counter(probe)
+                three = counter(probe + [{"role": "assistant", "content": "a"}, {"role": "user", "content": "a"}])
+                exact, scaffold, per_message = counter, max(0, two - 2 * a), max(0, (three - two) // 2 - a)
+        except Exception:
+            pass  # Templates that reject the probe (e.g. no system role) keep the estimate
+        with self._templates_lock:
+            self._templates[llm] = (exact, scaffold, per_message)
+        return exact, scaffold, per_message
+
+    def pack(self, llm, instructions: str, question: str, history: list, chunks: list,
+             max_tokens: int, format_chunk, user_message=None) -> dict:
+        """
+        Choose the history messages and chunks that fit the budget.
+        The window is the smaller of n_ctx and the context the model was loaded
+        with, which load_model may have reduced to fit memory.
+
+        Parameters:
+            llm: Model whose tokenizer is used for counting
+            instructions (str): System prompt text
+            question (str): Current user question
+            history (list): Earlier messages, oldest first (without the question)
+            chunks (list): Retrieved chunks, best first
+            max_tokens (int): Requested generation length
+            format_chunk (callable): Turns a chunk into the text placed in the prompt
+            user_message (callable): (question, chunks) -> text of the last user message
+                (default: the formatted chunks followed by the question)
+
+        Returns:
+            dict: {"messages": [...], "history": [...], "chunks": [...], "max_tokens": int,
+                   "usage": {section: tokens}, "dropped": {section: count}}
+
+        Raises:
+            PromptTooLong: if the instructions and question leave fewer than
+                min_generation tokens (or max_tokens, if smaller) for the answer
+        """
+        count = lambda text: self.counter.count(llm, text)
+        if user_message is None:
+            user_message = lambda q, kept: "".join(format_chunk(chunk) for chunk in kept) + q
+        n_ctx = min(self.n_ctx, llm.n_ctx()) if hasattr(llm, "n_ctx") else self.n_ctx
+        exact, scaffold, per_message = self.template_costs(llm)
+        margin = 0 if exact is not None else self.safety_margin
+
+        system_tokens = count(instructions)
+        question_tokens = count(question)
+        fixed = system_tokens + count(user_message(question, [])) + scaffold + margin
+
+        # Generation headroom comes before optional sections, but never past the window
+        generation = min(max_tokens, n_ctx - fixed)
+        if generation < min(max_tokens, self.min_generation):
+            raise PromptTooLong(f"The prompt takes {fixed} of {n_ctx} tokens before any history; "
+                                f"{max(generation, 0)} are left for the answer")
+        free = n_ctx - fixed - generation
+
+        # Newest history first, stopping at the first turn that does not fit
+        # so the kept turns stay contiguous
+        history_limit = min(int(n_ctx * self.history_share), free)
+        history_tokens = 0
+        kept_history = []
+        for message in reversed(history):
+            cost = count(message["content"]) + per_message
+            if history_tokens + cost > history_limit:
+                break
+            kept_history.append(message)
+            history_tokens += cost
+        kept_history.reverse()
+        # A history that starts with an assistant turn reads as a dangling reply
+        while kept_history and kept_history[0]["role"] == "assistant":
+            history_tokens -= count(kept_history.pop(0)["content"]) + per_message
+        free -= history_tokens
+
+        # Chunks in rank order; a chunk too large for what is left is skipped
+        context_limit = min(int(n_ctx * self.context_share), free)
+        context_tokens = 0
+        kept_chunks = []
+        for chunk in chunks:
+            cost = count(format_chunk(chunk))
+            if context_tokens + cost > context_limit:
+                continue
+            kept_chunks.append(chunk)
+            context_tokens += cost
+
+        # Render and count the real prompt; the per-chunk costs above leave out the
+        # context header and tokenizer boundary effects, so trim until it fits
+        while True:
+            user_text = user_message(question, kept_chunks)
+            messages = [{"role": "system", "content": instructions}, *kept_history,
+                        {"role": "user", "content": user_text}]
+            history_tokens = sum(count(message["content"]) for message in kept_history)
+            if exact is not None:
+                prompt = exact(messages)
+            else:
+                prompt = system_tokens + history_tokens + count(user_text) + scaffold + len(kept_history) * per_message
+            if prompt + generation + margin <= n_ctx:
+                break
+            if kept_chunks:
+                kept_chunks.pop()  # Lowest-ranked chunk first
+            elif kept_history:
+                kept_history.pop(0)
+                while kept_history and kept_history[0]["role"] == "assistant":
+                    kept_history.pop(0)
+            else:
+                raise PromptTooLong(f"The prompt takes {prompt} of {n_ctx} tokens; "
+                                    f"{generation} are needed for the answer")
+
+        context_tokens = count(user_text) - question_tokens  # Chunks plus the header around them
+        usage = {
+            "system": system_tokens,
+            "question": question_tokens,
+            "history": history_tokens,
+            "context": context_tokens,
+            "template": prompt - system_tokens - question_tokens - history_tokens - context_tokens,
+            "generation": generation,
+            "prompt": prompt,
+            "exact": exact is not None,
+        }
+        usage["total"] = prompt + generation
+        usage["budget"] = n_ctx
+
+        return {
+            "messages": messages,
+            "history": kept_history,
+            "chunks": kept_chunks,
+            "max_tokens": generation,
+            "usage": usage,
+            "dropped": {
+                "history": len(history) - len(kept_history),
+                "context": len(chunks) - len(kept_chunks),
+            },
+        }
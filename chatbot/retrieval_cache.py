@@ -0,0 +1,183 @@
+# chatbot/retrieval_cache.py
+
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+# --- Persian/Arabic letter variants folded to one form ---
+_CHAR_MAP = str.maketrans({
+    "ي": "ی",  # Arabic yeh -> Persian yeh
+    "ى": "ی",  # Alef maksura -> Persian yeh
+    "ك": "ک",  # Arabic kaf -> Persian keheh
+    "ة": "ه",  # Teh marbuta -> heh
+    "أ": "ا",  # Alef with hamza above -> alef
+    "إ": "ا",  # Alef with hamza below -> alef
+    "ٱ": "ا",  # Alef wasla -> alef
+    "ؤ": "و",  # Waw with hamza -> waw
+    "\u200c": "",  # ZWNJ (نیم‌فاصله) is dropped
+    "\u200d": "",  # ZWJ
+    "\u0640": "",  # Tatweel
+    "؟": "?",  # Arabic question mark
+    "،": ",",  # Arabic comma
+})
+# Persian and Arabic-Indic digits -> ASCII digits
+_CHAR_MAP.update({0x06F0 + i: ord("0") + i for i in range(10)})
+_CHAR_MAP.update({0x0660 + i: ord("0") + i for i in range(10)})
+
+_DIACRITICS = re.compile("[\u064b-\u065f\u0670]")  # Harakat and superscript alef
+_TRAILING_PUNCT = re.compile(r"[\s?!.,;:]+$")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Fold whitespace, ZWNJ, diacritics and Arabic/Persian letter variants so rephrasings share a key."""
+    text = unicodedata.normalize("NFKC", text).translate(_CHAR_MAP)
+    text = _DIACRITICS.sub("", text)
+    text = _SPACES.sub(" ", text).strip().lower()
+    return _TRAILING_PUNCT.sub("", text)
+
+
+class _LRU:
+    """Small thread-safe LRU dict with hit/miss counters."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RetrievalCache:
+    """
+    Two-level cache in front of the retriever:
+    normalized question text -> query embedding, and
+    (embedding, lang, top_k, index generation) -> retrieved chunks.
+    An optional diskcache directory keeps both across restarts.
+    """
+
+    def __init__(self, max_embeddings: int = 2048, max_results: int = 4096,
+                 persist_dir: str = None, namespace: str = ""):
+        """
+        Parameters:
+            max_embeddings (int): In-memory query embeddings kept
+            max_results (int): In-memory retrieval results kept
+            persist_dir (str): diskcache directory for the persistent tier (None disables)
+            namespace (str): Prefix for persistent keys, e.g. the embedding model name
+        """
+        self.embeddings = _LRU(max_embeddings)
+        self.results = _LRU(max_results)
+        self.namespace = namespace
+
+        self.disk = None
+        if persist_dir:
+            import diskcache  # Only needed when the persistent tier is enabled
+            self.disk = diskcache.Cache(persist_dir)
+        self.disk_hits = 0
+
+        # Running cost of misses, used to estimate the time hits save
+        self._encode_ms = [0.0, 0]  # total ms, count
+        self._search_ms = [0.0, 0]
+        self.saved_ms = 0.0
+
+    @staticmethod
+    def _avg(cost) -> float:
+        return cost[0] / cost[1] if cost[1] else 0.0
+
+    def embedding(self, question: str, encode) -> np.ndarray:
+        """Return the (1, dim) float32 embedding of a question, calling `encode` only on a miss."""
+        key = normalize_query(question)
+        emb = self.embeddings.get(key)
+        if emb is not None:
+            self.saved_ms += self._avg(self._encode_ms)
+            return emb
+
+        disk_key = f"emb:{self.namespace}:{key}"
+        if self.disk is not None:
+            emb = self.disk.get(disk_key)
+            if emb is not None:
+                self.disk_hits += 1
+                self.saved_ms += self._avg(self._encode_ms)
+                self.embeddings.put(key, emb)
+                return emb
+
+        start = time.perf_counter()
+        emb = np.ascontiguousarray(encode(key), dtype="float32").reshape(1, -1)
+        self._encode_ms[0] += (time.perf_counter() - start) * 1000
+        self._encode_ms[1] += 1
+
+        self.embeddings.put(key, emb)
+        if self.disk is not None:
+            self.disk.set(disk_key, emb)
+        return emb
+
+    def search(self, emb: np.ndarray, lang: str, top_k: int, generation, search) -> list:
+        """Return the chunks for an embedding, calling `search` only on a miss."""
+        digest = hashlib.blake2b(emb.tobytes(), digest_size=16).hexdigest()
+        key = (digest, lang, top_k, generation)
+        chunks = self.results.get(key)
+        if chunks is not None:
+            self.saved_ms += self._avg(self._search_ms)
+            return list(chunks)
+
+        disk_key = f"res:{self.namespace}:{digest}:{lang}:{top_k}:{generation}"
+        if self.disk is not None:
+            chunks = self.disk.get(disk_key)
+            if chunks is not None:
+                self.disk_hits += 1
+                self.saved_ms += self._avg(self._search_ms)
+                self.results.put(key, chunks)
+                return list(chunks)
+
+        start = time.perf_counter()
+        chunks = search(emb)
+        self._search_ms[0] += (time.perf_counter() - start) * 1000
+        self._search_ms[1] += 1
+
+        self.results.put(key, chunks)
+        if self.disk is not None:
+            self.disk.set(disk_key, chunks)
+        return list(chunks)
+
+    def stats(self) -> dict:
+        """Hit rates of both levels and the time they saved."""
+        def level(lru):
+            lookups = lru.hits + lru.misses
+            return {
+                "entries": len(lru),
+                "hits": lru.hits,
+                "misses": lru.misses,
+                "hit_rate": lru.hits / lookups if lookups else 0.0,
+            }
+        return {
+            "embeddings": level(self.embeddings),
+            "results": level(self.results),
+            "disk_hits": self.disk_hits,
+            "avg_encode_ms": self._avg(self._encode_ms),
+            "avg_search_ms": self._avg(self._search_ms),
+            "saved_ms": self.saved_ms,
+        }
@@ -0,0 +1,414 @@
+# chatbot/server.py
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+from chatbot.chatbot_core import TherapyChatbot
+from chatbot.prompt_packer import PromptTooLong
+from chatbot.sessions import SessionState
+
+_DONE = object()
+
+
+class ChatMessage(BaseModel):
+    role: str
+    content: str
+
+
+class ChatCompletionRequest(BaseModel):
+    model: str = None  # A model name pins the request to it; None or "auto" routes by language
+    messages: list[ChatMessage]
+    stream: bool = False
+    max_tokens: int = 512
+    temperature: float = 0.3
+    user: str = None  # Names a session (within the caller's API key): the server then keeps the history
+
+
+class EmbeddingRequest(BaseModel):
+    input: str | list[str]
+    model: str = None
+
+
+class QueueFull(Exception):
+    pass
+
+
+class AdmissionQueue:
+    """
+    At most `max_active` generations run at once and at most `max_waiting` wait
+    for a slot; beyond that requests are rejected right away (HTTP 503), so a
+    load balancer can send them elsewhere instead of piling up latency here.
+    """
+
+    def __init__(self, max_active: int, max_waiting: int):
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._slots = None  # Created on the server's event loop
+
+    async def acquire(self, timeout: float):
+        """Wait for a slot; raises QueueFull or asyncio.TimeoutError."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_active)
+        if self.waiting >= self.max_waiting and self._slots.locked():
+            self.rejected += 1
+            raise QueueFull()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        """Free a slot; must run on the event loop (use loop.call_soon_threadsafe from workers)."""
+        self.active -= 1
+        self._slots.release()
+
+
+class Generation:
+    """
+    One ask_stream() call running in a worker thread, with its pieces handed to
+    the event loop through an asyncio.Queue. cancel() stops it at the next token;
+    a prompt that is still being prefilled finishes its prefill first.
+    """
+
+    def __init__(self, chatbot, question, session_id, max_tokens, temperature, model=None, session=None):
+        self.chatbot = chatbot
+        self.question = question
+        self.session_id = session_id
+        self.session = session  # SessionState kept outside the session store (throwaway sessions)
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.model = model
+        self.stats = {}
+        self.cancelled = threading.Event()
+        self.queue = asyncio.Queue()
+        self.loop = asyncio.get_running_loop()
+
+    def run(self, on_exit):
+        """Worker thread body; on_exit runs on the event loop once the thread is done."""
+        emit = lambda item: self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        stream = self.chatbot.ask_stream(self.question, max_tokens=self.max_tokens,
+                                         temperature=self.temperature, session_id=self.session_id,
+                                         stats=self.stats, model=self.model, session=self.session)
+        try:
+            for piece in stream:
+                if self.cancelled.is_set():
+                    break
+                emit(piece)
+        except Exception as e:
+            emit(e)
+        finally:
+            stream.close()  # Ends the llama_cpp stream and releases the model lock
+            emit(_DONE)
+            self.loop.call_soon_threadsafe(on_exit)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    async def pieces(self, deadline: float):
+        """Yield text pieces until the generation ends; raises asyncio.TimeoutError past `deadline`."""
+        while True:
+            item = await asyncio.wait_for(self.queue.get(), max(0.0, deadline - time.monotonic()))
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+def _completion_id() -> str:
+    return "chatcmpl-" + uuid.uuid4().hex[:24]
+
+
+def _sse(payload) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _error(e: Exception) -> dict:
+    """OpenAI-style error object of a failed generation."""
+    kind = "invalid_request_error" if isinstance(e, PromptTooLong) else "server_error"
+    return {"error": {"message": str(e) or type(e).__name__, "type": kind}}
+
+
+def create_app(chatbot: TherapyChatbot, max_active: int = None, max_waiting: int = 32,
+               request_timeout: float = 120.0, api_keys: list = None) -> FastAPI:
+    """
+    OpenAI-compatible API over one shared TherapyChatbot.
+
+    Without `api_keys` the API is open: anyone who can reach it can read and
+    extend any `user` session, so it must sit behind a proxy that authenticates
+    the callers and sets `user` itself.
+
+    Parameters:
+        chatbot (TherapyChatbot): The shared bot (its models and indexes load in the background)
+        max_active (int): Generations running at once (default: one per model slot; an
+            in-process model has one, a llama-server one per parallel sequence)
+        max_waiting (int): Requests queued for a slot before new ones get HTTP 503
+        request_timeout (float): Seconds from arrival to the end of the answer
+        api_keys (list): Bearer tokens accepted on /v1/*; each key has its own `user` sessions
+    """
+    admission = AdmissionQueue(max_active or len(chatbot.model_paths) * chatbot.slots_per_model, max_waiting)
+    executor = ThreadPoolExecutor(max_workers=admission.max_active, thread_name_prefix="generate")
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        executor.shutdown(wait=False, cancel_futures=True)
+        chatbot.metrics.close()
+        if chatbot.conversations is not None:
+            chatbot.conversations.close()  # Commit the queued turns
+
+    app = FastAPI(title="Therapy Chatbot API", lifespan=lifespan)
+    app.state.chatbot = chatbot
+    app.state.admission = admission
+
+    # Sessions are namespaced by a digest of the caller's key, so one key cannot
+    # reach another's history and no `user` collides with the server's own sessions
+    key_namespaces = {key: "key-" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+                      for key in api_keys or ()}
+
+    def authenticate(request: Request) -> str:
+        """Session namespace of the caller; raises HTTP 401 for a missing or unknown key."""
+        if not key_namespaces:
+            return "user"
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        namespace = key_namespaces.get(token) if scheme.lower() == "bearer" else None
+        if namespace is None:
+            raise HTTPException(401, "Invalid API key", headers={"WWW-Authenticate": "Bearer"})
+        return namespace
+
+    def requested_model(body: ChatCompletionRequest):
+        """Model a request is pinned to (None: route by language); HTTP 400 for unknown names."""
+        if body.model in (None, "", "auto"):
+            return None
+        if body.model not in chatbot.model_paths:
+            raise HTTPException(400, f"Unknown model {body.model!r}; available: "
+                                     f"{', '.join(['auto', *chatbot.model_paths])}")
+        return body.model
+
+    def open_session(body: ChatCompletionRequest, namespace: str):
+        """
+        Session of a request: the `user` id keeps its history on the server; without
+        one, a throwaway session is seeded with the earlier messages of the request.
+        The throwaway one stays out of the session store, so neither its LRU nor its
+        idle expiry can drop it while the request waits for a slot.
+        """
+        if body.user:
+            return f"{namespace}:{body.user}", None
+        session = SessionState("req-" + uuid.uuid4().hex, persistent=False)
+        for message in body.messages[:-1]:
+            if message.role in ("user", "assistant"):
+                chatbot.sessions.append(session, message.role, message.content)
+        return session.session_id, session
+
+    async def start_generation(body: ChatCompletionRequest, request: Request, deadline: float) -> Generation:
+        namespace = authenticate(request)
+        if not body.messages or body.messages[-1].role != "user":
+            raise HTTPException(400, "The last message must come from the user")
+        model = requested_model(body)
+        session_id, session = open_session(body, namespace)
+        question = body.messages[-1].content
+        if model is None:
+            # Route here rather than in the worker, so every chunk can name the model
+            # from the first one on; the worker then runs on exactly this model
+            model = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: chatbot.route_model(chatbot.detect_language(question),
+                                                  session or chatbot.sessions.get(session_id))[0])
+
+        try:
+            await admission.acquire(max(0.0, deadline - time.monotonic()))
+        except QueueFull:
+            raise HTTPException(503, "Server busy", headers={"Retry-After": "1"})
+        except asyncio.TimeoutError:
+            raise HTTPException(504, "Timed out waiting for a free model")
+
+        generation = Generation(chatbot, question, session_id, body.max_tokens, body.temperature, model, session)
+        executor.submit(generation.run, admission.release)
+        return generation
+
+    def usage(generation: Generation) -> dict:
+        prompt = generation.stats.get("prompt_tokens") or 0
+        completion = generation.stats.get("tokens", 0)
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(body: ChatCompletionRequest, request: Request):
+        deadline = time.monotonic() + request_timeout
+        generation = await start_generation(body, request, deadline)
+        completion_id, created = _completion_id(), int(time.time())
+
+        def chunk(delta: dict, finish_reason=None) -> dict:
+            return {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created,
+                "model": generation.model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+
+        if body.stream:
+            async def events():
+                try:
+                    yield _sse(chunk({"role": "assistant"}))
+                    try:
+                        async for piece in generation.pieces(deadline):
+                            yield _sse(chunk({"content": piece}))
+                        finish_reason = generation.stats.get("finish_reason", "stop")
+                    except asyncio.TimeoutError:
+                        finish_reason = "length"  # Cut off by the request timeout
+                    except Exception as e:
+                        # The 200 header is out already: report the failure in the stream
+                        # and still end it properly
+                        yield _sse(_error(e))
+                        finish_reason = "error"
+                    yield _sse(dict(chunk({}, finish_reason), usage=usage(generation)))
+                    yield "data: [DONE]\n\n"
+                finally:
+                    # Also reached when the client disconnects and the response is cancelled
+                    generation.cancel()
+
+            return StreamingResponse(events(), media_type="text/event-stream",
+                                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+        # Non-streaming: collect the answer, but stop early if the client goes away
+        pieces = []
+        collector = asyncio.ensure_future(_collect(generation, deadline, pieces))
+        try:
+            while not collector.done():
+                await asyncio.wait({collector}, timeout=0.5)
+                if not collector.done() and await request.is_disconnected():
+                    generation.cancel()
+                    collector.cancel()
+                    return JSONResponse({"error": "client disconnected"}, status_code=499)
+            collector.result()
+        except asyncio.TimeoutError:
+            generation.cancel()
+            raise HTTPException(504, "Request timed out")
+        except PromptTooLong as e:
+            raise HTTPException(400, str(e))
+        return {
+            "id": completion_id, "object": "chat.completion", "created": created,
+            "model": generation.model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces).strip()},
+                         "finish_reason": generation.stats.get("finish_reason", "stop")}],
+            "usage": usage(generation),
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(body: EmbeddingRequest, request: Request):
+        authenticate(request)
+        texts = [body.input] if isinstance(body.input, str) else body.input
+        if not chatbot.startup.ready("embedder"):
+            raise HTTPException(503, "Embedder is still loading", headers={"Retry-After": "5"})
+        vectors = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: chatbot.embedder.encode(texts, convert_to_numpy=True))
+        return {
+            "object": "list",
+            "model": body.model or chatbot.retrieval_cache.namespace,
+            "data": [{"object": "embedding", "index": i, "embedding": vector.tolist()}
+                     for i, vector in enumerate(vectors)],
+            "usage": {"prompt_tokens": sum(len(text.split()) for text in texts),
+                      "total_tokens": sum(len(text.split()) for text in texts)},
+        }
+
+    @app.get("/health")
+    async def health():
+        """Liveness: the process answers."""
+        return {"status": "ok"}
+
+    @app.get("/ready")
+    async def ready():
+        """Readiness: every startup component loaded and a request slot can be had."""
+        components = chatbot.startup.status()
+        is_ready = all(status == "ok" for status in components.values())
+        body = {
+            "ready": is_ready,
+            "components": components,
+            "active": admission.active,
+            "waiting": admission.waiting,
+            "max_waiting": admission.max_waiting,
+        }
+        if not is_ready or admission.waiting >= admission.max_waiting:
+            return JSONResponse(body, status_code=503)
+        return body
+
+    @app.get("/metrics")
+    async def metrics():
+        text = chatbot.metrics.prometheus()
+        text += (f"chatbot_queue_active {admission.active}\n"
+                 f"chatbot_queue_waiting {admission.waiting}\n"
+                 f"chatbot_queue_rejected_total {admission.rejected}\n")
+        return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+    return app
+
+
+async def _collect(generation: Generation, deadline: float, pieces: list):
+    async for piece in generation.pieces(deadline):
+        pieces.append(piece)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve TherapyChatbot over an OpenAI-compatible HTTP API.")
+    parser.add_argument("--model", action="append", required=True, metavar="NAME=PATH",
+                        help="Model name and GGUF path, e.g. dorna=models/dorna.gguf (repeatable)")
+    parser.add_argument("--index-fa", required=True, help="Persian FAISS index (the _en. index is found next to it)")
+    parser.add_argument("--meta-fa", required=True, help="Persian chunk metadata")
+    parser.add_argument("--n-ctx", type=int, default=4096)
+    parser.add_argument("--n-gpu-layers", type=int, default=28)
+    parser.add_argument("--n-threads", type=int, default=6)
+    parser.add_argument("--ram-budget-gb", type=float, default=None)
+    parser.add_argument("--backend", choices=["llama_cpp", "llama_server"], default="llama_cpp",
+                        help="Run the models in this process or in one llama-server each")
+    parser.add_argument("--slots", type=int, default=4, help="Parallel sequences per llama-server")
+    parser.add_argument("--max-waiting", type=int, default=32)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--trace", default=None, help="JSONL request trace file")
+    parser.add_argument("--conversation-db", default=None,
+                        help="SQLite file that keeps the history of `user` sessions across restarts")
+    parser.add_argument("--api-key", action="append", default=None,
+                        help="Bearer token required on /v1/* (repeatable; default: $CHATBOT_API_KEYS, "
+                             "comma-separated). Without one, run behind an authenticating proxy")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("TERM_UI", "0")
+    chatbot = TherapyChatbot(
+        model_paths=dict(spec.split("=", 1) for spec in args.model),
+        faiss_index_path_fa=args.index_fa,
+        faiss_meta_path_fa=args.meta_fa,
+        n_ctx=args.n_ctx,
+        n_gpu_layers=args.n_gpu_layers,
+        n_threads=args.n_threads,
+        model_ram_budget_gb=args.ram_budget_gb,
+        route_by_language=True,  # The question picks the model; no shared active-model switching
+        metrics=True,
+        trace_path=args.trace,
+        backend=args.backend,
+        server_slots=args.slots,
+        conversation_db=args.conversation_db,
+    )
+    api_keys = args.api_key or [key for key in os.environ.get("CHATBOT_API_KEYS", "").split(",") if key]
+    app = create_app(chatbot, max_waiting=args.max_waiting, request_timeout=args.timeout, api_keys=api_keys)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# chatbot/sessions.py
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class SessionState:
+    """Conversation state of one user session."""
+
+    # __slots__ keeps each session small when many browser tabs share one model
+    __slots__ = ("session_id", "history", "language", "model", "retrieved_chunks", "last_active", "persistent",
+                 "summary")
+
+    def __init__(self, session_id: str, persistent: bool = True):
+        self.session_id = session_id
+        self.persistent = persistent   # Messages go to the conversation store (if any)
+        self.history = []              # [{"role": ..., "content": ...}, ...]
+        self.language = None           # None -> use the chatbot's default language
+        self.model = None              # None -> use the chatbot's active model
+        self.retrieved_chunks = []     # chunk_ids used for the last answer
+        self.summary = None            # Running summary of the turns folded out of history
+        self.last_active = time.monotonic()
+
+
+class SessionStore:
+    """
+    Bounded store of per-session conversation state.
+    Sessions idle longer than `idle_ttl` seconds are dropped, and when more than
+    `max_sessions` exist the least recently active one is dropped.
+
+    With a ConversationStore every message is also logged there, and a session
+    that is not in memory (new process, or dropped while idle) resumes with its
+    last `max_history` messages.
+    """
+
+    def __init__(self, max_sessions: int = 256, idle_ttl: float = 1800, max_history: int = 24, store=None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_history = max_history  # Messages kept per session
+        self.store = store  # ConversationStore, or None to keep conversations in memory only
+
+        # session_id -> SessionState; order is least -> most recently active
+        self._sessions = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, session_id: str, persistent: bool = True) -> SessionState:
+        """
+        Return the session with this id, creating it if needed.
+        A session created with persistent=False is neither resumed from nor logged to the store.
+        """
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = SessionState(session_id, persistent)
+                if self.store is not None and persistent:
+                    session.history = self.store.last_turns(session_id, self.max_history)
+                self._sessions[session_id] = session
+                # Drop the least recently active sessions beyond the limit
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_active = time.monotonic()
+            return session
+
+    def append(self, session: SessionState, role: str, content: str):
+        """Add a message to a session's history, keeping only the newest `max_history`."""
+        with self._lock:
+            session.history.append({"role": role, "content": content})
+            if len(session.history) > self.max_history:
+                del session.history[:-self.max_history]
+        if self.store is not None and session.persistent:
+            self.store.append(session.session_id, role, content)  # Queued; written in the background
+
+    def fold(self, session: SessionState, messages: list, summary: str) -> bool:
+        """
+        Replace `messages`, the oldest of the session's history, with a summary.
+        Returns False (and changes nothing) if the history moved on meanwhile
+        in a way that no longer starts with them (reset, trimmed).
+        """
+        with self._lock:
+            head = session.history[:len(messages)]
+            if len(head) != len(messages) or any(a is not b for a, b in zip(head, messages)):
+                return False
+            del session.history[:len(messages)]
+            session.summary = summary
+            return True
+
+    def reset(self, session_id: str):
+        """Clear a session's history and retrieved context."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.history = []
+                session.retrieved_chunks = []
+                session.summary = None
+        if self.store is not None and (session is None or session.persistent):
+            self.store.clear(session_id)
+
+    def drop(self, session_id: str):
+        """Forget a session completely (its stored log stays)."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _expire(self):
+        """Drop sessions that have been idle for longer than `idle_ttl`."""
+        if not self.idle_ttl:
+            return
+        cutoff = time.monotonic() - self.idle_ttl
+        # Oldest sessions come first, so stop at the first active one
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_active >= cutoff:
+                break
+            self._sessions.popitem(last=False)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -0,0 +1,73 @@
+# chatbot/speculative.py
+
+from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+
+# Defaults for prompt-lookup drafting; answers often quote the retrieved chunks,
+# so longer n-grams and drafts pay off more than in open-ended chat
+DEFAULT_SPECULATIVE = {"num_pred_tokens": 10, "max_ngram_size": 3}
+
+
+def speculative_options(value):
+    """
+    Normalize a per-model speculative setting: None/False -> None,
+    True -> defaults, dict -> defaults updated with the given keys.
+    """
+    if not value:
+        return None
+    options = dict(DEFAULT_SPECULATIVE)
+    if isinstance(value, dict):
+        options.update(value)
+    return options
+
+
+class PromptLookupDraft(LlamaPromptLookupDecoding):
+    """
+    Prompt-lookup draft model that measures how many of its tokens are accepted.
+
+    llama_cpp calls the draft model once per verification step with the tokens
+    so far, so each call shows the tokens actually emitted since the previous
+    draft: that draft's accepted length is its common prefix with them. The last
+    draft of a request is never followed by another call; it is left out of the
+    counts rather than guessed.
+    """
+
+    def __init__(self, num_pred_tokens: int = 10, max_ngram_size: int = 3):
+        super().__init__(max_ngram_size=max_ngram_size, num_pred_tokens=num_pred_tokens)
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.steps = 0
+        self.drafted = 0
+        self.accepted = 0
+        self._pending = None  # (position the last draft starts at, its tokens)
+
+    def _settle(self, input_ids):
+        """Compare the previous draft with the tokens emitted after it."""
+        if self._pending is None:
+            return
+        start, draft = self._pending
+        self._pending = None
+        emitted = input_ids[start:start + len(draft)].tolist()
+        accepted = 0
+        for drafted, token in zip(draft, emitted):
+            if drafted != token:
+                break
+            accepted += 1
+        self.steps += 1
+        self.drafted += len(draft)
+        self.accepted += accepted
+
+    def __call__(self, input_ids, /, **kwargs):
+        self._settle(input_ids)
+        draft = super().__call__(input_ids, **kwargs)
+        if len(draft):
+            self._pending = (len(input_ids), [int(token) for token in draft])
+        return draft
+
+    def stats(self) -> dict:
+        """Drafted / accepted tokens and acceptance rate of the verified drafts since reset_counts()."""
+        return {
+            "drafted": self.drafted,
+            "accepted": self.accepted,
+            "acceptance_rate": self.accepted / self.drafted if self.drafted else 0.0,
+        }
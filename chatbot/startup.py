@@ -0,0 +1,99 @@
+# chatbot/startup.py
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StartupLoader:
+    """
+    Load independent components (LLM, embedder, FAISS indexes) in background threads.
+    get(name) waits only for that component, so a request never blocks on parts it does not use.
+    """
+
+    def __init__(self, max_workers: int = 4, on_complete=None):
+        """
+        Parameters:
+            max_workers (int): Components loaded at the same time
+            on_complete (callable): Called with this loader once every component has finished
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="startup")
+        self._futures = {}
+        self._timeline = {}  # name -> {"start": s, "seconds": s, "status": "..."}
+        self._lock = threading.Lock()
+        self._pending = 1  # Held until close(), so completion is not reported mid-submission
+        self.on_complete = on_complete
+        self.t0 = time.perf_counter()
+
+    def submit(self, name: str, loader, *args):
+        """Start loading a component in the background."""
+        with self._lock:
+            self._pending += 1
+        self._futures[name] = self._executor.submit(self._run, name, loader, *args)
+
+    def _run(self, name: str, loader, *args):
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            return loader(*args)
+        except Exception as e:
+            status = f"error: {e}"
+            raise
+        finally:
+            with self._lock:
+                self._timeline[name] = {
+                    "start": start - self.t0,
+                    "seconds": time.perf_counter() - start,
+                    "status": status,
+                }
+            self._finished()
+
+    def close(self):
+        """Signal that all components have been submitted."""
+        self._finished()
+
+    def _finished(self):
+        with self._lock:
+            self._pending -= 1
+            done = self._pending == 0
+        if done:
+            self._executor.shutdown(wait=False)
+            if self.on_complete is not None:
+                self.on_complete(self)
+
+    def get(self, name: str):
+        """Return a component, waiting for it if it is still loading (re-raises load errors)."""
+        return self._futures[name].result()
+
+    def ready(self, name: str) -> bool:
+        """Check whether a component has finished loading."""
+        return self._futures[name].done()
+
+    def status(self) -> dict:
+        """name -> "loading", "ok" or "error: ..." for every submitted component."""
+        with self._lock:
+            finished = {name: t["status"] for name, t in self._timeline.items()}
+        return {name: finished.get(name, "loading") for name in self._futures}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._futures
+
+    def wait_all(self):
+        """Block until every component has finished (errors are not raised here)."""
+        for future in list(self._futures.values()):
+            future.exception()
+
+    def timeline(self) -> list:
+        """Finished components as (name, start offset s, wall time s, status), in start order."""
+        with self._lock:
+            rows = [(name, t["start"], t["seconds"], t["status"]) for name, t in self._timeline.items()]
+        return sorted(rows, key=lambda row: row[1])
+
+    def format_timeline(self) -> str:
+        """Human-readable startup timeline."""
+        rows = self.timeline()
+        total = max((start + seconds for _, start, seconds, _ in rows), default=0.0)
+        lines = [f"Startup timeline ({total:.2f}s total):"]
+        for name, start, seconds, status in rows:
+            lines.append(f"  {name:<16} +{start:6.2f}s  {seconds:6.2f}s  {status}")
+        return "\n".join(lines)
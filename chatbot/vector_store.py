@@ -0,0 +1,287 @@
+# chatbot/vector_store.py
+
+import json
+import os
+import re
+import unicodedata
+
+import faiss
+import numpy as np
+import xxhash
+
+EMBEDDING_STORE_VERSION = 1
+
+
+def vector_store_path(index_path: str) -> str:
+    """Full-precision vectors are kept next to the FAISS index they belong to."""
+    return os.path.splitext(index_path)[0] + ".vectors.npy"
+
+
+def is_exact_index(index) -> bool:
+    """True if the index scores with the original float32 vectors (no re-scoring needed)."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    return isinstance(index, (faiss.IndexFlat, faiss.IndexIVFFlat, faiss.IndexHNSWFlat))
+
+
+class VectorStore:
+    """
+    Read-only, memory-mapped float32 copy of the indexed vectors; row i is FAISS id i.
+    A compressed index (SQ8, fp16, PCA, PQ) finds candidates cheaply; the few
+    candidates are then re-scored exactly from this file. Only the rows that are
+    re-scored are paged in, so its size on disk does not add to resident memory.
+    """
+
+    def __init__(self, source):
+        """source: path of a .npy file written by EmbeddingStore, or an in-memory array."""
+        self.vectors = np.load(source, mmap_mode="r") if isinstance(source, str) else source
+
+    @staticmethod
+    def exists(index_path: str) -> bool:
+        return os.path.exists(vector_store_path(index_path))
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def rescore(self, query: np.ndarray, ids, top_k: int) -> list:
+        """Order candidate ids by exact L2 distance to the query and keep top_k."""
+        ids = np.array([i for i in ids if 0 <= i < len(self.vectors)], dtype=np.int64)
+        if not len(ids):
+            return []
+        # Sorted ids make the reads from the memory map sequential
+        order = np.argsort(ids)
+        rows = np.asarray(self.vectors[ids[order]], dtype=np.float32)
+        q = np.asarray(query, dtype=np.float32).reshape(-1)
+        dist = ((rows - q) ** 2).sum(axis=1)
+        best = np.argsort(dist, kind="stable")[:top_k]
+        return ids[order][best].tolist()
+
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_content(text: str) -> str:
+    """Canonical form of a chunk for hashing: NFC, single spaces, no outer whitespace."""
+    return _SPACES.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+def content_key(text: str) -> int:
+    """64-bit xxhash of the normalized chunk text."""
+    return xxhash.xxh3_64_intdigest(normalize_content(text).encode("utf-8"))
+
+
+class _AppendableArray:
+    """A .npy file that only grows along its first axis; the header is rewritten in place."""
+
+    def __init__(self, path: str, dtype, row_shape: tuple = ()):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        if not os.path.exists(path):
+            np.save(path, np.zeros((0,) + self.row_shape, dtype=self.dtype))
+        with open(path, "rb") as f:
+            np.lib.format.read_magic(f)
+            np.lib.format.read_array_header_1_0(f)
+            self._offset = f.tell()
+
+    def write(self, start: int, rows: np.ndarray):
+        """Write rows at position `start` (anything after it is overwritten)."""
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        row_bytes = self.dtype.itemsize * int(np.prod(self.row_shape, dtype=np.int64))
+        with open(self.path, "r+b") as f:
+            f.seek(self._offset + start * row_bytes)
+            f.write(rows.tobytes())
+            f.seek(0)
+            np.lib.format.write_array_header_1_0(f, {
+                "descr": np.lib.format.dtype_to_descr(self.dtype),
+                "fortran_order": False,
+                "shape": (start + len(rows),) + self.row_shape,
+            })
+            if f.tell() != self._offset:
+                raise RuntimeError(f"{self.path}: .npy header size changed while growing")
+
+    def view(self, count: int) -> np.ndarray:
+        """Read-only memory map of the first `count` rows."""
+        if not count:
+            return np.zeros((0,) + self.row_shape, dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode="r", offset=self._offset,
+                         shape=(count,) + self.row_shape)
+
+
+class _KeyTable:
+    """
+    Memory-mapped open-addressing hash table from content key to row.
+
+    Keys are xxhash values already, so the slot is the key's low bits; collisions
+    probe the next slots. Lookups and inserts work on whole batches with numpy, so
+    nothing per key lives in Python objects and memory does not grow with the
+    corpus. The table is derived from .keys.npy: `.table.json` records how many
+    rows it covers, and a table that does not match the store is rebuilt.
+    """
+
+    MAX_LOAD = 0.5
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.count = 0
+        self._table = None
+        if os.path.exists(prefix + ".table.json") and os.path.exists(prefix + ".table.npy"):
+            with open(prefix + ".table.json", encoding="utf-8") as f:
+                self.count = json.load(f).get("count", 0)
+            self._table = np.load(prefix + ".table.npy", mmap_mode="r+")
+
+    def _create(self, capacity: int):
+        self._table = None  # Close the old map before its file is replaced
+        table = np.lib.format.open_memmap(self.prefix + ".table.npy", mode="w+", shape=(capacity,),
+                                          dtype=[("key", np.uint64), ("row", np.int64)])
+        table["row"] = -1
+        self._table = table
+        self.count = 0
+
+    def rebuild(self, keys: np.ndarray, batch_size: int = 1 << 20):
+        """Index the rows of `keys` (a memory map of .keys.npy) from scratch."""
+        capacity = 1024
+        while len(keys) > capacity * self.MAX_LOAD:
+            capacity *= 2
+        self._create(capacity)
+        for start in range(0, len(keys), batch_size):
+            batch = np.asarray(keys[start:start + batch_size], dtype=np.uint64)
+            self._insert(batch, np.arange(start, start + len(batch), dtype=np.int64))
+        self._commit(len(keys))
+
+    def rows(self, keys: np.ndarray) -> np.ndarray:
+        """Rows of `keys` (-1 where a key is not in the table)."""
+        keys = np.asarray(keys, dtype=np.uint64)
+        found = np.full(len(keys), -1, dtype=np.int64)
+        if self._table is None or not len(keys):
+            return found
+        mask = len(self._table) - 1
+        slots = (keys & np.uint64(mask)).astype(np.int64)
+        pending = np.arange(len(keys))
+        while len(pending):
+            entries = self._table[slots[pending]]
+            hit = (entries["row"] >= 0) & (entries["key"] == keys[pending])
+            found[pending[hit]] = entries["row"][hit]
+            pending = pending[~hit & (entries["row"] >= 0)]  # An empty slot ends the probe
+            slots[pending] = (slots[pending] + 1) & mask
+        return found
+
+    def add(self, keys: np.ndarray, rows: np.ndarray, all_keys: np.ndarray):
+        """Insert new keys; past MAX_LOAD the table is rebuilt twice as large from `all_keys`."""
+        if self._table is None or self.count + len(keys) > len(self._table) * self.MAX_LOAD:
+            self.rebuild(all_keys)
+            return
+        self._insert(np.asarray(keys, dtype=np.uint64), np.asarray(rows, dtype=np.int64))
+        self._commit(self.count + len(keys))
+
+    def _insert(self, keys: np.ndarray, rows: np.ndarray):
+        mask = len(self._table) - 1
+        slots = (keys & np.uint64(mask)).astype(np.int64)
+        pending = np.arange(len(keys))
+        while len(pending):
+            free = pending[self._table["row"][slots[pending]] < 0]
+            # One key per free slot this round; the others move on to the next slot
+            _, first = np.unique(slots[free], return_index=True)
+            placed = free[first]
+            self._table["key"][slots[placed]] = keys[placed]
+            self._table["row"][slots[placed]] = rows[placed]
+            pending = np.setdiff1d(pending, placed, assume_unique=True)
+            slots[pending] = (slots[pending] + 1) & mask
+
+    def _commit(self, count: int):
+        self._table.flush()
+        self.count = count
+        with open(self.prefix + ".table.json", "w", encoding="utf-8") as f:
+            json.dump({"count": count}, f)
+
+
+class EmbeddingStore:
+    """
+    Append-only store of chunk embeddings keyed by content_key().
+
+    Files next to `prefix`:
+        .npy        float32 vectors, one row per distinct chunk text (row = FAISS id)
+        .keys.npy   uint64 content keys, aligned with the vectors
+        .table.npy  key -> row hash table over .keys.npy (see _KeyTable)
+        .json       manifest (version, model, dim, count), written after every append
+
+    Rows are never rewritten, so ids stay stable across rebuilds; chunks removed from
+    the corpus are simply left out of the index. The manifest is the commit point:
+    rows written after it by an interrupted append are ignored and overwritten.
+    """
+
+    def __init__(self, prefix: str, model: str):
+        self.prefix = prefix
+        self.model = model
+        os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+
+        manifest = {}
+        if os.path.exists(prefix + ".json"):
+            with open(prefix + ".json", encoding="utf-8") as f:
+                manifest = json.load(f)
+        if manifest.get("version") != EMBEDDING_STORE_VERSION or manifest.get("model") != model:
+            self.reset()
+            manifest = {}
+
+        self.dim = manifest.get("dim")
+        self.count = manifest.get("count", 0)
+        self._keys = _AppendableArray(prefix + ".keys.npy", np.uint64)
+        self._vectors = _AppendableArray(prefix + ".npy", np.float32, (self.dim,)) if self.dim else None
+        self._table = _KeyTable(prefix)
+        if self._table.count != self.count:  # Missing, or an append was interrupted
+            self._table.rebuild(self._keys.view(self.count))
+
+    def reset(self):
+        """Delete all stored embeddings (e.g. after changing the embedding model)."""
+        for suffix in (".json", ".npy", ".keys.npy", ".table.json", ".table.npy"):
+            if os.path.exists(self.prefix + suffix):
+                os.remove(self.prefix + suffix)
+        self.dim, self.count, self._vectors = None, 0, None
+        if hasattr(self, "_keys"):
+            self._keys = _AppendableArray(self.prefix + ".keys.npy", np.uint64)
+            self._table = _KeyTable(self.prefix)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, key: int) -> bool:
+        return self.row(key) is not None
+
+    def row(self, key: int):
+        """Row (FAISS id) of a content key, or None if it has not been embedded."""
+        row = int(self._table.rows([key])[0])
+        return row if row >= 0 else None
+
+    def rows(self, keys) -> np.ndarray:
+        """Rows (FAISS ids) of many content keys at once; -1 for keys not embedded yet."""
+        return self._table.rows(keys)
+
+    def add(self, keys: list, vectors: np.ndarray) -> list:
+        """Append embeddings for new keys and return their rows."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self._vectors is None:
+            self.dim = vectors.shape[1]
+            self._vectors = _AppendableArray(self.prefix + ".npy", np.float32, (self.dim,))
+
+        start = self.count
+        self._vectors.write(start, vectors)
+        self._keys.write(start, np.array(keys, dtype=np.uint64))
+        self.count += len(keys)
+
+        tmp = self.prefix + ".json.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": EMBEDDING_STORE_VERSION, "model": self.model,
+                       "dim": self.dim, "count": self.count}, f)
+        os.replace(tmp, self.prefix + ".json")
+
+        rows = list(range(start, self.count))
+        self._table.add(keys, rows, self._keys.view(self.count))
+        return rows
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """All stored vectors, memory-mapped (row = FAISS id)."""
+        if self._vectors is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._vectors.view(self.count)
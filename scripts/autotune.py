@@ -0,0 +1,54 @@
+#autotune.py
+# --- Find the fastest n_threads / n_batch / n_gpu_layers for each model on this machine ---
+import os, sys, argparse
+
+# --- Make the project root importable when run as a script ---
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chatbot.autotune import autotune, save_profile, load_profile, request_seconds
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_DIR = os.path.join(BASE_DIR, "models")
+
+MODEL_PATHS = {
+    "dorna": os.path.join(MODEL_DIR, "dorna-llama3-8b-instruct.Q4_K_M.gguf"),
+    "zephyr": os.path.join(MODEL_DIR, "zephyr-7b-beta.Q4_K_M.gguf"),
+}
+
+
+def int_list(text):
+    return [int(x) for x in text.split(",") if x] if text else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark each model over thread/batch/offload settings and save the best profile. "
+                    "TherapyChatbot picks the saved profile up automatically.")
+    parser.add_argument("models", nargs="*", default=list(MODEL_PATHS),
+                        help="Model names (dorna, zephyr) or paths to GGUF files")
+    parser.add_argument("--threads", help="Comma-separated thread counts (default: 1, 2, 4, ... cores)")
+    parser.add_argument("--batches", help="Comma-separated batch sizes (default: 128,256,512)")
+    parser.add_argument("--gpu-layers", help="Comma-separated offload values (default: quarters of the layers)")
+    parser.add_argument("--n-ctx", type=int, default=2048)
+    parser.add_argument("--prompt-tokens", type=int, default=512)
+    parser.add_argument("--decode-tokens", type=int, default=32)
+    parser.add_argument("--force", action="store_true", help="Re-tune models that already have a profile")
+    args = parser.parse_args()
+
+    for model in args.models:
+        path = MODEL_PATHS.get(model, model)
+        if not os.path.exists(path):
+            print(f"❌ Model file not found: {path}")
+            continue
+        if not args.force and load_profile(path):
+            print(f"✅ {model}: already tuned on this host (use --force to re-run)")
+            continue
+
+        print(f"⚙️  Tuning {model} ({os.path.basename(path)})")
+        profile = autotune(path, n_ctx=args.n_ctx, threads=int_list(args.threads),
+                           batches=int_list(args.batches), gpu_layers=int_list(args.gpu_layers),
+                           prompt_tokens=args.prompt_tokens, decode_tokens=args.decode_tokens)
+        saved = save_profile(path, profile)
+        print(f"✅ {model}: n_threads={profile['n_threads']} n_threads_batch={profile['n_threads_batch']} "
+              f"n_batch={profile['n_batch']} n_gpu_layers={profile['n_gpu_layers']} "
+              f"(~{request_seconds(profile['prefill_tok_s'], profile['decode_tok_s']):.1f}s per typical request)")
+        print(f"   Profile saved: {saved}")
@@ -0,0 +1,70 @@
+#benchmark_embedding.py
+# --- Embedding throughput (chunks/sec) against the number of worker processes ---
+import os, sys, json, time, argparse, itertools
+import numpy as np
+
+# --- Make the project root importable when run as a script ---
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.build_faiss import EMBED_MODEL, iter_chunks, load_encoder
+from scripts.parallel_embed import available_cores, plan_core_sets
+
+
+def load_texts(jsonl_path, n):
+    """First n chunk texts of the corpus, or synthetic sentences when it is not available."""
+    if os.path.exists(jsonl_path):
+        return [chunk["content"] for _, chunk in itertools.islice(iter_chunks(jsonl_path), n)]
+    words = "feel anxious sleep therapy stress family work talk help thought breathe calm".split()
+    rng = np.random.default_rng(0)
+    return [" ".join(rng.choice(words, 60)) for _ in range(n)]
+
+
+def run(texts, workers, batch_size, repeats=3):
+    """Chunks/sec of one worker count, with encoder startup reported separately."""
+    start = time.perf_counter()
+    encoder = load_encoder(workers)
+    startup_s = time.perf_counter() - start
+    try:
+        encoder.encode(texts[:batch_size * workers], convert_to_numpy=True)  # Warm-up
+        rates = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for begin in range(0, len(texts), batch_size * workers):
+                encoder.encode(texts[begin:begin + batch_size * workers], convert_to_numpy=True)
+            rates.append(len(texts) / (time.perf_counter() - start))
+    finally:
+        if hasattr(encoder, "close"):
+            encoder.close()
+    return {
+        "workers": workers,
+        "cores_per_worker": [len(c) for c in plan_core_sets(workers)] if workers > 1 else len(available_cores()),
+        "startup_s": startup_s,
+        "chunks_per_s": float(np.median(rates)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure embedding throughput for several worker counts.")
+    parser.add_argument("--corpus", default="data/processed_chunks/all_chunks_fa.jsonl")
+    parser.add_argument("--chunks", type=int, default=2048, help="Chunks encoded per measurement")
+    parser.add_argument("--workers", default="1,2,4,8", help="Comma-separated worker counts")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--output", default="data/retriever/embedding_benchmark.json")
+    args = parser.parse_args()
+
+    texts = load_texts(args.corpus, args.chunks)
+    n_cores = len(available_cores())
+    counts = [w for w in (int(x) for x in args.workers.split(",")) if w <= n_cores]
+
+    results = []
+    print(f"{EMBED_MODEL}, {len(texts)} chunks, {n_cores} cores")
+    print(f"{'workers':>7} {'startup s':>10} {'chunks/s':>10} {'speedup':>8}")
+    for workers in counts:
+        row = run(texts, workers, args.batch_size)
+        row["speedup"] = row["chunks_per_s"] / results[0]["chunks_per_s"] if results else 1.0
+        results.append(row)
+        print(f"{workers:>7} {row['startup_s']:>10.1f} {row['chunks_per_s']:>10.1f} {row['speedup']:>7.2f}x")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"model": EMBED_MODEL, "chunks": len(texts), "cores": n_cores, "results": results}, f, indent=2)
+    print(f"📊 Benchmark saved: {args.output}")
@@ -0,0 +1,109 @@
+#benchmark_kv_cache.py
+# --- Speed, memory and answer drift of quantized KV caches and flash attention ---
+import os, sys, gc, json, argparse, difflib
+import numpy as np
+import psutil
+
+# --- Make the project root importable when run as a script ---
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chatbot.chatbot_core import TherapyChatbot
+from benchmark_speculative import QUESTIONS
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Settings compared against the f16 baseline (the first entry)
+SETTINGS = {
+    "f16": {"type_k": "f16", "type_v": "f16", "flash_attn": False},
+    "f16+fa": {"type_k": "f16", "type_v": "f16", "flash_attn": True},
+    "q8_0+fa": {"type_k": "q8_0", "type_v": "q8_0", "flash_attn": True},
+    "q4_0+fa": {"type_k": "q4_0", "type_v": "q4_0", "flash_attn": True},
+    "q8_0/q4_0+fa": {"type_k": "q8_0", "type_v": "q4_0", "flash_attn": True},
+}
+
+
+def run(model_paths, model, kv_cache, questions, args):
+    """Answer every question greedily (after a warm-up); return answers, stats and memory."""
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    chatbot = TherapyChatbot(
+        model_paths={model: model_paths[model]},  # Only the measured model is loaded
+        faiss_index_path_fa=os.path.join(args.data_dir, "faiss_index_fa.bin"),
+        faiss_meta_path_fa=os.path.join(args.data_dir, "faiss_meta_fa.json"),
+        n_ctx=args.n_ctx,
+        n_gpu_layers=args.n_gpu_layers,
+        n_threads=args.n_threads,
+        prefix_cache_mb=0,        # Every request prefills its whole prompt
+        kv_cache={model: kv_cache},
+    )
+    chatbot.switch_model(model)  # Sets the prompt language of the model
+
+    rows = []
+    for i, question in enumerate([questions[0]] + questions):
+        chatbot.reset_history()
+        answer = "".join(chatbot.ask_stream(question, max_tokens=args.max_tokens, temperature=0.0))
+        if i > 0:  # The first question is a warm-up
+            rows.append(dict(chatbot.last_generation_stats, question=question, answer=answer))
+
+    memory = {
+        "kv_bytes": chatbot.kv_cache_report()[model]["kv_bytes"],
+        "rss_bytes": process.memory_info().rss - rss_before,
+    }
+    del chatbot
+    gc.collect()
+    return rows, memory
+
+
+def similarity(a: str, b: str) -> float:
+    """Word-level similarity of two answers (1.0 = identical)."""
+    return difflib.SequenceMatcher(None, a.split(), b.split()).ratio()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare KV cache types and flash attention on a fixed prompt set.")
+    parser.add_argument("--model", default="dorna", choices=["dorna", "zephyr"])
+    parser.add_argument("--model-dir", default=os.path.join(BASE_DIR, "models"))
+    parser.add_argument("--data-dir", default=os.path.join(BASE_DIR, "data", "retriever"))
+    parser.add_argument("--settings", nargs="*", default=list(SETTINGS), choices=list(SETTINGS))
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--n-ctx", type=int, default=4096)
+    parser.add_argument("--n-gpu-layers", type=int, default=28)
+    parser.add_argument("--n-threads", type=int, default=6)
+    parser.add_argument("--output", default="data/benchmarks/kv_cache.json")
+    args = parser.parse_args()
+
+    model_paths = {
+        "dorna": os.path.join(args.model_dir, "dorna-llama3-8b-instruct.Q4_K_M.gguf"),
+        "zephyr": os.path.join(args.model_dir, "zephyr-7b-beta.Q4_K_M.gguf"),
+    }
+    questions = QUESTIONS["fa" if args.model == "dorna" else "en"]
+    labels = ["f16"] + [label for label in args.settings if label != "f16"]
+
+    results = {}
+    for label in labels:
+        rows, memory = run(model_paths, args.model, SETTINGS[label], questions, args)
+        baseline = results["f16"]["requests"] if results else rows
+        # Greedy decoding: any difference from the f16 answers comes from the cache precision
+        same = [r["answer"] == b["answer"] for r, b in zip(rows, baseline)]
+        results[label] = {
+            "settings": SETTINGS[label],
+            "summary": {
+                "decode_tokens_per_s": float(np.median([r["decode_tokens_per_s"] for r in rows])),
+                "tokens_per_s": float(np.median([r["tokens_per_s"] for r in rows])),
+                "ttft_s": float(np.median([r["ttft_s"] for r in rows])),
+                "kv_mb": memory["kv_bytes"] / 2**20,
+                "rss_mb": memory["rss_bytes"] / 2**20,
+                "identical_answers": sum(same) / len(same),
+                "answer_similarity": float(np.mean([similarity(r["answer"], b["answer"])
+                                                    for r, b in zip(rows, baseline)])),
+            },
+            "requests": rows,
+        }
+        s = results[label]["summary"]
+        print(f"{label:<14} decode {s['decode_tokens_per_s']:6.1f} tok/s  first token {s['ttft_s']:5.2f}s  "
+              f"KV {s['kv_mb']:7.1f} MB  RSS {s['rss_mb']:7.1f} MB  "
+              f"identical {s['identical_answers']:.0%}  similarity {s['answer_similarity']:.2f}")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"model": args.model, "n_ctx": args.n_ctx, **results}, f, ensure_ascii=False, indent=2)
+    print(f"📊 Benchmark saved: {args.output}")
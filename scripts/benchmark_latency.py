@@ -0,0 +1,204 @@
+#benchmark_latency.py
+# --- Where time goes in ask(): per-stage p50/p95/p99, time to first token and tokens/sec ---
+import os, sys, gc, json, time, argparse, platform, subprocess, tempfile
+from functools import partial
+import numpy as np
+
+# --- Make the project root importable when run as a script ---
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chatbot.chatbot_core import TherapyChatbot
+from chatbot.retrieval_cache import RetrievalCache
+from benchmark_speculative import QUESTIONS
+from fake_backend import FakeEmbedder, FakeLlama, build_synthetic_corpus, write_fake_gguf
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = ["language", "model", "embedding", "search", "prompt", "prefill", "decode", "total"]
+PERCENTILES = (50, 95, 99)
+
+
+def git_commit() -> str:
+    """Commit of the working tree, so result files can be compared across commits."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def make_chatbot(args, work_dir):
+    """TherapyChatbot on the fake backend and synthetic corpus, or on the real files."""
+    options = dict(n_ctx=args.n_ctx, prefix_cache_mb=0, route_by_language=args.route,
+                   use_tuned_profiles=not args.fake, history_summary_tokens=args.summary_tokens)
+    if args.fake:
+        embedder = FakeEmbedder(encode_ms=args.encode_ms)
+        paths = build_synthetic_corpus(os.path.join(work_dir, "retriever"), embedder, n_chunks=args.chunks)
+        model_paths = {name: write_fake_gguf(os.path.join(work_dir, f"{name}.gguf")) for name in ("dorna", "zephyr")}
+        llm_class = partial(FakeLlama, prefill_tok_s=args.prefill_tok_s, decode_tok_s=args.decode_tok_s,
+                            answer_tokens=args.answer_tokens)
+        return TherapyChatbot(model_paths=model_paths, embed_model=embedder, llm_class=llm_class,
+                              **paths, **options)
+
+    model_paths = {
+        "dorna": os.path.join(args.model_dir, "dorna-llama3-8b-instruct.Q4_K_M.gguf"),
+        "zephyr": os.path.join(args.model_dir, "zephyr-7b-beta.Q4_K_M.gguf"),
+    }
+    return TherapyChatbot(
+        model_paths=model_paths,
+        faiss_index_path_fa=os.path.join(args.data_dir, "faiss_index_fa.bin"),
+        faiss_meta_path_fa=os.path.join(args.data_dir, "faiss_meta_fa.json"),
+        n_gpu_layers=args.n_gpu_layers, n_threads=args.n_threads, **options)
+
+
+def run_path(chatbot, questions, args):
+    """
+    Stream `args.requests` answers (after warm-ups) and collect stage times per request.
+    With --conversation the questions are turns of one conversation instead of fresh ones.
+    """
+    rows = []
+    chatbot.reset_history()
+    for i in range(args.warmup + args.requests):
+        question = questions[i % len(questions)]
+        if args.conversation:
+            if chatbot.summarizer is not None:
+                chatbot.summarizer.wait()  # A user takes longer to type than a fold takes
+        else:
+            chatbot.reset_history()
+        if not args.warm_cache:
+            chatbot.retrieval_cache = RetrievalCache()  # Every request embeds and searches
+        chatbot.last_prompt_usage = {}  # An answer-cache hit builds no prompt
+        start = time.perf_counter()
+        for _ in chatbot.ask_stream(question, max_tokens=args.max_tokens, temperature=0.0):
+            pass
+        total = time.perf_counter() - start
+        if i >= args.warmup:
+            stats = chatbot.last_generation_stats
+            rows.append({
+                "question": question,
+                "model": stats["model"],
+                "stages": dict(chatbot.last_stage_times, total=total),
+                "ttft_s": stats.get("ttft_s", 0.0),
+                "tokens": stats["tokens"],
+                "prompt_tokens": chatbot.last_prompt_usage.get("prompt", 0),
+                "tokens_per_s": stats["tokens_per_s"],
+                "decode_tokens_per_s": stats.get("decode_tokens_per_s", 0.0),
+            })
+    return rows
+
+
+def summarize(rows) -> dict:
+    """Percentiles (ms) per stage plus TTFT and throughput over the requests."""
+    def pct(values):
+        return {f"p{p}": float(np.percentile(values, p)) * 1000 for p in PERCENTILES}
+
+    stages = {}
+    for stage in STAGES:
+        values = [r["stages"][stage] for r in rows if stage in r["stages"]]
+        if values:
+            stages[stage] = pct(values)
+    return {
+        "requests": len(rows),
+        "model": rows[0]["model"] if rows else None,
+        "stages_ms": stages,
+        "ttft_ms": pct([r["ttft_s"] for r in rows]),
+        "prompt_tokens": [r["prompt_tokens"] for r in rows],
+        "tokens_per_s": float(np.median([r["tokens_per_s"] for r in rows])),
+        "decode_tokens_per_s": float(np.median([r["decode_tokens_per_s"] for r in rows])),
+    }
+
+
+def print_summary(lang, summary):
+    print(f"\n[{lang}] {summary['requests']} requests on {summary['model']}: "
+          f"TTFT p50 {summary['ttft_ms']['p50']:.0f} ms, {summary['tokens_per_s']:.1f} tok/s "
+          f"(decode {summary['decode_tokens_per_s']:.1f})")
+    tokens = summary["prompt_tokens"]
+    if tokens:
+        print(f"  prompt tokens per turn: first {tokens[0]}, last {tokens[-1]}, max {max(tokens)}")
+    print(f"  {'stage':<10}" + "".join(f"{f'p{p} ms':>11}" for p in PERCENTILES))
+    for stage, values in summary["stages_ms"].items():
+        print(f"  {stage:<10}" + "".join(f"{values[f'p{p}']:11.2f}" for p in PERCENTILES))
+
+
+def compare(report, baseline_path):
+    """Print the p50/p95 change of every stage against an earlier result file."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nChange vs {baseline.get('commit', '?')} ({baseline_path}):")
+    for lang, result in report["results"].items():
+        old = baseline.get("results", {}).get(lang)
+        if not old:
+            continue
+        for stage, values in result["summary"]["stages_ms"].items():
+            before = old["summary"]["stages_ms"].get(stage)
+            if not before:
+                continue
+            deltas = "  ".join(f"p{p} {(values[f'p{p}'] / max(before[f'p{p}'], 1e-9) - 1):+7.1%}" for p in (50, 95))
+            print(f"  [{lang}] {stage:<10} {deltas}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Per-stage latency of TherapyChatbot for the fa and en paths. Uses the real "
+                    "models and indexes when they exist, otherwise (or with --fake) a fake backend.")
+    parser.add_argument("--fake", action="store_true", help="Use the fake backend even if the real files exist")
+    parser.add_argument("--model-dir", default=os.path.join(BASE_DIR, "models"))
+    parser.add_argument("--data-dir", default=os.path.join(BASE_DIR, "data", "retriever"))
+    parser.add_argument("--languages", nargs="*", default=["fa", "en"], choices=["fa", "en"])
+    parser.add_argument("--requests", type=int, default=30, help="Measured requests per language")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--max-tokens", type=int, default=150)
+    parser.add_argument("--n-ctx", type=int, default=4096)
+    parser.add_argument("--n-gpu-layers", type=int, default=28)
+    parser.add_argument("--n-threads", type=int, default=6)
+    parser.add_argument("--no-route", dest="route", action="store_false",
+                        help="Answer every language with dorna instead of routing en to zephyr")
+    parser.add_argument("--warm-cache", action="store_true", help="Keep the retrieval cache between requests")
+    parser.add_argument("--conversation", action="store_true",
+                        help="Ask the questions as one long conversation (history and its summary grow)")
+    parser.add_argument("--summary-tokens", type=int, default=768,
+                        help="History size that triggers summarization (0 disables)")
+    # Fake backend
+    parser.add_argument("--prefill-tok-s", type=float, default=400.0)
+    parser.add_argument("--decode-tok-s", type=float, default=25.0)
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--encode-ms", type=float, default=5.0)
+    parser.add_argument("--chunks", type=int, default=2000, help="Synthetic chunks per language")
+    parser.add_argument("--output", default="data/benchmarks/latency.json")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    args = parser.parse_args()
+
+    real_files = [os.path.join(args.model_dir, "dorna-llama3-8b-instruct.Q4_K_M.gguf"),
+                  os.path.join(args.data_dir, "faiss_index_fa.bin")]
+    if args.route and "en" in args.languages:
+        real_files.append(os.path.join(args.model_dir, "zephyr-7b-beta.Q4_K_M.gguf"))
+    if not args.fake and not all(os.path.exists(path) for path in real_files):
+        print("ℹ️  Model or index files not found; using the fake backend.")
+        args.fake = True
+
+    os.environ.setdefault("TERM_UI", "0")  # No startup banners between measurements
+    with tempfile.TemporaryDirectory() as work_dir:
+        chatbot = make_chatbot(args, work_dir)
+        chatbot.switch_model("dorna")
+
+        results = {}
+        for lang in args.languages:
+            rows = run_path(chatbot, QUESTIONS[lang], args)
+            results[lang] = {"summary": summarize(rows), "requests": rows}
+            print_summary(lang, results[lang]["summary"])
+        del chatbot
+        gc.collect()
+
+    report = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "mode": "fake" if args.fake else "real",
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n📊 Benchmark saved: {args.output}")
+    if args.compare:
+        compare(report, args.compare)
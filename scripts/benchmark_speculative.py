@@ -0,0 +1,114 @@
+#benchmark_speculative.py
+# --- Decode throughput with and without prompt-lookup speculative decoding ---
+import os, sys, gc, json, argparse
+import numpy as np
+
+# --- Make the project root importable when run as a script ---
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chatbot.chatbot_core import TherapyChatbot
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Fixed question set: answers to these usually quote the retrieved chunks
+QUESTIONS = {
+    "fa": [
+        "چطور می‌توانم اضطرابم را قبل از امتحان کنترل کنم؟",
+        "وقتی شب‌ها خوابم نمی‌برد چه کار کنم؟",
+        "نشانه‌های افسردگی چیست؟",
+        "چگونه با استرس کاری کنار بیایم؟",
+        "تمرین تنفس برای آرامش را توضیح بده.",
+        "چطور با خانواده‌ام درباره احساساتم صحبت کنم؟",
+    ],
+    "en": [
+        "How can I manage anxiety before an exam?",
+        "What should I do when I cannot fall asleep at night?",
+        "What are the signs of depression?",
+        "How do I cope with stress at work?",
+        "Explain a breathing exercise for relaxation.",
+        "How can I talk to my family about my feelings?",
+    ],
+}
+
+
+def run(model_paths, model, speculative, questions, args):
+    """Ask every question once (after a warm-up) and collect the per-request stats."""
+    chatbot = TherapyChatbot(
+        model_paths={model: model_paths[model]},  # Only the measured model is loaded
+        faiss_index_path_fa=os.path.join(args.data_dir, "faiss_index_fa.bin"),
+        faiss_meta_path_fa=os.path.join(args.data_dir, "faiss_meta_fa.json"),
+        n_ctx=args.n_ctx,
+        n_gpu_layers=args.n_gpu_layers,
+        n_threads=args.n_threads,
+        prefix_cache_mb=0,        # Measure decoding, not prefix reuse
+        speculative={model: speculative},
+    )
+    chatbot.switch_model(model)  # Sets the prompt language of the model
+
+    rows = []
+    for i, question in enumerate([questions[0]] + questions):
+        chatbot.reset_history()
+        # Consume the stream so time to first token and decode speed are separated
+        for _ in chatbot.ask_stream(question, max_tokens=args.max_tokens, temperature=0.0):
+            pass
+        if i > 0:  # The first question is a warm-up
+            rows.append(dict(chatbot.last_generation_stats, question=question))
+
+    del chatbot
+    gc.collect()
+    return rows
+
+
+def summarize(rows):
+    decode = [r["decode_tokens_per_s"] for r in rows]
+    summary = {
+        "tokens": int(sum(r["tokens"] for r in rows)),
+        "decode_tokens_per_s": float(np.median(decode)),
+        "tokens_per_s": float(np.median([r["tokens_per_s"] for r in rows])),
+        "ttft_s": float(np.median([r["ttft_s"] for r in rows])),
+    }
+    if rows and "drafted" in rows[0]:
+        drafted = sum(r["drafted"] for r in rows)
+        summary["acceptance_rate"] = sum(r["accepted"] for r in rows) / drafted if drafted else 0.0
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare decoding with and without prompt-lookup drafting.")
+    parser.add_argument("--model", default="dorna", choices=["dorna", "zephyr"])
+    parser.add_argument("--model-dir", default=os.path.join(BASE_DIR, "models"))
+    parser.add_argument("--data-dir", default=os.path.join(BASE_DIR, "data", "retriever"))
+    parser.add_argument("--num-pred-tokens", type=int, default=10)
+    parser.add_argument("--max-ngram-size", type=int, default=3)
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--n-ctx", type=int, default=4096)
+    parser.add_argument("--n-gpu-layers", type=int, default=28)
+    parser.add_argument("--n-threads", type=int, default=6)
+    parser.add_argument("--output", default="data/benchmarks/speculative.json")
+    args = parser.parse_args()
+
+    model_paths = {
+        "dorna": os.path.join(args.model_dir, "dorna-llama3-8b-instruct.Q4_K_M.gguf"),
+        "zephyr": os.path.join(args.model_dir, "zephyr-7b-beta.Q4_K_M.gguf"),
+    }
+    questions = QUESTIONS["fa" if args.model == "dorna" else "en"]
+    draft = {"num_pred_tokens": args.num_pred_tokens, "max_ngram_size": args.max_ngram_size}
+
+    results = {}
+    for label, speculative in (("baseline", False), ("prompt_lookup", draft)):
+        rows = run(model_paths, args.model, speculative, questions, args)
+        results[label] = {"summary": summarize(rows), "requests": rows}
+        s = results[label]["summary"]
+        line = f"{label:<14} decode {s['decode_tokens_per_s']:6.1f} tok/s  first token {s['ttft_s']:5.2f}s"
+        if "acceptance_rate" in s:
+            line += f"  acceptance {s['acceptance_rate']:.0%}"
+        print(line)
+
+    speedup = (results["prompt_lookup"]["summary"]["decode_tokens_per_s"]
+               / max(results["baseline"]["summary"]["decode_tokens_per_s"], 1e-9))
+    print(f"Decode speedup: {speedup:.2f}x")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"model": args.model, "draft": draft, "speedup": speedup, **results},
+                  f, ensure_ascii=False, indent=2)
+    print(f"📊 Benchmark saved: {args.output}")
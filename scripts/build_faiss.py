@@ -1,62 +1,297 @@
 #build_faiss.py
 # --- Required Libraries ---
-import os, json
+import os, sys, json, argparse, itertools
 import numpy as np
 import faiss
 from sentence_transformers import SentenceTransformer
 
+# --- Make the project root importable when run as a script ---
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chatbot.chunk_store import ChunkStoreWriter
+from chatbot.bm25 import BM25Builder
+from chatbot.vector_store import EmbeddingStore, content_key, vector_store_path
+from scripts.parallel_embed import ParallelEncoder
+from scripts.index_specs import (INDEX_SPECS, DEFAULT_PCA_DIM, create_index, compare_index_specs,
+                                 format_report, supports_removal)
+
 # Embedding model used to encode text chunks into vectors
 EMBED_MODEL = "all-MiniLM-L6-v2"
 
-def build_index(jsonl_path, index_path, meta_path):
+def iter_chunks(jsonl_path):
+    """Yield (byte offset, chunk) for every chunk of a JSONL file, one at a time."""
+    with open(jsonl_path, "rb") as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                yield offset, json.loads(line)
+            offset += len(line)
+
+
+def read_chunk(f, offset):
+    """Read the chunk that starts at `offset` of an open JSONL file."""
+    f.seek(offset)
+    return json.loads(f.readline())
+
+
+def batched(iterable, size):
+    """Split an iterable into lists of at most `size` items."""
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def load_encoder(workers=1):
+    """In-process SentenceTransformer, or a pool of pinned worker processes when workers > 1."""
+    if workers > 1:
+        return ParallelEncoder(EMBED_MODEL, workers)
+    return SentenceTransformer(EMBED_MODEL)
+
+
+def embed_corpus(jsonl_path, store, pairs_path, batch_size=256, workers=1):
+    """
+    Make sure every chunk of the corpus has a vector in the embedding store.
+    Only chunks whose normalized text is not stored yet are encoded (in batches);
+    the embedder is not even loaded when nothing changed. Every batch is committed
+    to the store, so an interrupted run resumes where it stopped.
+    With workers > 1, each batch of batch_size * workers chunks is split across
+    worker processes and merged back in order.
+    The (store row, byte offset of the chunk) pairs of each batch are appended to
+    `pairs_path` as int64, so memory does not grow with the corpus (see row_offsets).
+    """
+    model = None
+    n_chunks = n_new = 0
+    pairs = open(pairs_path, "wb")
+    try:
+        for batch in batched(iter_chunks(jsonl_path), batch_size * workers):
+            keys = np.array([content_key(chunk["content"]) for _, chunk in batch], dtype=np.uint64)
+            rows = store.rows(keys)
+
+            # Texts not embedded before (duplicates within the batch are encoded once)
+            missing = {}
+            for key, row, (_, chunk) in zip(keys.tolist(), rows.tolist(), batch):
+                if row < 0 and key not in missing:
+                    missing[key] = chunk["content"]
+            if missing:
+                if model is None:
+                    model = load_encoder(workers)
+                embeddings = model.encode(list(missing.values()), convert_to_numpy=True)
+                store.add(list(missing), embeddings)
+                n_new += len(missing)
+                rows = store.rows(keys)
+
+            offsets = np.array([offset for offset, _ in batch], dtype=np.int64)
+            np.column_stack([rows, offsets]).tofile(pairs)
+            n_chunks += len(batch)
+            print(f"  {n_chunks} chunks read, {n_new} embedded", end="\r")
+    finally:
+        pairs.close()
+        if isinstance(model, ParallelEncoder):
+            model.close()
+    print()
+
+
+def row_offsets(pairs_path, offsets_path, n_rows, batch_size=65536):
+    """
+    Memory-mapped array of the byte offset of each store row's chunk (-1 for rows of
+    chunks no longer in the corpus), built from the pairs embed_corpus spilled.
+    Identical texts share one row; the first chunk keeps its metadata.
+    """
+    if not n_rows:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.lib.format.open_memmap(offsets_path, mode="w+", dtype=np.int64, shape=(n_rows,))
+    offsets[:] = -1
+    if os.path.getsize(pairs_path):
+        pairs = np.memmap(pairs_path, dtype=np.int64, mode="r").reshape(-1, 2)
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            rows, first = np.unique(batch[:, 0], return_index=True)
+            unset = offsets[rows] < 0
+            offsets[rows[unset]] = batch[first[unset], 1]
+        del pairs
+    return offsets
+
+
+def sample_ids(ids, size, seed=0):
+    """Random sample of ids (all of them when there are fewer than `size`)."""
+    if len(ids) <= size:
+        return ids
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(ids, size, replace=False))
+
+
+def with_ids(index):
+    """Let the index take explicit ids (IVF has them natively, the others get an ID map)."""
+    if faiss.try_extract_index_ivf(index) is not None:
+        return index
+    return faiss.IndexIDMap2(index)
+
+
+def update_index(index_path, store, live_ids, index_spec, pca_dim, train_size, batch_size, rebuild=False):
+    """
+    Bring the FAISS index in line with the live embedding-store rows.
+    If the existing index has the same settings, rows that left the corpus are removed
+    with remove_ids and new rows are added; otherwise the index is rebuilt from the
+    stored vectors. FAISS ids are embedding-store rows in both cases.
+    """
+    state_path = index_path + ".state.json"
+    ids_path = os.path.splitext(index_path)[0] + ".ids.npy"
+    settings = {"index_spec": index_spec, "pca_dim": pca_dim, "embed_model": EMBED_MODEL}
+
+    index = None
+    if not rebuild and os.path.exists(state_path) and os.path.exists(ids_path) and os.path.exists(index_path):
+        with open(state_path, encoding="utf-8") as f:
+            if json.load(f) == settings:
+                index = faiss.read_index(index_path)
+                if not supports_removal(index):
+                    index = None
+
+    vectors = store.vectors
+    if index is not None:
+        old_ids = np.load(ids_path)
+        removed = np.setdiff1d(old_ids, live_ids)
+        added = np.setdiff1d(live_ids, old_ids)
+        if len(removed):
+            index.remove_ids(removed.astype("int64"))
+        print(f"  index updated: {len(added)} added, {len(removed)} removed")
+    else:
+        train = np.ascontiguousarray(vectors[sample_ids(live_ids, train_size)])
+        index = with_ids(create_index(index_spec, train, len(live_ids), pca_dim))
+        added = live_ids
+        print(f"  index rebuilt from {len(added)} stored vectors")
+
+    # Add in slices so memory does not grow with the corpus
+    step = batch_size * 16
+    for begin in range(0, len(added), step):
+        ids = added[begin:begin + step]
+        index.add_with_ids(np.ascontiguousarray(vectors[ids]), ids.astype("int64"))
+
+    faiss.write_index(index, index_path)
+    np.save(ids_path, live_ids)
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump(settings, f)
+
+
+def build_index(jsonl_path, index_path, meta_path, index_spec="flat", compare_specs=None,
+                train_size=50_000, pca_dim=DEFAULT_PCA_DIM, batch_size=256, rebuild=False, reembed=False,
+                workers=1):
+    """
+    Embed the chunks of a JSONL file and write the FAISS index, metadata, chunk store and BM25 index.
+
+    Embeddings are kept in an append-only store keyed by a hash of the normalized
+    chunk text (<index>.vectors.*), so a rerun embeds only new or edited chunks and an
+    interrupted run resumes after the last stored batch. FAISS ids are store rows:
+    chunks removed from the corpus are removed from the index and leave empty slots
+    in the metadata.
+
+    index_spec picks the index type (see INDEX_SPECS or any faiss.index_factory string);
+    types that need training are trained on a sample of `train_size` vectors.
+    workers > 1 encodes in that many pinned worker processes (see parallel_embed.py).
+    Changing index_spec, or rebuild=True, rebuilds the index from the stored vectors without
+    the embedder; reembed=True discards the stored vectors first.
+    Compressed types (SQ8, fp16, PCA, PQ) re-score their top candidates exactly from
+    the stored vectors in the chatbot.
+    With compare_specs, each candidate is also measured against the flat baseline
+    and a report is written next to the index.
+    """
     # Create directory for FAISS index if it doesn't exist
     os.makedirs(os.path.dirname(index_path), exist_ok=True)
 
-    # Load the sentence transformer model
-    model = SentenceTransformer(EMBED_MODEL)
+    store = EmbeddingStore(os.path.splitext(vector_store_path(index_path))[0], EMBED_MODEL)
+    if reembed:
+        store.reset()
+    prefix = os.path.splitext(meta_path)[0]
+    embed_corpus(jsonl_path, store, prefix + ".pairs.tmp", batch_size, workers)
+    offsets = row_offsets(prefix + ".pairs.tmp", prefix + ".offsets.tmp", len(store))
+    live_ids = np.flatnonzero(offsets >= 0).astype(np.int64)
 
-    texts, metas = [], []
+    update_index(index_path, store, live_ids, index_spec, pca_dim, train_size, batch_size,
+                 rebuild=rebuild or reembed)
 
-    # Read JSONL file line by line and extract text + metadata
-    with open(jsonl_path, encoding="utf-8") as f:
-        for line in f:
-            chunk = json.loads(line)
-            texts.append(chunk["content"])  # The actual text content
-            metas.append({
-                "chunk_id": chunk["chunk_id"],
-                "source": chunk.get("source", "")  # Optional source info
-            })
-
-    # Generate embeddings (vectors) for all text chunks
-    embeddings = model.encode(texts, convert_to_numpy=True)
-
-    # Create a FAISS index using L2 (Euclidean) distance
-    dim = embeddings.shape[1]  # Vector dimension
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)  # Add all vectors to the index
-
-    # Save FAISS index to disk
-    faiss.write_index(index, index_path)
+    # Metadata, chunk store and BM25 (same ids as the FAISS index) are laid out by row;
+    # rows of chunks no longer in the corpus stay as empty placeholders. Rows are not
+    # in corpus order after edits, so they are written in a second pass over the
+    # row -> offset map, each as soon as its chunk is read
+    chunks = ChunkStoreWriter(prefix)
+    bm25 = BM25Builder(prefix + ".bm25")
+    with open(jsonl_path, "rb") as src, open(meta_path, "w", encoding="utf-8") as mf:
+        mf.write("[")
+        for row in range(len(store)):
+            if offsets[row] >= 0:
+                chunk = read_chunk(src, int(offsets[row]))
+                chunks.append(chunk["content"], chunk["chunk_id"], chunk.get("source", ""))
+                bm25.add(chunk["content"])
+                meta = {"chunk_id": chunk["chunk_id"], "source": chunk.get("source", "")}
+            else:
+                chunks.append("", None)
+                bm25.skip()
+                meta = {"chunk_id": None, "source": ""}
+            mf.write(",\n  " if row else "\n  ")
+            json.dump(meta, mf, ensure_ascii=False)
+        mf.write("\n]\n")
+    chunks.close()
+    bm25.save()
+    del offsets
+    for path in (prefix + ".pairs.tmp", prefix + ".offsets.tmp"):
+        if os.path.exists(path):
+            os.remove(path)
 
-    # Save associated metadata to a JSON file
-    with open(meta_path, "w", encoding="utf-8") as mf:
-        json.dump(metas, mf, ensure_ascii=False, indent=2)
+    print(f"✅ FAISS index created: {index_path} ({index_spec}, {len(live_ids)} chunks)")
 
-    print(f"✅ FAISS index created: {index_path}")
+    # Optional recall/latency/size comparison of candidate index types
+    if compare_specs:
+        embeddings = np.ascontiguousarray(store.vectors[live_ids])
+        report = compare_index_specs(embeddings, compare_specs, train_size=train_size, pca_dim=pca_dim)
+        report_path = os.path.splitext(index_path)[0] + ".report.json"
+        with open(report_path, "w", encoding="utf-8") as rf:
+            json.dump({"n_vectors": len(embeddings), "dim": int(embeddings.shape[1]),
+                       "candidates": report}, rf, indent=2)
+        print(format_report(report))
+        print(f"📊 Index comparison saved: {report_path}")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build FAISS indexes for the Persian and English chunks.")
+    parser.add_argument("--index-spec", default="flat",
+                        help=f"Index type: {', '.join(INDEX_SPECS)} or a faiss.index_factory string")
+    parser.add_argument("--compare", default="",
+                        help="Comma-separated index types to compare against the flat baseline")
+    parser.add_argument("--pca-dim", type=int, default=DEFAULT_PCA_DIM,
+                        help="Target dimension of the pca-* index types")
+    parser.add_argument("--batch-size", type=int, default=256,
+                        help="Chunks encoded per batch")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Embedding worker processes, each pinned to its own cores")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Rebuild the index from the stored vectors instead of updating it")
+    parser.add_argument("--reembed", action="store_true",
+                        help="Discard the stored vectors and embed every chunk again")
+    args = parser.parse_args()
+    compare = [spec for spec in args.compare.split(",") if spec]
+
     # Build FAISS index for Persian chunks
     build_index(
       "data/processed_chunks/all_chunks_fa.jsonl",     # Input data
       "data/retriever/faiss_index_fa.bin",             # FAISS index output
-      "data/retriever/faiss_meta_fa.json"              # Metadata output
+      "data/retriever/faiss_meta_fa.json",             # Metadata output
+      index_spec=args.index_spec,
+      compare_specs=compare,
+      pca_dim=args.pca_dim,
+      batch_size=args.batch_size,
+      rebuild=args.rebuild,
+      reembed=args.reembed,
+      workers=args.workers
     )
 
     # Build FAISS index for English chunks
     build_index(
       "data/processed_chunks/all_chunks_en.jsonl",
       "data/retriever/faiss_index_en.bin",
-      "data/retriever/faiss_meta_en.json"
+      "data/retriever/faiss_meta_en.json",
+      index_spec=args.index_spec,
+      compare_specs=compare,
+      pca_dim=args.pca_dim,
+      batch_size=args.batch_size,
+      rebuild=args.rebuild,
+      reembed=args.reembed,
+      workers=args.workers
     )
-
@@ -0,0 +1,158 @@
+#fake_backend.py
+# --- Deterministic stand-ins for llama_cpp.Llama and SentenceTransformer, plus a synthetic corpus ---
+import os, re, sys, time, json
+import numpy as np
+import faiss
+import xxhash
+
+# --- Make the project root importable when run as a script ---
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chatbot import model_info  # noqa: F401  (puts the vendored gguf-py on sys.path)
+from gguf import GGUFWriter
+
+_WORD = re.compile(r"\w+|[^\w\s]")
+
+# Vocabulary of the synthetic corpus per language
+WORDS = {
+    "fa": ("اضطراب استرس خواب افسردگی تنفس آرامش خانواده احساس فکر نگرانی تمرین "
+           "درمان رفتار ذهن بدن کار امتحان ترس خشم امید شادی گفتگو روز شب").split(),
+    "en": ("anxiety stress sleep depression breathing calm family feeling thought worry exercise "
+           "therapy behavior mind body work exam fear anger hope joy conversation day night").split(),
+}
+
+
+def _seed(text: str) -> int:
+    return xxhash.xxh32_intdigest(text.encode("utf-8"))
+
+
+class FakeLlama:
+    """
+    Llama-compatible model with a fixed prefill and decode speed.
+    Tokens are words and punctuation; the answer is a deterministic function of
+    the prompt, so runs are repeatable. Only the parts TherapyChatbot uses exist.
+    """
+
+    def __init__(self, model_path: str, n_ctx: int = 4096, prefill_tok_s: float = 400.0,
+                 decode_tok_s: float = 25.0, answer_tokens: int = 120, **kwargs):
+        self.model_path = model_path
+        self._n_ctx = n_ctx
+        self.prefill_tok_s = prefill_tok_s
+        self.decode_tok_s = decode_tok_s
+        self.answer_tokens = answer_tokens
+        self.n_tokens = 0
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def set_cache(self, cache):
+        pass
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> list:
+        tokens = [_seed(word) % 32000 for word in _WORD.findall(text.decode("utf-8", errors="ignore"))]
+        return ([1] if add_bos else []) + tokens
+
+    def _generate(self, prompt: str, max_tokens: int):
+        """Sleep for the prefill, then yield one word per decode step."""
+        n_prompt = len(self.tokenize(prompt.encode("utf-8")))
+        time.sleep(n_prompt / self.prefill_tok_s)
+        self.n_tokens = n_prompt
+        words = _WORD.findall(prompt) or ["..."]
+        rng = np.random.default_rng(_seed(prompt))
+        for i in range(min(max_tokens or self.answer_tokens, self.answer_tokens)):
+            time.sleep(1 / self.decode_tok_s)
+            self.n_tokens += 1
+            yield ("" if i == 0 else " ") + words[rng.integers(len(words))]
+
+    def _finish_reason(self, max_tokens: int) -> str:
+        return "length" if max_tokens and max_tokens < self.answer_tokens else "stop"
+
+    def __call__(self, prompt: str, max_tokens: int = 16, stream: bool = False, **kwargs):
+        pieces = self._generate(prompt, max_tokens)
+        reason = self._finish_reason(max_tokens)
+        if stream:
+            def chunks():
+                for piece in pieces:
+                    yield {"choices": [{"text": piece, "finish_reason": None}]}
+                yield {"choices": [{"text": "", "finish_reason": reason}]}
+            return chunks()
+        return {"choices": [{"text": "".join(pieces), "finish_reason": reason}]}
+
+    def create_chat_completion(self, messages: list, max_tokens: int = None, stream: bool = False, **kwargs):
+        prompt = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        pieces = self._generate(prompt, max_tokens)
+        reason = self._finish_reason(max_tokens)
+        if stream:
+            def chunks():
+                yield {"choices": [{"delta": {"role": "assistant"}, "finish_reason": None}]}
+                for piece in pieces:
+                    yield {"choices": [{"delta": {"content": piece}, "finish_reason": None}]}
+                yield {"choices": [{"delta": {}, "finish_reason": reason}]}
+            return chunks()
+        return {"choices": [{"message": {"role": "assistant", "content": "".join(pieces)}, "finish_reason": reason}]}
+
+
+class FakeEmbedder:
+    """
+    Bag-of-words encoder with a fixed random vector per word: texts sharing words
+    land close together, so retrieval over the synthetic corpus is meaningful.
+    """
+
+    def __init__(self, dim: int = 384, encode_ms: float = 5.0):
+        self.dim = dim
+        self.encode_ms = encode_ms  # Simulated model latency per call
+        self._vectors = {}
+
+    def _word_vector(self, word: str) -> np.ndarray:
+        if word not in self._vectors:
+            self._vectors[word] = np.random.default_rng(_seed(word)).standard_normal(self.dim).astype("float32")
+        return self._vectors[word]
+
+    def encode(self, texts, convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        time.sleep(self.encode_ms / 1000)
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for row, text in enumerate(texts):
+            for word in _WORD.findall(text.lower()):
+                out[row] += self._word_vector(word)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-9)
+
+
+def write_fake_gguf(path: str, n_layer: int = 32, n_ctx_train: int = 8192, n_embd: int = 4096,
+                    n_head: int = 32, n_head_kv: int = 8):
+    """Header-only GGUF with a llama architecture, so memory planning runs on fake models."""
+    writer = GGUFWriter(path, "llama")
+    writer.add_name(os.path.splitext(os.path.basename(path))[0])
+    writer.add_block_count(n_layer)
+    writer.add_context_length(n_ctx_train)
+    writer.add_embedding_length(n_embd)
+    writer.add_feed_forward_length(int(n_embd * 3.5))
+    writer.add_head_count(n_head)
+    writer.add_head_count_kv(n_head_kv)
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+    return path
+
+
+def build_synthetic_corpus(out_dir: str, embedder: FakeEmbedder, n_chunks: int = 2000,
+                           words_per_chunk: int = 60, seed: int = 0) -> dict:
+    """
+    Write a Flat FAISS index and JSON metadata per language (faiss_index_{lang}.bin,
+    faiss_meta_{lang}.json) in the layout TherapyChatbot loads. Returns the fa paths.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for lang, words in WORDS.items():
+        chunks = [" ".join(rng.choice(words, words_per_chunk)) for _ in range(n_chunks)]
+        vectors = np.vstack([embedder.encode(chunks[i:i + 256]) for i in range(0, n_chunks, 256)])
+        index = faiss.IndexFlatIP(embedder.dim)
+        index.add(vectors)
+        faiss.write_index(index, os.path.join(out_dir, f"faiss_index_{lang}.bin"))
+        meta = [{"chunk_id": f"{lang}-{i}", "content": text, "source": "synthetic"} for i, text in enumerate(chunks)]
+        with open(os.path.join(out_dir, f"faiss_meta_{lang}.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+    return {
+        "faiss_index_path_fa": os.path.join(out_dir, "faiss_index_fa.bin"),
+        "faiss_meta_path_fa": os.path.join(out_dir, "faiss_meta_fa.json"),
+    }
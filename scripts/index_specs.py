@@ -0,0 +1,193 @@
+# index_specs.py
+# --- FAISS index types for build_faiss.py and a recall/latency comparison ---
+import math
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from chatbot.vector_store import VectorStore, is_exact_index
+
+# Short names for the supported index types; {nlist}, {m} and {pca} are filled from the corpus
+INDEX_SPECS = {
+    "flat": "Flat",                     # Exact brute-force scan (baseline)
+    "ivf-flat": "IVF{nlist},Flat",       # Inverted lists, exact vectors
+    "ivf-pq": "IVF{nlist},PQ{m}",        # Inverted lists, product-quantized vectors
+    "hnsw": "HNSW32",                   # Graph index, no training needed
+    "sq8": "SQ8",                       # 8-bit scalar quantization (4x smaller)
+    "fp16": "SQfp16",                   # Half-precision floats (2x smaller)
+    "pca-sq8": "PCA{pca},SQ8",          # PCA to {pca} dims, then 8-bit (~4*dim/pca x smaller)
+    "pca-fp16": "PCA{pca},SQfp16",      # PCA to {pca} dims, then half precision
+}
+
+# Target dimension of the PCA pre-transform (a third of MiniLM's 384)
+DEFAULT_PCA_DIM = 128
+
+# Candidates fetched per result when re-scoring from the float store
+DEFAULT_RESCORE_FACTOR = 4
+
+# Search-time defaults, stored inside the index file so the chatbot needs no settings
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+
+
+def resolve_index_spec(spec: str, dim: int, n_vectors: int, pca_dim: int = DEFAULT_PCA_DIM) -> str:
+    """Turn a short name (or a raw faiss.index_factory string) into a factory string."""
+    factory = INDEX_SPECS.get(spec.lower(), spec)
+    # ~4*sqrt(n) lists, but keep >= 39 training points per list as FAISS recommends
+    nlist = max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+    # PQ sub-quantizers must divide the dimension; aim for 8 dims per code byte
+    m = next(m for m in range(max(1, dim // 8), 0, -1) if dim % m == 0)
+    return factory.format(nlist=nlist, m=m, pca=min(pca_dim, dim))
+
+
+def create_index(spec: str, train_vectors: np.ndarray, n_vectors: int, pca_dim: int = DEFAULT_PCA_DIM):
+    """Create an empty index of the given type, trained on a sample if the type needs it."""
+    dim = train_vectors.shape[1]
+    index = faiss.index_factory(dim, resolve_index_spec(spec, dim, n_vectors, pca_dim), faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(train_vectors, dtype="float32"))
+    set_search_defaults(index)
+    return index
+
+
+def set_search_defaults(index):
+    """Set nprobe / efSearch on whichever part of the index has them."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(DEFAULT_NPROBE, ivf.nlist)
+    base = faiss.downcast_index(index.index) if hasattr(index, "index") else index
+    for candidate in (index, base):
+        if hasattr(candidate, "hnsw"):
+            candidate.hnsw.efSearch = DEFAULT_EF_SEARCH
+
+
+def supports_removal(index) -> bool:
+    """
+    False when the index is, or wraps, an HNSW graph: HNSW cannot delete vectors,
+    so such indexes are rebuilt from stored vectors instead of updated. Looks
+    through ID maps, pre-transforms (PCA) and refinement wrappers.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return False
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexPreTransform)):
+        return supports_removal(index.index)
+    if isinstance(index, faiss.IndexRefine):
+        return supports_removal(index.base_index)
+    return True
+
+
+def sample_rows(vectors: np.ndarray, size: int, seed: int = 0) -> np.ndarray:
+    """Random sample of rows (all rows when there are fewer than `size`)."""
+    if len(vectors) <= size:
+        return vectors
+    rng = np.random.default_rng(seed)
+    return vectors[np.sort(rng.choice(len(vectors), size, replace=False))]
+
+
+def index_bytes(index) -> int:
+    """Size of the index as written to disk."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.bin")
+        faiss.write_index(index, path)
+        return os.path.getsize(path)
+
+
+def _recall(found: list, truth: np.ndarray) -> float:
+    hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(truth)))
+    return hits / truth.size if truth.size else 1.0
+
+
+def evaluate_index(index, baseline, queries: np.ndarray, k: int = 10, vectors: VectorStore = None,
+                   rescore_factor: int = DEFAULT_RESCORE_FACTOR) -> dict:
+    """
+    Recall@k against the exact baseline plus per-query latency and size on disk.
+    With a float vector store, recall and latency are also measured with
+    k * rescore_factor candidates re-scored exactly.
+    """
+    _, truth = baseline.search(queries, k)
+
+    latencies, found = [], []
+    rescored_latencies, rescored = [], []
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, I = index.search(queries[i:i + 1], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(I[0].tolist())
+
+        if vectors is not None:
+            start = time.perf_counter()
+            _, I = index.search(queries[i:i + 1], k * rescore_factor)
+            rescored.append(vectors.rescore(queries[i], I[0].tolist(), k))
+            rescored_latencies.append((time.perf_counter() - start) * 1000)
+
+    result = {
+        "recall_at_k": _recall(found, truth),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "bytes": index_bytes(index),
+    }
+    if vectors is not None:
+        result.update({
+            "rescored_recall_at_k": _recall(rescored, truth),
+            "rescored_p50_ms": float(np.percentile(rescored_latencies, 50)),
+            "rescored_p99_ms": float(np.percentile(rescored_latencies, 99)),
+        })
+    return result
+
+
+def compare_index_specs(embeddings: np.ndarray, specs, k: int = 10, n_queries: int = 200,
+                        train_size: int = 50_000, pca_dim: int = DEFAULT_PCA_DIM,
+                        rescore_factor: int = DEFAULT_RESCORE_FACTOR) -> list:
+    """
+    Build each candidate index on the same vectors and compare it with the flat baseline.
+    Queries are corpus vectors with a little noise, so they are near but not on a stored point.
+    Compressed types are also measured with exact re-scoring from the float vectors.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    rng = np.random.default_rng(0)
+    queries = sample_rows(embeddings, n_queries, seed=1)
+    queries = queries + rng.normal(0, queries.std() * 0.05, queries.shape).astype("float32")
+
+    baseline = faiss.IndexFlatL2(embeddings.shape[1])
+    baseline.add(embeddings)
+    train = sample_rows(embeddings, train_size)
+    flat_bytes = embeddings.nbytes
+
+    # Re-scoring reads the same rows VectorStore would map from disk
+    vectors = VectorStore(embeddings)
+
+    report = []
+    for spec in specs:
+        start = time.perf_counter()
+        index = create_index(spec, train, len(embeddings), pca_dim)
+        index.add(embeddings)
+        row = {
+            "spec": spec,
+            "factory": resolve_index_spec(spec, embeddings.shape[1], len(embeddings), pca_dim),
+            "build_s": time.perf_counter() - start,
+        }
+        row.update(evaluate_index(index, baseline, queries, k,
+                                  vectors=None if is_exact_index(index) else vectors,
+                                  rescore_factor=rescore_factor))
+        row["compression"] = flat_bytes / row["bytes"] if row["bytes"] else 0.0
+        report.append(row)
+    return report
+
+
+def format_report(report: list, k: int = 10) -> str:
+    """Plain-text table of a compare_index_specs() report."""
+    lines = [f"{'spec':<10} {'factory':<22} {'recall@' + str(k):>9} {'rescored':>9} "
+             f"{'p50 ms':>8} {'p99 ms':>8} {'MB':>8} {'ratio':>6}"]
+    for row in report:
+        rescored = row.get("rescored_recall_at_k")
+        lines.append(
+            f"{row['spec']:<10} {row['factory']:<22} {row['recall_at_k']:>9.3f} "
+            f"{'-' if rescored is None else format(rescored, '.3f'):>9} "
+            f"{row['p50_ms']:>8.3f} {row['p99_ms']:>8.3f} {row['bytes'] / 2 ** 20:>8.2f} "
+            f"{row['compression']:>5.1f}x"
+        )
+    return "\n".join(lines)
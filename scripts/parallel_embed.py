@@ -0,0 +1,121 @@
+# parallel_embed.py
+# --- Sentence embedding across several worker processes, each pinned to its own cores ---
+import multiprocessing as mp
+import os
+
+import numpy as np
+
+
+def available_cores():
+    """CPU cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_core_sets(workers, cores=None):
+    """
+    Split the cores into `workers` disjoint, contiguous sets of (almost) equal size.
+    With more workers than cores, cores are shared round-robin.
+    """
+    cores = list(cores if cores is not None else available_cores())
+    if workers >= len(cores):
+        return [[cores[i % len(cores)]] for i in range(workers)]
+    size, extra = divmod(len(cores), workers)
+    sets, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        sets.append(cores[start:end])
+        start = end
+    return sets
+
+
+def _worker(worker_id, model_name, cores, tasks, results):
+    """Worker loop: pin to `cores`, match torch threads to them, encode shards until None arrives."""
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+        threads = str(len(cores))
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            os.environ[var] = threads
+
+        import torch
+        torch.set_num_threads(len(cores))
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name, device="cpu")
+    except Exception as e:
+        results.put((worker_id, None, f"worker {worker_id} failed to start: {e}"))
+        return
+    results.put((worker_id, None, None))  # Ready
+
+    while (task := tasks.get()) is not None:
+        seq, texts = task
+        try:
+            results.put((worker_id, seq, model.encode(texts, convert_to_numpy=True)))
+        except Exception as e:
+            results.put((worker_id, seq, f"worker {worker_id}: {e}"))
+
+
+class ParallelEncoder:
+    """
+    Drop-in replacement for SentenceTransformer.encode() that splits each call
+    into one shard per worker process and merges the vectors back in input order.
+
+    Workers are started with the "spawn" method (torch is not fork-safe), each with
+    its own SentenceTransformer, pinned to a disjoint set of cores with torch
+    intra-op threads limited to the size of that set.
+    """
+
+    def __init__(self, model_name, workers, cores=None):
+        self.workers = workers
+        self.core_sets = plan_core_sets(workers, cores)
+        ctx = mp.get_context("spawn")
+        self._results = ctx.Queue()
+        self._tasks = [ctx.Queue() for _ in range(workers)]
+        self._procs = [
+            ctx.Process(target=_worker, args=(i, model_name, self.core_sets[i], self._tasks[i], self._results),
+                        daemon=True, name=f"embed-{i}")
+            for i in range(workers)
+        ]
+        for proc in self._procs:
+            proc.start()
+
+        # Wait until every worker has loaded its model
+        for _ in range(workers):
+            _, _, error = self._results.get()
+            if error:
+                self.close()
+                raise RuntimeError(error)
+
+    def encode(self, texts, convert_to_numpy=True):
+        """Embed `texts` on all workers; rows come back in the order of `texts`."""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        shards = np.array_split(np.arange(len(texts)), min(self.workers, len(texts)))
+        for seq, shard in enumerate(shards):
+            self._tasks[seq].put((seq, [texts[i] for i in shard]))
+
+        parts = {}
+        while len(parts) < len(shards):
+            _, seq, result = self._results.get()
+            if isinstance(result, str):
+                raise RuntimeError(result)
+            parts[seq] = result
+        return np.concatenate([parts[seq] for seq in range(len(shards))])
+
+    def close(self):
+        """Stop the worker processes."""
+        for tasks in self._tasks:
+            tasks.put(None)
+        for proc in self._procs:
+            proc.join(timeout=10)
+            if proc.is_alive():
+                proc.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,37 @@
+# tests/test_index_specs.py
+import os
+import sys
+
+import faiss
+import numpy as np
+import pytest
+
+# --- Make the project root importable when run from anywhere ---
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.index_specs import create_index, supports_removal
+
+DIM = 32
+
+
+def built_index(spec, tmp_path):
+    """An index of `spec` as update_index finds it: ID-mapped, written and read back."""
+    vectors = np.random.default_rng(0).standard_normal((500, DIM)).astype("float32")
+    index = create_index(spec, vectors, len(vectors), pca_dim=16)
+    if faiss.try_extract_index_ivf(index) is None:
+        index = faiss.IndexIDMap2(index)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype="int64"))
+    path = str(tmp_path / "index.bin")
+    faiss.write_index(index, path)
+    return faiss.read_index(path)
+
+
+@pytest.mark.parametrize("spec", ["hnsw", "PCA{pca},HNSW32", "PCA16,HNSW32,Refine(Flat)"])
+def test_hnsw_is_rebuilt_not_updated(spec, tmp_path):
+    assert not supports_removal(built_index(spec, tmp_path))
+
+
+@pytest.mark.parametrize("spec", ["flat", "ivf-flat", "sq8", "pca-sq8"])
+def test_other_indexes_remove_in_place(spec, tmp_path):
+    index = built_index(spec, tmp_path)
+    assert supports_removal(index)
+    assert index.remove_ids(np.arange(10, dtype="int64")) == 10
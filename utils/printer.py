@@ -1,5 +1,6 @@
 # Import necessary modules from rich for styled console output
 from rich.console import Console
+from rich.live import Live
 from rich.panel import Panel
 from rich.text import Text
 
@@ -40,6 +41,10 @@ def print_warning(message):
 
 # Display chatbot's response in a styled panel
 def print_bot_panel(answer):
+    console.print(_bot_panel(answer))
+
+# Build the bot panel for a (possibly partial) answer
+def _bot_panel(answer):
     if current_lang == "fa":
         # Reshape and display RTL Persian text
         reshaped = arabic_reshaper.reshape(answer)
@@ -50,14 +55,22 @@ def print_bot_panel(answer):
         prefix = "[🤖 Bot]: "
         title = "Bot"
 
-    panel = Panel.fit(
+    return Panel.fit(
         Text(prefix, style="bold blue") + Text(answer, style="white"),
         border_style="cyan",
         title=title,
         title_align="left"
     )
-    console.print(panel)
 
+# Display chatbot's response in a panel that grows as tokens arrive
+def print_bot_stream(tokens):
+    answer = ""
+    with Live(_bot_panel(answer), console=console, refresh_per_second=12) as live:
+        for token in tokens:
+            answer += token
+            # Re-shape the whole text each time so RTL joins stay correct
+            live.update(_bot_panel(answer))
+    return answer.strip()
 
 # Display user's message in a styled panel
 def print_user_panel(message):
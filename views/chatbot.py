@@ -1,5 +1,6 @@
 #views/chatbot.py
 import os
+import uuid
 from chatbot.chatbot_core import TherapyChatbot
 import streamlit as st
 
@@ -45,12 +46,29 @@ texts = {
 }
 
 
+# --- One chatbot (models, embedder, FAISS) shared by every browser session ---
+@st.cache_resource(show_spinner=False)
+def get_chatbot():
+    return TherapyChatbot(
+        model_paths=model_paths,
+        faiss_index_path_fa=os.path.join(DATA_DIR, "faiss_index_fa.bin"),
+        faiss_meta_path_fa=os.path.join(DATA_DIR, "faiss_meta_fa.json"),
+        n_ctx=4096,
+        n_gpu_layers=28,
+        n_threads=6,
+        model_ram_budget_gb=12.0,  # Keep both models resident for all users
+        conversation_db=os.path.join(BASE_DIR, "..", "data", "conversations.db")
+    )
+
+
 # --- Initialize session state variables if not set ---
 if "selected_model" not in st.session_state:
     st.session_state.selected_model = "dorna"
 
-if "models" not in st.session_state:
-    st.session_state.models = {}
+if "session_id" not in st.session_state:
+    # Identifies this browser tab; kept in the URL (?chat=...) so a reload resumes the conversation
+    st.session_state.session_id = st.query_params.get("chat") or uuid.uuid4().hex
+    st.query_params["chat"] = st.session_state.session_id
 
 # --- Temporary language used for displaying the model select box ---
 tmp_language = "fa" if st.session_state.selected_model == "dorna" else "en"
@@ -73,48 +91,32 @@ txt = texts[language]
 st.set_page_config(page_title="Therapy Chatbot", page_icon="💬")
 st.title(txt["title"])
 
+# --- Load the shared chatbot and make sure the selected model is resident ---
+try:
+    chatbot = get_chatbot()
+    if not chatbot.pool.is_loaded(selected_model):
+        with st.spinner(txt["model_loading"].format(selected_model)):
+            chatbot.pool.get(selected_model)
+        st.success(txt["model_loaded"].format(selected_model))
+except Exception as e:
+    st.error(txt["model_load_error"].format(selected_model, e))
+    st.stop()
+
+# --- Per-tab conversation state inside the shared chatbot (one per model) ---
+session_id = f"{st.session_state.session_id}-{selected_model}"
+
 # --- Load or initialize chat message history for the selected model ---
+# A resumed conversation reads only its newest messages from the store
 msg_key = f"messages_{selected_model}"
 if msg_key not in st.session_state:
-    st.session_state[msg_key] = []
-
-# --- If the user switched models, unload the previous one ---
-if selected_model != st.session_state.selected_model:
-    old_model = st.session_state.selected_model
-    if old_model in st.session_state.models:
-        try:
-            del st.session_state.models[old_model]
-            import gc
-            gc.collect() # Explicitly free up GPU/CPU memory
-        except Exception as e:
-            st.warning(txt["free_model_error"].format(e))
-    st.session_state.selected_model = selected_model
+    st.session_state[msg_key] = chatbot.conversations.last_turns(session_id, 200)
+st.session_state.selected_model = selected_model
 
 # --- Load messages for current model session ---
 messages = st.session_state[msg_key]
-
-# --- Load the selected model if not already loaded ---
-if selected_model not in st.session_state.models:
-    with st.spinner(txt["model_loading"].format(selected_model)):
-        try:
-            st.session_state.models[selected_model] = TherapyChatbot(
-                model_paths={selected_model: model_paths[selected_model]},
-                faiss_index_path_fa=os.path.join(DATA_DIR, "faiss_index_fa.bin"),
-                faiss_meta_path_fa=os.path.join(DATA_DIR, "faiss_meta_fa.json"),
-                n_ctx=4096,
-                n_gpu_layers=28,
-                n_threads=6
-            )
-            st.success(txt["model_loaded"].format(selected_model))
-        except Exception as e:
-            st.error(txt["model_load_error"].format(selected_model, e))
-            st.stop()
-
-# --- Retrieve the active chatbot instance ---
-chatbot = st.session_state.models.get(selected_model)
-if chatbot is None:
-    st.error(txt["model_not_loaded"].format(selected_model))
-    st.stop()
+chat_session = chatbot.sessions.get(session_id)
+chat_session.model = selected_model
+chat_session.language = language
 
 # --- Display chat history messages ---
 for message in messages:
@@ -128,20 +130,18 @@ if prompt := st.chat_input(txt["input_placeholder"]):
     with st.chat_message("user"):
         st.markdown(prompt)
     
-        # Generate assistant reply
+        # Generate assistant reply, writing tokens as they arrive
     with st.chat_message("assistant"):
-        with st.spinner(txt["loading"]):
-            try:
-                chatbot.language = language
-                response = chatbot.ask(
-                    question=prompt,
-                    max_tokens=512,
-                    temperature=0.3
-                )
-                st.markdown(response)
-            except Exception as e:
-                st.error(f"❌ {txt['error_response']}")
-                response = txt["error_response"]
+        try:
+            response = st.write_stream(chatbot.ask_stream(
+                question=prompt,
+                max_tokens=512,
+                temperature=0.3,
+                session_id=session_id
+            )).strip()
+        except Exception as e:
+            st.error(f"❌ {txt['error_response']}")
+            response = txt["error_response"]
 
 
             # Append assistant message